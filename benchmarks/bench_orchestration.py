@@ -0,0 +1,157 @@
+# End-to-end overhead of executing specs, against the fake Docker daemon (see fake_docker.py)
+#
+# Containers do no work there, so the time measured is mnb's own: planning, Docker API calls, stdio streaming and
+# output placement. Every scenario runs in a fresh process, so that peak RSS is its own.
+#   chain    pull, build, then a chain of file copies, each action depending on the previous one
+#   fanout   many independent actions, each streaming a small file through stdin to a stdout output file
+#   payload  few actions streaming big files through stdin and stdout
+#   host     the fan-out, run by the host backend (real cat processes, the daemon is not used)
+#   fused    the chain, with fusion of actions (scripts are run by the host shell, see fake_docker.py)
+#   tmpfs    the chain, every action with a tmpfs scratch dir (run as an exec instance, output copied out of it)
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fake_docker import start_fake_docker
+
+CHAIN_LENGTH = 100
+FANOUT_WIDTH = 200
+PAYLOAD_ACTIONS = 4
+PAYLOAD_SIZE = 64 * 1024 * 1024
+JOBS = [1, 8]
+IMAGE = "bench/runner:latest"
+TMPFS_SIZE = 64 * 1024 * 1024
+
+
+def chain_spec(workspace: Path):
+    from spec import Spec
+    (workspace / "image").mkdir()
+    (workspace / "image" / "Dockerfile").write_text("FROM scratch\n")
+    (workspace / "chain").mkdir()
+    (workspace / "chain" / "0.txt").write_text("chain start\n")
+    s = Spec(spec_version=(1, 0))
+    s.pull_image(IMAGE)
+    built = s.build_image("bench/built:latest", context_path="image")
+    for i in range(CHAIN_LENGTH):
+        s.exec(built, command=["cp", "in.txt", "out.txt"]) \
+            .input(file=f"chain/{i}.txt", through_file="in.txt") \
+            .output(file=f"chain/{i + 1}.txt", through_file="out.txt")
+    return s, 0
+
+
+def fanout_spec(workspace: Path):
+    from spec import Spec
+    (workspace / "in.txt").write_text("fan out\n" * 100)
+    s = Spec(spec_version=(1, 0))
+    image = s.pull_image(IMAGE)
+    for i in range(FANOUT_WIDTH):
+        s.exec(image, command=["cat"]) \
+            .input(file="in.txt", through_stdin=True) \
+            .output(file=f"out/{i}.txt", through_stdout=True)
+    return s, 0
+
+
+def payload_spec(workspace: Path):
+    from spec import Spec
+    with open(workspace / "big.bin", "wb") as f:
+        f.truncate(PAYLOAD_SIZE)
+    s = Spec(spec_version=(1, 0))
+    image = s.pull_image(IMAGE)
+    for i in range(PAYLOAD_ACTIONS):
+        s.exec(image, command=["cat"]) \
+            .input(file="big.bin", through_stdin=True) \
+            .output(file=f"out/{i}.bin", through_stdout=True)
+    # stdin and stdout of every action
+    return s, 2 * PAYLOAD_ACTIONS * PAYLOAD_SIZE
+
+
+def host_spec(workspace: Path):
+    from spec import Settings, BACKEND_HOST
+    (s, payload_bytes) = fanout_spec(workspace)
+    s.settings = Settings(backends={IMAGE: BACKEND_HOST})
+    return s, payload_bytes
+
+
+def tmpfs_spec(workspace: Path):
+    from spec import Exec
+    (s, payload_bytes) = chain_spec(workspace)
+    for action in s.actions:
+        if isinstance(action, Exec):
+            action.tmpfs_size = TMPFS_SIZE
+    return s, payload_bytes
+
+
+SCENARIOS = {"chain": chain_spec, "fanout": fanout_spec, "payload": payload_spec, "host": host_spec,
+             "fused": chain_spec, "tmpfs": tmpfs_spec}
+
+
+def run_scenario(name: str, jobs: int):
+    """Executed in a child process, prints measurements as JSON"""
+    from common import CommandLineOptions
+    from spec import Settings
+    import executor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workspace = Path(tmp)
+        (s, payload_bytes) = SCENARIOS[name](workspace)
+        cliopts = CommandLineOptions()
+        cliopts.rootabspath = str(workspace)
+        cliopts.dev_mode = True
+        cliopts.windows_host = False
+        cliopts.subcommand = "update"
+        cliopts.jobs = jobs
+        cliopts.no_cache = True
+        cliopts.fuse = name == "fused"
+        real_stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        context = executor.Context(cliopts)
+        context.settings = s.settings or Settings()
+        try:
+            started = time.perf_counter()
+            executor.execute_spec(s, context)
+            elapsed = time.perf_counter() - started
+        finally:
+            context.close()
+            sys.stdout = real_stdout
+    json.dump({
+        "actions": len(s.actions),
+        "elapsed": elapsed,
+        "payload_bytes": payload_bytes,
+        # kilobytes on Linux
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }, sys.stdout)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = Path(tmp) / "docker.sock"
+        daemon = start_fake_docker(socket_path)
+        try:
+            env = dict(os.environ, DOCKER_HOST=f"unix://{socket_path}")
+            print(f"{'scenario':>8} {'jobs':>4} {'actions':>7} {'wall':>8} {'ms/action':>9} {'actions/s':>9} "
+                  f"{'MB/s':>7} {'peak RSS MB':>11}")
+            for name in SCENARIOS:
+                for jobs in JOBS:
+                    output = subprocess.run([sys.executable, __file__, "--scenario", name, str(jobs)],
+                                            env=env, check=True, capture_output=True, text=True).stdout
+                    result = json.loads(output)
+                    elapsed = result["elapsed"]
+                    throughput = result["payload_bytes"] / elapsed / 2**20 if result["payload_bytes"] else 0
+                    print(f"{name:>8} {jobs:>4} {result['actions']:>7} {elapsed:>7.2f}s "
+                          f"{1000 * elapsed / result['actions']:>9.2f} {result['actions'] / elapsed:>9.1f} "
+                          f"{throughput:>7.0f} {result['peak_rss'] / 2**20:>11.1f}")
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--scenario":
+        run_scenario(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,47 @@
+# Memory taken by the spec object model, and toposort_actions time, for synthetic specs of growing size
+#
+# Specs look like the generated ones: a chain of per-file conversions, with every intermediate file consumed by
+# the next action, and a final action consuming the whole output dir.
+import gc
+import time
+import tracemalloc
+
+from spec import *
+from plan import toposort_actions
+
+ACTION_COUNTS = [1000, 10000, 100000]
+CHAIN_LENGTH = 4
+
+
+def generate_spec(action_count: int) -> Spec:
+    s = Spec(spec_version=(1, 0))
+    image = s.pull_image("foo")
+    for i in range(action_count // CHAIN_LENGTH):
+        for step in range(CHAIN_LENGTH):
+            # paths are built anew for every action, as a parser would do
+            s.exec(image, command=["convert", f"in.{step}", f"out.{step}"], workdir="/work") \
+                .input(file=f"work/{i}/{step}.txt", through_file="in") \
+                .input(file="notes/settings.json", through_file="settings.json") \
+                .output(file=f"work/{i}/{step + 1}.txt", through_file="out") \
+                .output(file=f"logs/{i}/{step}.log", through_stderr=True)
+    s.exec(image, command=["index"]).input(dir="work").output(file="index.txt", through_stdout=True)
+    return s
+
+
+def main():
+    print(f"{'actions':>8} {'model MB':>10} {'bytes/action':>13} {'toposort':>10}")
+    for action_count in ACTION_COUNTS:
+        gc.collect()
+        tracemalloc.start()
+        s = generate_spec(action_count)
+        (size, _) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        started = time.perf_counter()
+        toposort_actions(s)
+        elapsed = time.perf_counter() - started
+        print(f"{len(s.actions):>8} {size / 2**20:>10.1f} {size / len(s.actions):>13.0f} {elapsed:>9.3f}s")
+        del s
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Parse time of big generated specs: jsonschema.validate on every parse vs compiled validator vs validated-hash hit,
+# and peak memory of parsing (validation skipped) with json.loads vs streaming
+import io
+import json
+import time
+import tracemalloc
+
+from jsonschema.validators import validate
+
+import spec_parser
+
+ACTION_COUNTS = [1000, 10000, 100000]
+
+
+def generate_spec(action_count: int) -> bytes:
+    actions = [{"pull_image": {"image_name": "foo"}}]
+    for i in range(action_count - 1):
+        actions.append({"exec": {
+            "image_name": "foo",
+            "command": ["convert", f"in/{i}.dot", f"out/{i}.svg"],
+            "inputs": [{"value": {"file": {"path": f"in/{i}.dot"}}, "through": {"file": {"path": f"in/{i}.dot"}}}],
+            "outputs": [{"value": {"file": {"path": f"out/{i}.svg"}}, "through": {"file": {"path": f"out/{i}.svg"}}}],
+        }})
+    return json.dumps({"spec_version": "1.0", "actions": actions}).encode()
+
+
+def legacy_parse(data: bytes):
+    # the way specs were parsed before: validator built for every document
+    parsed_json = json.loads(data)
+    validate(parsed_json, spec_parser.schema)
+    return spec_parser.build_spec(parsed_json, [spec_parser.parse_action(a) for a in parsed_json["actions"]])
+
+
+def loads_parse(data: bytes):
+    parsed_json = json.loads(data)
+    return spec_parser.build_spec(parsed_json, [spec_parser.parse_action(a) for a in parsed_json["actions"]])
+
+
+def stream_parse(data: bytes):
+    return spec_parser.parse_spec_stream(io.BytesIO(data), validate_document=False)
+
+
+def peak_memory(parse, data):
+    tracemalloc.start()
+    result = parse(data)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak
+
+
+def measure(parse, data):
+    started = time.perf_counter()
+    parse(data)
+    return time.perf_counter() - started
+
+
+def main():
+    print(f"{'actions':>8} {'legacy':>10} {'compiled':>10} {'hash hit':>10}")
+    for action_count in ACTION_COUNTS:
+        data = generate_spec(action_count)
+        spec_parser.enable_validated_specs_memo(None)
+        legacy = measure(legacy_parse, data)
+        compiled = measure(spec_parser.parse_spec_bytes, data)
+        hash_hit = measure(spec_parser.parse_spec_bytes, data)
+        print(f"{action_count:>8} {legacy:>9.3f}s {compiled:>9.3f}s {hash_hit:>9.3f}s")
+    print(f"{'actions':>8} {'raw MB':>10} {'loads MB':>10} {'stream MB':>10}")
+    for action_count in ACTION_COUNTS:
+        data = generate_spec(action_count)
+        loads_peak = peak_memory(loads_parse, data)
+        stream_peak = peak_memory(stream_parse, data)
+        print(f"{action_count:>8} {len(data) / 2**20:>10.1f} {loads_peak / 2**20:>10.1f} {stream_peak / 2**20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
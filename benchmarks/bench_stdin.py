@@ -0,0 +1,83 @@
+# Throughput of feeding files to container stdin: in-memory concatenation with small sends vs chained sendfile
+#
+# Container attach socket is substituted by a unix socket pair, with a thread draining the other end.
+import io
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from streams import ChainedFileSource, socket_sender
+
+FILE_SIZES_MB = [1, 16, 128]
+FILES_PER_INPUT = 2
+
+
+def legacy_send(sock, paths):
+    # the way stdin was fed before: read all files, concatenate, send in 512 byte pieces
+    stdin_data = []
+    for path in paths:
+        with open(path, "rb") as f:
+            stdin_data.append(f.read())
+    stdin_stream = io.BytesIO(b"".join(stdin_data))
+    buffer = b""
+    while True:
+        if len(buffer) == 0:
+            buffer = stdin_stream.read(512)
+            if len(buffer) == 0:
+                break
+        sent = sock.send(buffer)
+        buffer = buffer[sent:]
+    sock.shutdown(socket.SHUT_WR)
+
+
+def chained_send(sock, paths):
+    socket_sender(sock, ChainedFileSource(paths))
+
+
+def drain(sock, received):
+    while chunk := sock.recv(1024 * 1024):
+        received[0] += len(chunk)
+
+
+def measure(send, paths):
+    sender_sock, receiver_sock = socket.socketpair()
+    received = [0]
+    receiver = threading.Thread(target=drain, args=(receiver_sock, received))
+    receiver.start()
+    tracemalloc.start()
+    started = time.perf_counter()
+    send(sender_sock, paths)
+    receiver.join()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    sender_sock.close()
+    receiver_sock.close()
+    return received[0], elapsed, peak
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{'input MB':>10} {'method':>8} {'MB/s':>10} {'peak MB':>10}")
+        for size_mb in FILE_SIZES_MB:
+            paths = []
+            for i in range(FILES_PER_INPUT):
+                path = Path(tmp_dir) / f"input-{size_mb}-{i}"
+                with path.open("wb") as f:
+                    for _ in range(size_mb):
+                        f.write(b"x" * (1024 * 1024))
+                paths.append(path)
+            for name, send in [("legacy", legacy_send), ("chained", chained_send)]:
+                received, elapsed, peak = measure(send, paths)
+                assert received == size_mb * FILES_PER_INPUT * 1024 * 1024, f"{name}: received {received}"
+                total_mb = received / (1024 * 1024)
+                print(f"{total_mb:>10.0f} {name:>8} {total_mb / elapsed:>10.1f} {peak / (1024 * 1024):>10.1f}")
+                sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+# Stand-in for Docker Engine API on a unix socket, to measure mnb's own overhead without a container runtime
+#
+# Implements just enough of the API for executor to run unchanged: version, image inspect/list/pull/build/tag,
+# container create/attach/start/wait/logs/inspect/stop/remove/archive, exec create/start/inspect. Containers do not
+# run anything: commands are interpreted in-process, with bind mounts resolved to host paths (tmpfs mounts are
+# temporary host dirs):
+#   cat              copy stdin to stdout
+#   emit N           write N bytes to stdout
+#   cp SRC DST       copy file (paths inside the container)
+#   mkdir -p DIR     create dir
+#   true             do nothing
+#   /bin/sh -c "kill -9 -1 ..."  warm container reset, does nothing
+# except for scripts given as "/bin/sh -c SCRIPT" entrypoint (fused actions), which are run by the host shell in
+# the host dir mounted as workdir, with nested bind mounts emulated by symlinks. Idle containers (of warm pools and
+# tmpfs runs) keep running until removed, their commands are run as exec instances.
+# Run as a script: python fake_docker.py SOCKET_PATH
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+API_VERSION = "1.44"
+FRAME_HEADER = struct.Struct('>BxxxL')
+STDOUT = 1
+STDERR = 2
+CHUNK_SIZE = 1024 * 1024
+# how long attached stdio waits for the container to be started
+START_TIMEOUT = 30
+# script of the idle entrypoint (see warm_pool.py)
+IDLE_SCRIPT_PREFIX = "trap 'exit 0' TERM;"
+# warm container reset, nothing to kill or clear here
+RESET_SCRIPT_PREFIX = "kill -9 -1"
+
+
+class FakeContainer:
+    def __init__(self, container_id: str, config: dict):
+        self.id = container_id
+        self.image = config.get("Image")
+        self.command: List[str] = (config.get("Entrypoint") or []) + (config.get("Cmd") or [])
+        self.workdir = PurePosixPath(config.get("WorkingDir") or "/")
+        self.tmpfs_dirs: List[str] = list()
+        self.mounts = list()
+        for mount in (config.get("HostConfig") or {}).get("Mounts") or []:
+            if mount.get("Type") == "tmpfs":
+                self.tmpfs_dirs.append(tempfile.mkdtemp(prefix="fake-tmpfs-"))
+                source = self.tmpfs_dirs[-1]
+            else:
+                source = mount["Source"]
+            self.mounts.append((PurePosixPath(mount["Target"]), Path(source)))
+        self.started = threading.Event()
+        self.attached = False
+        self.finished = threading.Event()
+        self.exit_code = 0
+        self.logs: List[bytes] = list()
+
+    def host_path(self, path: str,
+                  exclude_mount: Optional[PurePosixPath] = None,
+                  workdir: Optional[PurePosixPath] = None) -> Path:
+        container_path = PurePosixPath(os.path.normpath((workdir or self.workdir) / path))
+        for (target, source) in sorted(self.mounts, key=lambda mount: len(mount[0].parts), reverse=True):
+            if target != exclude_mount and (container_path == target or target in container_path.parents):
+                return source / container_path.relative_to(target)
+        raise FileNotFoundError(f"{container_path} is not mounted")
+
+    def run_script(self, script: str):
+        """Run a shell script on the host, in the workdir, with mounts nested in other mounts linked into place"""
+        for (target, source) in self.mounts:
+            try:
+                location = self.host_path(str(target), exclude_mount=target)
+            except FileNotFoundError:
+                # not nested
+                continue
+            location.parent.mkdir(parents=True, exist_ok=True)
+            location.unlink(missing_ok=True)
+            location.symlink_to(source)
+        try:
+            result = subprocess.run(["/bin/sh", "-c", script], cwd=self.host_path("."), capture_output=True)
+            self.logs.append(result.stdout + result.stderr)
+            self.exit_code = result.returncode
+        finally:
+            self.finished.set()
+
+    def is_idle(self) -> bool:
+        return self.command[:2] == ["/bin/sh", "-c"] and self.command[2].startswith(IDLE_SCRIPT_PREFIX)
+
+    def run(self, sock: socket.socket):
+        """Interpret the command, reading stdin from and writing output frames to the attached socket"""
+        try:
+            self.exit_code = self.interpret(sock, self.command, self.workdir)
+        finally:
+            self.finished.set()
+
+    def interpret(self, sock: socket.socket, command: List[str], workdir: PurePosixPath) -> int:
+        try:
+            if command == ["cat"]:
+                while chunk := sock.recv(CHUNK_SIZE):
+                    send_frame(sock, STDOUT, chunk)
+                return 0
+            if command[:2] == ["/bin/sh", "-c"] and command[2].startswith(RESET_SCRIPT_PREFIX):
+                # no stdin attached
+                return 0
+            drain(sock)
+            if command == ["true"]:
+                pass
+            elif len(command) == 2 and command[0] == "emit":
+                remaining = int(command[1])
+                chunk = bytes(CHUNK_SIZE)
+                while remaining > 0:
+                    send_frame(sock, STDOUT, chunk[:remaining])
+                    remaining -= min(remaining, CHUNK_SIZE)
+            elif len(command) == 3 and command[0] == "cp":
+                shutil.copyfile(self.host_path(command[1], workdir=workdir),
+                                self.host_path(command[2], workdir=workdir))
+            elif len(command) == 3 and command[:2] == ["mkdir", "-p"]:
+                self.host_path(command[2], workdir=workdir).mkdir(parents=True, exist_ok=True)
+            else:
+                send_frame(sock, STDERR, f"unknown command {command}\n".encode())
+                return 127
+            return 0
+        except OSError as e:
+            send_frame(sock, STDERR, f"{e}\n".encode())
+            return 1
+
+    def remove(self):
+        for tmpfs_dir in self.tmpfs_dirs:
+            shutil.rmtree(tmpfs_dir, ignore_errors=True)
+
+
+class FakeExec:
+    def __init__(self, container: FakeContainer, config: dict):
+        self.container = container
+        self.command: List[str] = config.get("Cmd") or []
+        self.workdir = PurePosixPath(config.get("WorkingDir") or container.workdir)
+        self.finished = threading.Event()
+        self.exit_code = 0
+
+    def run(self, sock: socket.socket):
+        try:
+            self.exit_code = self.container.interpret(sock, self.command, self.workdir)
+        finally:
+            self.finished.set()
+
+
+def send_frame(sock: socket.socket, stream: int, data: bytes):
+    sock.sendall(FRAME_HEADER.pack(stream, len(data)) + data)
+
+
+def drain(sock: socket.socket):
+    while sock.recv(CHUNK_SIZE):
+        pass
+
+
+class FakeDocker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.images: Dict[str, dict] = dict()
+        self.containers: Dict[str, FakeContainer] = dict()
+        self.execs: Dict[str, FakeExec] = dict()
+        self.ids = itertools.count(1)
+
+    def add_image(self, name: str, labels: Optional[dict] = None) -> dict:
+        image_id = "sha256:" + hashlib.sha256(f"{name} {labels}".encode()).hexdigest()
+        if ":" not in name.rsplit("/", 1)[-1]:
+            name += ":latest"
+        attrs = {"Id": image_id, "RepoTags": [name], "Config": {"Labels": labels or {}}}
+        with self.lock:
+            self.images[name] = attrs
+            self.images[image_id] = attrs
+        return attrs
+
+    def find_image(self, name: str) -> Optional[dict]:
+        with self.lock:
+            attrs = self.images.get(name) or self.images.get(name + ":latest")
+            if attrs is None and re.fullmatch("[0-9a-f]{12,64}", name):
+                # short image id
+                attrs = next((attrs for attrs in self.images.values() if attrs["Id"][7:].startswith(name)), None)
+            return attrs
+
+    def create_container(self, config: dict) -> FakeContainer:
+        container = FakeContainer(f"{next(self.ids):064x}", config)
+        with self.lock:
+            self.containers[container.id] = container
+        return container
+
+    def container(self, container_id: str) -> Optional[FakeContainer]:
+        with self.lock:
+            return self.containers.get(container_id)
+
+    def remove_container(self, container_id: str):
+        with self.lock:
+            container = self.containers.pop(container_id, None)
+            self.execs = {exec_id: fake_exec for (exec_id, fake_exec) in self.execs.items()
+                          if fake_exec.container is not container}
+        if container is not None:
+            container.remove()
+
+    def create_exec(self, container: FakeContainer, config: dict) -> str:
+        exec_id = f"{next(self.ids):064x}"
+        with self.lock:
+            self.execs[exec_id] = FakeExec(container, config)
+        return exec_id
+
+    def exec(self, exec_id: str) -> Optional[FakeExec]:
+        with self.lock:
+            return self.execs.get(exec_id)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    docker: FakeDocker
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method: str):
+        url = urlparse(self.path)
+        path = re.sub(r"^/v[0-9.]+", "", url.path)
+        params = {key: values[-1] for (key, values) in parse_qs(url.query).items()}
+        body = self.read_body()
+        for (route_method, pattern, handler) in ROUTES:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                handler(self, params, body, *match.groups())
+                return
+        self.send_json(404, {"message": f"{method} {path} not implemented"})
+
+    def read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b"".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length > 0 else b""
+
+    def send_json(self, status: int, body):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json_stream(self, lines: List[dict]):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for line in lines:
+            data = json.dumps(line).encode() + b"\r\n"
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    #### Routes ####
+
+    def ping(self, params, body):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"OK")
+
+    def version(self, params, body):
+        self.send_json(200, {"ApiVersion": API_VERSION, "Version": "fake", "MinAPIVersion": "1.24"})
+
+    def list_images(self, params, body):
+        with self.docker.lock:
+            images = {attrs["Id"]: attrs for attrs in self.docker.images.values()}
+        self.send_json(200, [{"Id": attrs["Id"], "RepoTags": attrs["RepoTags"]} for attrs in images.values()])
+
+    def inspect_image(self, params, body, name):
+        attrs = self.docker.find_image(name)
+        if attrs is None:
+            self.send_json(404, {"message": f"No such image: {name}"})
+        else:
+            self.send_json(200, attrs)
+
+    def pull_image(self, params, body):
+        name = params["fromImage"] + (":" + params["tag"] if params.get("tag") else "")
+        self.docker.add_image(name)
+        self.send_json_stream([{"status": f"Pulling from {name}"}, {"status": f"Downloaded newer image for {name}"}])
+
+    def build_image(self, params, body):
+        labels = json.loads(params.get("labels") or "{}")
+        attrs = self.docker.add_image(params["t"], labels)
+        self.send_json_stream([{"stream": f"Step 1/1 : context of {len(body)} bytes\n"},
+                               {"aux": {"ID": attrs["Id"]}},
+                               {"stream": f"Successfully built {attrs['Id'][7:19]}\n"}])
+
+    def tag_image(self, params, body, name):
+        attrs = self.docker.find_image(name)
+        self.docker.add_image(params["repo"] + (":" + params["tag"] if params.get("tag") else ""),
+                              attrs["Config"]["Labels"] if attrs else None)
+        self.send_json(201, None)
+
+    def create_container(self, params, body):
+        config = json.loads(body)
+        if self.docker.find_image(config["Image"]) is None:
+            self.send_json(404, {"message": f"No such image: {config['Image']}"})
+            return
+        container = self.docker.create_container(config)
+        self.send_json(201, {"Id": container.id, "Warnings": []})
+
+    def attach_container(self, params, body, container_id):
+        container = self.docker.container(container_id)
+        if container is None:
+            self.send_json(404, {"message": f"No such container: {container_id}"})
+            return
+        container.attached = True
+        sock = self.hijack()
+        if container.started.wait(START_TIMEOUT):
+            container.run(sock)
+        sock.shutdown(socket.SHUT_RDWR)
+
+    def hijack(self) -> socket.socket:
+        """Upgrade the connection: raw stdio streams follow the response headers"""
+        self.send_response(101, "UPGRADED")
+        self.send_header("Content-Type", "application/vnd.docker.multiplexed-stream")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Upgrade", "tcp")
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+        return self.connection
+
+    def start_container(self, params, body, container_id):
+        container = self.docker.container(container_id)
+        if container is None:
+            self.send_json(404, {"message": f"No such container: {container_id}"})
+            return
+        container.started.set()
+        if not container.attached and not container.is_idle():
+            if container.command[:2] == ["/bin/sh", "-c"]:
+                threading.Thread(target=container.run_script, args=(container.command[2],), daemon=True).start()
+            else:
+                container.finished.set()
+        self.send_json(204, None)
+
+    def wait_container(self, params, body, container_id):
+        container = self.docker.container(container_id)
+        if container is None:
+            self.send_json(404, {"message": f"No such container: {container_id}"})
+            return
+        container.finished.wait()
+        self.send_json(200, {"StatusCode": container.exit_code, "Error": None})
+
+    def container_logs(self, params, body, container_id):
+        container = self.docker.container(container_id)
+        if container is None:
+            self.send_json(404, {"message": f"No such container: {container_id}"})
+            return
+        data = b"".join(FRAME_HEADER.pack(STDERR, len(chunk)) + chunk for chunk in container.logs if chunk)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.docker.multiplexed-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def inspect_container(self, params, body, container_id):
+        container = self.docker.container(container_id)
+        if container is None:
+            self.send_json(404, {"message": f"No such container: {container_id}"})
+            return
+        self.send_json(200, {
+            "Id": container.id,
+            "Name": "/" + container.id[:12],
+            "Image": container.image,
+            "Config": {"Cmd": container.command, "WorkingDir": str(container.workdir), "Tty": False},
+            "State": {"Running": container.started.is_set() and not container.finished.is_set(),
+                      "ExitCode": container.exit_code},
+        })
+
+    def stop_container(self, params, body, container_id):
+        self.send_json(204, None)
+
+    def remove_container(self, params, body, container_id):
+        self.docker.remove_container(container_id)
+        self.send_json(204, None)
+
+    def get_archive(self, params, body, container_id):
+        container = self.docker.container(container_id)
+        if container is None:
+            self.send_json(404, {"message": f"No such container: {container_id}"})
+            return
+        try:
+            host_path = container.host_path(params["path"])
+        except FileNotFoundError:
+            host_path = None
+        if host_path is None or not host_path.exists():
+            self.send_json(404, {"message": f"Could not find the file {params['path']} in container"})
+            return
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode="w") as archive:
+            archive.add(host_path, arcname=host_path.name)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-tar")
+        self.send_header("Content-Length", str(len(data.getvalue())))
+        self.end_headers()
+        self.wfile.write(data.getvalue())
+
+    def create_exec(self, params, body, container_id):
+        container = self.docker.container(container_id)
+        if container is None:
+            self.send_json(404, {"message": f"No such container: {container_id}"})
+            return
+        self.send_json(201, {"Id": self.docker.create_exec(container, json.loads(body))})
+
+    def start_exec(self, params, body, exec_id):
+        fake_exec = self.docker.exec(exec_id)
+        if fake_exec is None:
+            self.send_json(404, {"message": f"No such exec instance: {exec_id}"})
+            return
+        sock = self.hijack()
+        fake_exec.run(sock)
+        sock.shutdown(socket.SHUT_RDWR)
+
+    def inspect_exec(self, params, body, exec_id):
+        fake_exec = self.docker.exec(exec_id)
+        if fake_exec is None:
+            self.send_json(404, {"message": f"No such exec instance: {exec_id}"})
+            return
+        self.send_json(200, {"ID": exec_id,
+                             "Running": not fake_exec.finished.is_set(),
+                             "ExitCode": fake_exec.exit_code})
+
+
+ROUTES = [
+    ("GET", r"/_ping", Handler.ping),
+    ("GET", r"/version", Handler.version),
+    ("GET", r"/images/json", Handler.list_images),
+    ("GET", r"/images/(.+)/json", Handler.inspect_image),
+    ("POST", r"/images/create", Handler.pull_image),
+    ("POST", r"/build", Handler.build_image),
+    ("POST", r"/images/(.+)/tag", Handler.tag_image),
+    ("POST", r"/containers/create", Handler.create_container),
+    ("POST", r"/containers/([0-9a-f]+)/attach", Handler.attach_container),
+    ("POST", r"/containers/([0-9a-f]+)/start", Handler.start_container),
+    ("POST", r"/containers/([0-9a-f]+)/wait", Handler.wait_container),
+    ("GET", r"/containers/([0-9a-f]+)/logs", Handler.container_logs),
+    ("GET", r"/containers/([0-9a-f]+)/json", Handler.inspect_container),
+    ("POST", r"/containers/([0-9a-f]+)/stop", Handler.stop_container),
+    ("DELETE", r"/containers/([0-9a-f]+)", Handler.remove_container),
+    ("GET", r"/containers/([0-9a-f]+)/archive", Handler.get_archive),
+    ("POST", r"/containers/([0-9a-f]+)/exec", Handler.create_exec),
+    ("POST", r"/exec/([0-9a-f]+)/start", Handler.start_exec),
+    ("GET", r"/exec/([0-9a-f]+)/json", Handler.inspect_exec),
+]
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str):
+        handler = type("BoundHandler", (Handler,), {"docker": FakeDocker()})
+        super().__init__(socket_path, handler)
+
+
+def start_fake_docker(socket_path: Path) -> subprocess.Popen:
+    """Start the fake daemon in a separate process (so that it does not affect measurements), wait for the socket"""
+    process = subprocess.Popen([sys.executable, __file__, str(socket_path)])
+    deadline = time.monotonic() + 10
+    while not socket_path.exists():
+        if time.monotonic() > deadline or process.poll() is not None:
+            process.kill()
+            raise RuntimeError("fake Docker daemon did not start")
+        time.sleep(0.01)
+    return process
+
+
+if __name__ == "__main__":
+    server = FakeDockerServer(sys.argv[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.unlink(sys.argv[1])
@@ -9,8 +9,8 @@ with Spec(spec_version=(1, 0), description="Run some regular shell commands") as
     # a directory to keep intermediate files
     mnb_generated = PurePosixPath("mnb-generated")
 
-    # pull stock bash image
-    bash_image = s.pull_image("bash:5.2")
+    # pull stock bash image (the tag is pinned, so there is no need to pull it again if it's already present)
+    bash_image = s.pull_image("bash:5.2", pull_policy=PULL_IF_NOT_PRESENT)
 
     my_file = mnb_generated / "my_file.txt"
 
@@ -0,0 +1,84 @@
+# Persistent cache of Exec action results
+#
+# Cache key covers everything the result of an Exec action depends on: image id, the action itself
+# (command, entrypoint, workdir, inputs and outputs mapping), environment and content hashes of all input values.
+# Cache entry records outputs produced by the action, so that it's possible to tell if they were modified
+# or removed since then.
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from errors import UnexpectedValueType
+from hashing import hash_file, hash_dir
+from spec import *
+
+
+class ActionCache:
+    cache_dir: Path
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+
+    def key_for(self, action: Exec, image_id: str, environment: Dict[str, str], root: Path) -> str:
+        key_json = {
+            "image_id": image_id,
+            "action": action_to_json(action),
+            "environment": environment,
+            "inputs": [input_value_hash(inp.value, root) for inp in action.inputs],
+        }
+        return hashlib.sha256(json.dumps(key_json, sort_keys=True).encode()).hexdigest()
+
+    def is_fresh(self, key: str, root: Path) -> bool:
+        """True if there is an entry for the key and all recorded outputs are present and unmodified"""
+        entry = self.load(key)
+        if entry is None:
+            return False
+        for output_path, recorded in entry['outputs'].items():
+            path = root / output_path
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                return False
+            if stat.st_size != recorded['size']:
+                return False
+            if stat.st_mtime_ns != recorded['mtime_ns'] and hash_file(path) != recorded['sha256']:
+                return False
+        return True
+
+    def store(self, key: str, output_paths: List[str], root: Path):
+        outputs = dict()
+        for output_path in output_paths:
+            path = root / output_path
+            stat = path.stat()
+            outputs[output_path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": hash_file(path),
+            }
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        entry_path = self.entry_path(key)
+        tmp_path = entry_path.with_suffix(".tmp")
+        with tmp_path.open('w') as entry_file:
+            json.dump({"key": key, "outputs": outputs}, entry_file)
+        os.replace(tmp_path, entry_path)
+
+    def load(self, key: str) -> Optional[dict]:
+        try:
+            with self.entry_path(key).open('r') as entry_file:
+                return json.load(entry_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+
+def input_value_hash(value: Value, root: Path) -> str:
+    if isinstance(value, File):
+        return hash_file(root / value.path)
+    elif isinstance(value, Dir):
+        return hash_dir(root / value.path)
+    else:
+        raise UnexpectedValueType(value)
@@ -0,0 +1,447 @@
+# Backends running commands of Exec actions
+#
+# Executor prepares everything backend independent (stdio sources and destinations, environment, caching), while
+# a backend gives the command its scratch dir (the /mnb/run of the command) with inputs staged into it, runs the
+# command with stdio streamed from and to files, and leaves output files in the scratch dir for executor to place.
+#   docker   a fresh container per action, inputs are bind-mounted (or, with a warm pool, a long-lived container
+#            per image and concurrent action, inputs are copied)
+#            With fusion (see fusion.py), a chain of small actions runs in a single container.
+#            Actions with tmpfs_size run in a tmpfs at /mnb/run, only their file outputs are copied out of it
+#            (warm containers and the host backend keep the scratch dir on disk).
+#   host     a local process, in a scratch dir with inputs copied into it
+import os
+import shutil
+import subprocess
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path, PurePath, PurePosixPath
+from typing import Callable, ContextManager, Dict, List, Optional
+
+from docker import DockerClient
+from docker.errors import NotFound
+from docker.types import Mount
+
+from errors import MissingHostCommand
+from fusion import FusedExec, step_dir, status_file
+from hashing import MNB_DIR_NAME
+from materialize import materialize, copy_file
+from scratch import ScratchAllocator, ScratchDir
+from streams import ChainedFileSource, FanOutWriter, exchange_stdio, exchange_process_stdio, extract_file
+from tracing import Tracer
+from warm_pool import IDLE_ENTRYPOINT, WarmContainerPool, WarmContainer, exec_command
+from spec import *
+
+MNB_RUN = PurePosixPath("/mnb/run")
+# exit code of a shell for a command not found
+COMMAND_NOT_FOUND = 127
+# size of a single read of stdout/stderr a fused step left in a file
+STATUS_CHUNK_SIZE = 64 * 1024
+
+
+class ExecRun(ABC):
+    """Execution of a single action, scratch_dir is where the command runs and leaves its output files"""
+    scratch_dir: Path
+
+    @abstractmethod
+    def stage_inputs(self, bound_inputs: Dict[str, Input]):
+        """Make input files and dirs available to the command, by their paths relative to the scratch dir"""
+
+    @abstractmethod
+    def run(self,
+            action: Exec,
+            environment: Dict[str, str],
+            stdin_source: ChainedFileSource,
+            stdout_writer: FanOutWriter,
+            stderr_writer: FanOutWriter) -> int:
+        """Run the command until it exits, streaming its stdio; return exit code"""
+
+
+class FusedRun(ABC):
+    """
+    Execution of fused actions by a single shell script (see fused_script), every step in its own dir, where
+    its command leaves output files and the script leaves its stdout, stderr and exit code
+    """
+
+    @abstractmethod
+    def step_dir(self, index: int) -> Path:
+        """Dir the step runs in"""
+
+    @abstractmethod
+    def stage_inputs(self, index: int, bound_inputs: Dict[str, Input]):
+        """Make input files and dirs available to the step, by their paths relative to the step dir"""
+
+    @abstractmethod
+    def argv(self, image_name: str, command: Optional[List[str]]) -> List[str]:
+        """Command line of a step (image entrypoint and default command applied)"""
+
+    @abstractmethod
+    def run(self, image_name: str, script: str) -> int:
+        """Run the script until it exits, return its exit code"""
+
+    @abstractmethod
+    def step_exit_code(self, index: int) -> Optional[int]:
+        """Exit code of a step, None if it did not run"""
+
+    @abstractmethod
+    def step_output(self, index: int, stream: str, writer: FanOutWriter):
+        """Write stdout ("out") or stderr ("err") of a step to the writer"""
+
+    @abstractmethod
+    def logs(self) -> str:
+        """Output of the script itself (e.g. why outputs were not copied between steps)"""
+
+
+class ExecBackend(ABC):
+    # True if the backend runs fused actions (see start_fused)
+    supports_fusion = False
+
+    @abstractmethod
+    def image_id(self, image_name: str) -> str:
+        """Identity of the image, as a part of action cache keys"""
+
+    @abstractmethod
+    def start(self, action: Exec) -> ContextManager[ExecRun]:
+        """Context manager providing a run of the action; resources of the run are released on exit"""
+
+    def start_fused(self, node: FusedExec) -> ContextManager[FusedRun]:
+        """Context manager providing a run of fused actions, only for backends with supports_fusion"""
+        raise NotImplementedError(f"{type(self).__name__} does not run fused actions")
+
+    def close(self):
+        pass
+
+
+class DockerRun(ExecRun):
+    mounts: List[Mount]
+
+    def __init__(self, backend: 'DockerBackend', scratch_dir: ScratchDir):
+        self.backend = backend
+        self.scratch_dir = scratch_dir.path
+        self.scratch_dir_on_host = scratch_dir.path_on_host
+        self.mounts = list()
+
+    def stage_inputs(self, bound_inputs: Dict[str, Input]):
+        self.mounts = [Mount(source=str(self.backend.root_on_host / inp.value.path),
+                             target=str(MNB_RUN / through_path),
+                             type='bind',
+                             read_only=True)
+                       for (through_path, inp) in bound_inputs.items()]
+
+    def run(self, action, environment, stdin_source, stdout_writer, stderr_writer):
+        client = self.backend.get_client()
+        tracer = self.backend.tracer
+        mounts = self.mounts + [Mount(source=str(self.scratch_dir_on_host),
+                                      target=str(MNB_RUN),
+                                      type="bind",
+                                      read_only=False)]
+        # create container, but do not start yet (we need to attach to it first)
+        with tracer.span("create container"):
+            container = client.containers.create(
+                action.image_name,
+                command=action.command,
+                mounts=mounts,
+                environment=environment,
+                working_dir=str(MNB_RUN / (action.workdir or "")),
+                detach=True,
+                # stdin inputs are sent over the attach socket, which is then half-closed (see socket_sender)
+                stdin_open=True)
+        try:
+            # attach to socket
+            with tracer.span("attach and start container"):
+                docker_socket = container.attach_socket(params=dict(interactive=True,
+                                                                    stdout=True,
+                                                                    stderr=True,
+                                                                    stdin=True,
+                                                                    stream=True,
+                                                                    demux=True))
+                # now we are ready to start the container
+                container.start()
+            with tracer.span("stream stdio"):
+                exchange_stdio(docker_socket._sock, stdin_source, stdout_writer, stderr_writer)
+            # update container status
+            container.reload()
+            exit_code = container.attrs['State']['ExitCode']
+        finally:
+            with tracer.span("remove container"):
+                container.remove(force=True)
+        return exit_code
+
+
+class TmpfsDockerRun(DockerRun):
+    """
+    Run with /mnb/run on a tmpfs, which is discarded when the container stops: the container idles while the
+    command runs as an exec instance, then file outputs are copied out of it into the scratch dir
+    """
+
+    def run(self, action, environment, stdin_source, stdout_writer, stderr_writer):
+        client = self.backend.get_client()
+        tracer = self.backend.tracer
+        # inputs are mounted into the tmpfs, Docker mounts parent paths first
+        mounts = self.mounts + [Mount(source=None,
+                                      target=str(MNB_RUN),
+                                      type="tmpfs",
+                                      tmpfs_size=action.tmpfs_size)]
+        with tracer.span("create container"):
+            container = client.containers.create(action.image_name,
+                                                  entrypoint=IDLE_ENTRYPOINT,
+                                                  command=[],
+                                                  mounts=mounts,
+                                                  detach=True)
+        try:
+            with tracer.span("start container"):
+                container.start()
+            # exec instances do not use image entrypoint and command, so these are applied explicitly
+            image_config = client.images.get(action.image_name).attrs['Config']
+            argv = (image_config.get('Entrypoint') or []) + \
+                (action.command if action.command is not None else image_config.get('Cmd') or [])
+            workdir = MNB_RUN / (action.workdir or "")
+            exit_code = 0
+            if action.workdir:
+                # unlike containers, exec instances do not create their workdir
+                with tracer.span("create workdir"):
+                    exit_code = exec_command(client, container.id, ["mkdir", "-p", str(workdir)], {}, MNB_RUN,
+                                             ChainedFileSource([]), FanOutWriter([]), stderr_writer)
+            if exit_code == 0:
+                with tracer.span("exec command"):
+                    exit_code = exec_command(client, container.id, argv, environment, workdir,
+                                             stdin_source, stdout_writer, stderr_writer)
+            if exit_code == 0:
+                with tracer.span("copy outputs"):
+                    for through_path in dict.fromkeys(out.through.path for out in action.outputs
+                                                      if isinstance(out.through, ThroughFile)):
+                        self.copy_output(container, through_path)
+        finally:
+            with tracer.span("remove container"):
+                container.remove(force=True)
+        return exit_code
+
+    def copy_output(self, container, through_path: str):
+        # an output left missing is reported when outputs are placed, as for other runs
+        try:
+            (archive_chunks, _) = container.get_archive(str(MNB_RUN / through_path))
+        except NotFound:
+            return
+        extract_file(archive_chunks, self.scratch_dir / through_path)
+
+
+class FusedDockerRun(FusedRun):
+    """
+    Run of fused actions in a single container: the scratch dir holding steps and their status (see fused_script)
+    is mounted at /mnb, inputs of every step are bind-mounted into its own scratch dir
+    """
+    mounts: List[Mount]
+
+    def __init__(self, backend: 'DockerBackend', scratch_dir: ScratchDir):
+        self.backend = backend
+        self.scratch_dir = scratch_dir.path
+        self.scratch_dir_on_host = scratch_dir.path_on_host
+        self.mounts = list()
+        self.image_config = None
+        self.container = None
+
+    def step_dir(self, index: int) -> Path:
+        return self.scratch_dir / step_dir(index)
+
+    def stage_inputs(self, index: int, bound_inputs: Dict[str, Input]):
+        self.step_dir(index).mkdir(parents=True, exist_ok=True)
+        self.mounts.extend(Mount(source=str(self.backend.root_on_host / inp.value.path),
+                                 target=str(MNB_RUN.parent / step_dir(index) / through_path),
+                                 type='bind',
+                                 read_only=True)
+                           for (through_path, inp) in bound_inputs.items())
+
+    def argv(self, image_name: str, command: Optional[List[str]]) -> List[str]:
+        # the container runs a script, so image entrypoint and command are applied explicitly
+        if self.image_config is None:
+            self.image_config = self.backend.get_client().images.get(image_name).attrs['Config']
+        if command is None:
+            command = self.image_config.get('Cmd') or []
+        return (self.image_config.get('Entrypoint') or []) + command
+
+    def run(self, image_name: str, script: str) -> int:
+        client = self.backend.get_client()
+        (self.scratch_dir / "status").mkdir(parents=True, exist_ok=True)
+        mounts = [Mount(source=str(self.scratch_dir_on_host),
+                        target=str(MNB_RUN.parent),
+                        type="bind",
+                        read_only=False)] + self.mounts
+        with self.backend.tracer.span("create container"):
+            self.container = client.containers.create(image_name,
+                                                      entrypoint=["/bin/sh", "-c", script],
+                                                      command=[],
+                                                      mounts=mounts,
+                                                      working_dir=str(MNB_RUN.parent),
+                                                      detach=True)
+        with self.backend.tracer.span("run fused container"):
+            self.container.start()
+            return self.container.wait()['StatusCode']
+
+    def step_exit_code(self, index: int) -> Optional[int]:
+        try:
+            return int((self.scratch_dir / status_file(index, "exit")).read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def step_output(self, index: int, stream: str, writer: FanOutWriter):
+        with open(self.scratch_dir / status_file(index, stream), 'rb') as f:
+            while chunk := f.read(STATUS_CHUNK_SIZE):
+                writer.write(chunk)
+
+    def logs(self) -> str:
+        return self.container.logs().decode('utf8', errors='replace')
+
+    def remove(self):
+        if self.container is not None:
+            with self.backend.tracer.span("remove container"):
+                self.container.remove(force=True)
+
+
+class DockerBackend(ExecBackend):
+    """Every action runs in a new container, with inputs bind-mounted into it"""
+    supports_fusion = True
+
+    def __init__(self,
+                 get_client: Callable[[], DockerClient],
+                 root_on_host: PurePath,
+                 scratch: ScratchAllocator,
+                 tracer: Tracer):
+        self.get_client = get_client
+        self.root_on_host = root_on_host
+        self.scratch = scratch
+        self.tracer = tracer
+
+    def image_id(self, image_name):
+        return self.get_client().images.get(image_name).id
+
+    @contextmanager
+    def start(self, action):
+        run_class = DockerRun if action.tmpfs_size is None else TmpfsDockerRun
+        with self.scratch.scratch_dir() as scratch_dir:
+            yield run_class(self, scratch_dir)
+
+    @contextmanager
+    def start_fused(self, node: FusedExec):
+        with self.scratch.scratch_dir() as scratch_dir:
+            run = FusedDockerRun(self, scratch_dir)
+            try:
+                yield run
+            finally:
+                run.remove()
+
+
+class WarmRun(ExecRun):
+    def __init__(self, backend: 'WarmBackend', warm_container: WarmContainer):
+        self.backend = backend
+        self.warm_container = warm_container
+        self.scratch_dir = warm_container.scratch_dir
+
+    def stage_inputs(self, bound_inputs):
+        stage_inputs(bound_inputs, self.backend.root_for_mnb, self.scratch_dir)
+
+    def run(self, action, environment, stdin_source, stdout_writer, stderr_writer):
+        with self.backend.tracer.span("exec in warm container"):
+            return self.warm_container.exec(self.backend.get_client(), action.command, environment,
+                                            MNB_RUN / (action.workdir or ""),
+                                            stdin_source, stdout_writer, stderr_writer)
+
+
+class WarmBackend(ExecBackend):
+    """Actions run in long-lived containers of a WarmContainerPool, with inputs copied into them"""
+
+    def __init__(self,
+                 get_client: Callable[[], DockerClient],
+                 root_for_mnb: Path,
+                 scratch: ScratchAllocator,
+                 tracer: Tracer):
+        self.get_client = get_client
+        self.root_for_mnb = root_for_mnb
+        self.tracer = tracer
+        self.pool = WarmContainerPool(get_client, scratch, MNB_RUN)
+
+    def image_id(self, image_name):
+        return self.get_client().images.get(image_name).id
+
+    @contextmanager
+    def start(self, action):
+        with self.pool.lease(action.image_name) as warm_container:
+            yield WarmRun(self, warm_container)
+
+    def close(self):
+        self.pool.close()
+
+
+class HostRun(ExecRun):
+    def __init__(self, backend: 'HostBackend', scratch_dir: Path):
+        self.backend = backend
+        self.scratch_dir = scratch_dir
+
+    def stage_inputs(self, bound_inputs):
+        stage_inputs(bound_inputs, self.backend.root_for_mnb, self.scratch_dir)
+
+    def run(self, action, environment, stdin_source, stdout_writer, stderr_writer):
+        argv = ([action.entrypoint] if action.entrypoint else []) + (action.command or [])
+        if not argv:
+            raise MissingHostCommand(action)
+        workdir = self.scratch_dir / (action.workdir or "")
+        workdir.mkdir(parents=True, exist_ok=True)
+        with self.backend.tracer.span("run process"):
+            try:
+                process = subprocess.Popen(argv,
+                                           cwd=workdir,
+                                           env={"PATH": os.environ.get("PATH", os.defpath), **environment},
+                                           stdin=subprocess.PIPE,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE,
+                                           bufsize=0)
+            except (FileNotFoundError, PermissionError) as e:
+                # same as a container would report
+                stderr_writer.write(f"{argv[0]}: {e.strerror}\n".encode())
+                return COMMAND_NOT_FOUND
+            with process:
+                exchange_process_stdio(process, stdin_source, stdout_writer, stderr_writer)
+                exit_code = process.wait()
+        # killed by a signal, reported the way a shell (and Docker) does
+        return 128 - exit_code if exit_code < 0 else exit_code
+
+
+class HostBackend(ExecBackend):
+    """
+    Actions run as local processes, for trusted commands available on the host (cat, sed, jq...), avoiding
+    container startup. The environment has only PATH of mnb itself added to the variables given by the action.
+    """
+
+    def __init__(self, root_for_mnb: Path, scratch: ScratchAllocator, tracer: Tracer):
+        self.root_for_mnb = root_for_mnb
+        self.scratch = scratch
+        self.tracer = tracer
+
+    def image_id(self, image_name):
+        # there is no image, results depend only on the command and inputs
+        return BACKEND_HOST
+
+    @contextmanager
+    def start(self, action):
+        with self.scratch.scratch_dir() as scratch_dir:
+            yield HostRun(self, scratch_dir.path)
+
+
+def stage_inputs(bound_inputs: Dict[str, Input], root_for_mnb: Path, scratch_dir_for_mnb: Path):
+    """
+    Copy inputs into a scratch dir, to the same places they would be bind-mounted to.
+    Copies (or reflinks) are used rather than hardlinks, so that a command can not modify workspace files.
+    """
+    # parent directories go first, so that files nested in them are not overwritten
+    for through_path in sorted(bound_inputs.keys(), key=lambda p: len(PurePosixPath(p).parts)):
+        inp = bound_inputs[through_path]
+        src = root_for_mnb / inp.value.path
+        dst = scratch_dir_for_mnb / through_path
+        if isinstance(inp.value, File):
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            materialize(src, dst, move=False, allow_hardlink=False)
+        else:
+            shutil.copytree(src, dst,
+                            symlinks=True,
+                            dirs_exist_ok=True,
+                            # bookkeeping dir (containing scratch dir itself) is never a part of an input
+                            ignore=lambda dir_path, names: [MNB_DIR_NAME] if Path(dir_path) == src else [],
+                            copy_function=lambda s, d: copy_file(Path(s), Path(d), allow_hardlink=False))
@@ -0,0 +1,61 @@
+# Fingerprint of everything an image build depends on, to skip builds when nothing changed
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from docker.utils.build import exclude_paths
+
+from hashing import hash_file, MNB_DIR_NAME
+
+# image label to store the fingerprint the image was built from
+FINGERPRINT_LABEL = "mnb.fingerprint"
+# bump to invalidate fingerprints computed by previous versions
+FINGERPRINT_VERSION = 1
+
+DEFAULT_DOCKERFILE = "Dockerfile"
+
+
+def build_fingerprint(context_path: Path,
+                      dockerfile_path: Optional[str],
+                      build_args: Dict[str, str],
+                      git_rev: Optional[str]) -> str:
+    dockerfile = dockerfile_path or DEFAULT_DOCKERFILE
+    fingerprint_json = {
+        "version": FINGERPRINT_VERSION,
+        "context": build_context_hash(context_path, dockerfile),
+        "dockerfile": hash_file(context_path / dockerfile),
+        "build_args": build_args,
+        "git_rev": git_rev,
+    }
+    return hashlib.sha256(json.dumps(fingerprint_json, sort_keys=True).encode()).hexdigest()
+
+
+def build_context_hash(context_path: Path, dockerfile: str) -> str:
+    """Hash of files sent to Docker daemon as a build context, i.e. all files not excluded by .dockerignore"""
+    root = str(context_path)
+    h = hashlib.sha256()
+    for rel_path in sorted(exclude_paths(root, read_dockerignore(context_path), dockerfile=dockerfile)):
+        if rel_path == MNB_DIR_NAME or rel_path.startswith(MNB_DIR_NAME + "/"):
+            # bookkeeping dir changes on every run, and builds must not depend on it
+            continue
+        path = os.path.join(root, rel_path)
+        stat = os.lstat(path)
+        mode = oct(stat.st_mode).encode()
+        if os.path.islink(path):
+            h.update(b"l\0" + rel_path.encode() + b"\0" + os.readlink(path).encode() + b"\0")
+        elif os.path.isdir(path):
+            h.update(b"d\0" + rel_path.encode() + b"\0" + mode + b"\0")
+        else:
+            h.update(b"f\0" + rel_path.encode() + b"\0" + mode + b"\0" + hash_file(path).encode() + b"\0")
+    return h.hexdigest()
+
+
+def read_dockerignore(context_path: Path):
+    # parsed the same way docker-py does it when sending a build context
+    dockerignore = context_path / ".dockerignore"
+    if not dockerignore.exists():
+        return []
+    with dockerignore.open('r') as f:
+        return [line.strip() for line in f.read().splitlines() if line.strip() != '' and not line.strip().startswith('#')]
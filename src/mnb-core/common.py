@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
 
 def get_lib_path() -> Path:
@@ -10,3 +10,13 @@ class CommandLineOptions:
     windows_host: bool
     dev_mode: bool
     subcommand: Optional[str]
+    no_cache: bool = False
+    jobs: int = 1
+    docker_pool_size: Optional[int] = None
+    warm_containers: bool = False
+    fuse: bool = False
+    poll: bool = False
+    debounce: int = 100
+    targets: List[str] = []
+    paths: List[str] = []
+    trace: Optional[str] = None
@@ -0,0 +1,65 @@
+# Durations of actions measured on previous runs, used to start actions on the critical path first
+#
+# Actions are identified by their JSON representation, so the identity survives spec regeneration as long as
+# the action itself does not change.
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Set
+
+from spec import *
+
+# assumed duration of actions never executed before, in seconds
+DEFAULT_DURATION = 1.0
+# weight of the last measurement, older ones are exponentially forgotten
+SMOOTHING = 0.5
+
+
+def action_identity(action: Action) -> str:
+    return hashlib.sha256(json.dumps(action_to_json(action), sort_keys=True).encode()).hexdigest()[:32]
+
+
+class ActionDurations:
+    durations: Dict[str, float]
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.skipped: Set[Action] = set()
+        try:
+            with path.open('r') as f:
+                self.durations = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.durations = dict()
+
+    def estimate(self, action: Action) -> float:
+        return self.durations.get(action_identity(action), DEFAULT_DURATION)
+
+    def mark_skipped(self, action: Action):
+        """Action turned out to be up to date, its duration says nothing about how long it takes to execute"""
+        with self.lock:
+            self.skipped.add(action)
+
+    def record(self, action: Action, duration: float):
+        identity = action_identity(action)
+        with self.lock:
+            if action in self.skipped:
+                self.skipped.discard(action)
+                return
+            prev = self.durations.get(identity)
+            self.durations[identity] = duration if prev is None else SMOOTHING * duration + (1 - SMOOTHING) * prev
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with tmp_path.open('w') as f:
+                json.dump(self.durations, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
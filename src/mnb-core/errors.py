@@ -24,6 +24,11 @@ class MissingProducer(SpecSemanticError):
         super().__init__(f'Missing producer for {value}')
         self.value = value
 
+class UnknownTarget(SpecSemanticError):
+    def __init__(self, path: str):
+        super().__init__(f'No action produces {path}')
+        self.path = path
+
 class UnexpectedActionType(SpecSemanticError):
     def __init__(self, action: Action):
         super().__init__(f'Invalid action type {type(action)}')
@@ -42,6 +47,14 @@ class ProducerConflict(SpecSemanticError):
         self.prev_producer = prev_producer
 
 
+class DependencyCycle(SpecSemanticError):
+    def __init__(self, action: Exec, other_action: Exec):
+        super().__init__(f'Actions exec {action.image_name} {action.command} and '
+                         f'exec {other_action.image_name} {other_action.command} depend on each other')
+        self.action = action
+        self.other_action = other_action
+
+
 class IncompatibleValueAndThrough(SpecSemanticError):
     def __init__(self, action: Action, value: Value, through):
         super().__init__(f'Value type {type(Value)} not compatible with through {through} in action {action}')
@@ -69,4 +82,14 @@ class UnexpectedInputThroughType(SpecSemanticError):
 class UnexpectedOutputThroughType(SpecSemanticError):
     def __init__(self, through):
         super().__init__(f'Invalid output through type {type(through)}')
-        self.through = through
\ No newline at end of file
+        self.through = through
+
+class ImageNotPresent(SpecSemanticError):
+    def __init__(self, image_name: str):
+        super().__init__(f'Image {image_name} is not present locally, and its pull policy is "{PULL_NEVER}"')
+        self.image_name = image_name
+
+class MissingHostCommand(SpecSemanticError):
+    def __init__(self, action: Action):
+        super().__init__(f'No command in action {action} running on host (there is no image to take a default one from)')
+        self.action = action
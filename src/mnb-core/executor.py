@@ -1,34 +1,67 @@
-import io
+import itertools
 import json
-import re
+import shutil
 import sys
 import threading
+import time
+from graphlib import TopologicalSorter
 from pathlib import PurePosixPath, Path, PurePath, PosixPath, PureWindowsPath, WindowsPath
-from shutil import copy
+from collections import Counter
+from typing import Set, Tuple
 
-import git
 import chevron
 import mnb_version
 
 import spec_parser
+from action_cache import ActionCache
+from backends import ExecBackend, DockerBackend, WarmBackend, HostBackend
 from common import CommandLineOptions, get_lib_path
+from durations import ActionDurations, DEFAULT_DURATION
+from fusion import FusedExec, FusedStep, PlanNode, fuse_actions, fused_script
+from scratch import ScratchAllocator, collect_garbage, disk_usage
+from tracing import Tracer
 
-MNB_RUN = PurePosixPath("/mnb/run")
+# scratch dir of earlier versions (a dir per action, left behind by interrupted runs), removed by gc
+LEGACY_SCRATCH_DIR = "context"
+# stderr is displayed after the command completes, limit amount of it kept in memory
+STDERR_TAIL_SIZE = 64 * 1024
 
 from docker import DockerClient, from_env
-from docker.types import Mount
-from docker.utils.socket import next_frame_header, read_exactly
+from docker.constants import DEFAULT_MAX_POOL_SIZE
+from docker.errors import ImageNotFound
 
 from fancy_output import FancyOutput
+from build_fingerprint import build_fingerprint, FINGERPRINT_LABEL
+from git_checkout import GitCheckouts
+from generator_cache import GeneratorCache
+from hashing import MNB_DIR_NAME, enable_memo
+from image_index import LocalImageIndex
+from materialize import materialize
+from streams import FanOutWriter, ChainedFileSource
 from spec import *
 from errors import UnexpectedActionType, IncompatibleValueAndThrough, ConflictingMounts, \
-    ConflictingEnvironmentAssignements, UnexpectedInputThroughType, UnexpectedOutputThroughType
-from plan import toposort_actions
+    ConflictingEnvironmentAssignements, UnexpectedInputThroughType, UnexpectedOutputThroughType, ImageNotPresent
+from path_trie import path_parts
+from plan import build_plan_graph, PlanGraph, is_within, normalize_path
+from plan_index import save_plan_index, load_plan_index, describe_action
+from scheduler import run_actions, SchedulingAborted, remaining_path_lengths, critical_path
+from watcher import create_watcher
 
 class Context:
     fancy_output: FancyOutput
     context_absolute_path_on_host: PurePath
     context_absolute_path_for_mnb: Path
+    action_cache: Optional[ActionCache]
+    jobs: int
+    docker_pool_size: int
+    settings: Settings
+    scratch: ScratchAllocator
+    backends: Dict[str, ExecBackend]
+    use_cache: bool
+    fuse: bool
+    git_checkouts: GitCheckouts
+    action_durations: ActionDurations
+    tracer: Tracer
 
     def __init__(self, cliopts: CommandLineOptions):
         self.fancy_output = FancyOutput(sys.stdout)
@@ -47,66 +80,222 @@ class Context:
         else:
             self.context_absolute_path_for_mnb = PosixPath("/mnb/run")
 
-def execute_spec(spec: Spec, context: Context):
+        self.jobs = cliopts.jobs
+        # every running action holds one connection for attached stdio, and needs one more for API calls
+        self.docker_pool_size = cliopts.docker_pool_size or max(DEFAULT_MAX_POOL_SIZE, 2 * self.jobs)
+        self._docker_client = None
+        self._docker_client_lock = threading.Lock()
+
+        self.tracer = Tracer(self.context_absolute_path_for_mnb / cliopts.trace if cliopts.trace else None)
+
+        # backends are selected per image by workspace settings, loaded with the workspace spec
+        self.settings = Settings()
+        self.scratch = ScratchAllocator(self.context_absolute_path_for_mnb / MNB_DIR_NAME / "scratch",
+                                        self.context_absolute_path_on_host / MNB_DIR_NAME / "scratch")
+        if cliopts.warm_containers:
+            docker_backend = WarmBackend(lambda: self.docker_client, self.context_absolute_path_for_mnb,
+                                         self.scratch, self.tracer)
+        else:
+            docker_backend = DockerBackend(lambda: self.docker_client, self.context_absolute_path_on_host,
+                                           self.scratch, self.tracer)
+        self.backends = {
+            BACKEND_DOCKER: docker_backend,
+            BACKEND_HOST: HostBackend(self.context_absolute_path_for_mnb, self.scratch, self.tracer),
+        }
+
+        self._local_images = None
+        self._local_images_lock = threading.Lock()
+        self.git_checkouts = GitCheckouts(self.context_absolute_path_for_mnb / ".mnb" / "repo")
+
+        self.use_cache = not cliopts.no_cache
+        self.fuse = cliopts.fuse
+        if cliopts.no_cache:
+            self.action_cache = None
+        else:
+            self.action_cache = ActionCache(self.context_absolute_path_for_mnb / ".mnb" / "cache" / "actions")
+        self.action_durations = ActionDurations(self.context_absolute_path_for_mnb / ".mnb" / "cache" / "durations.json")
+
+    @property
+    def docker_client(self) -> DockerClient:
+        """Docker client shared by all actions, created on first use"""
+        with self._docker_client_lock:
+            if self._docker_client is None:
+                self._docker_client = from_env(max_pool_size=self.docker_pool_size)
+            return self._docker_client
+
+    @property
+    def local_images(self) -> LocalImageIndex:
+        """Index of local images, listed on first use"""
+        with self._local_images_lock:
+            if self._local_images is None:
+                self._local_images = LocalImageIndex(self.docker_client)
+            return self._local_images
+
+    def add_local_image(self, image_name: str):
+        """Record a built or pulled image, if local images were listed already"""
+        with self._local_images_lock:
+            if self._local_images is not None:
+                self._local_images.add(image_name)
+
+    def backend_for(self, image_name: str) -> ExecBackend:
+        return self.backends[self.settings.backend_for(image_name)]
+
+    def close(self):
+        self.action_durations.save()
+        self.tracer.save()
+        for backend in self.backends.values():
+            backend.close()
+        self.scratch.close()
+        with self._docker_client_lock:
+            if self._docker_client is not None:
+                self._docker_client.close()
+                self._docker_client = None
+
+def execute_spec(spec: Spec, context: Context, graph: Optional[PlanGraph] = None, actions: Optional[Set[Action]] = None,
+                 result_path: Optional[Path] = None):
+    """
+    Execute actions of the spec (or only the given subset of them) in dependency order, return output of the last one.
+    With result_path, output of actions is written there instead of being kept in memory.
+    """
     if spec.description:
         context.fancy_output.phase(spec.description)
-    context.fancy_output.phase(f"Actions to execute: {len(spec.actions)}")
-    toposorted_actions = toposort_actions(spec)
-    last_result = None
-    for index, action in enumerate(toposorted_actions):
-        context.fancy_output.phase(f"Action {index + 1}/{len(toposorted_actions)}")
-        last_result = execute_action(action, context)
+    with context.tracer.span("plan dependencies"):
+        dependencies = (graph or build_plan_graph(spec)).dependencies()
+        if actions is not None:
+            dependencies = {action: [dep for dep in deps if dep in actions]
+                            for (action, deps) in dependencies.items() if action in actions}
+    context.fancy_output.phase(f"Actions to execute: {len(dependencies)}")
+    if any(isinstance(action, PullImage) and action.pull_policy != PULL_ALWAYS
+           and context.settings.backend_for(action.image_name) == BACKEND_DOCKER for action in dependencies):
+        with context.tracer.span("list local images"):
+            # a single listing of local images serves all pull actions of the plan
+            context.local_images
+    if context.fuse:
+        with context.tracer.span("fuse actions"):
+            dependencies = fuse_small_actions(dependencies, context)
+    # actions on the longest chain (by durations measured before) are started first
+    estimates = {node: sum(map(context.action_durations.estimate, node_actions(node))) for node in dependencies}
+    remaining = remaining_path_lengths(dependencies, estimates.__getitem__)
+    path = critical_path(dependencies, remaining)
+    if path:
+        context.fancy_output.phase(f"Estimated time: {remaining[path[0]]:.1f}s on critical path of {len(path)} actions, "
+                                   f"{sum(estimates.values()):.1f}s in total")
+        for action in path:
+            context.fancy_output.progress(f"{estimates[action]:.1f}s {describe_action(action)}", prefix="critical path: ")
+    action_numbers = itertools.count(1)
+
+    def execute_numbered_action(action):
+        index = next(action_numbers)
+        tag = f"[{index}/{len(dependencies)}] " if context.jobs > 1 else None
+        with context.fancy_output.tagged(tag):
+            context.fancy_output.phase(f"Action {index}/{len(dependencies)}")
+            started = time.monotonic()
+            with context.tracer.span(describe_action(action), index=index):
+                result = execute_action(action, context, result_path)
+            actions = node_actions(action)
+            for fused_action in actions:
+                context.action_durations.record(fused_action, (time.monotonic() - started) / len(actions))
+            return result
+
+    try:
+        with context.tracer.span("execute actions", actions=len(dependencies), jobs=context.jobs):
+            completed = run_actions(dependencies, context.jobs, execute_numbered_action, remaining)
+    except SchedulingAborted as e:
+        context.fancy_output.failure(f"Stopped after failure, {e.not_started} actions not started")
+        raise e.cause
+    if len(completed) == 0:
+        return None
+    (last_action, last_result) = completed[-1]
     return last_result
 
 
-def execute_action(action, context):
+def fuse_small_actions(dependencies: Dict[Action, List[Action]], context: Context) -> Dict[PlanNode, List[PlanNode]]:
+    """Fuse actions on backends supporting it, taking up to DEFAULT_DURATION (as do actions never measured)"""
+    def can_fuse(action: Exec) -> bool:
+        return (context.backend_for(action.image_name).supports_fusion
+                and context.action_durations.estimate(action) <= DEFAULT_DURATION)
+    order = list(TopologicalSorter(dependencies).static_order())
+    # with several jobs, only chains are fused, independent actions are left to run concurrently
+    fused = fuse_actions(order, dependencies, can_fuse, chains_only=context.jobs > 1)
+    fused_count = sum(len(node.actions) for node in fused if isinstance(node, FusedExec))
+    if fused_count > 0:
+        context.fancy_output.phase(f"Fused {fused_count} actions into "
+                                   f"{sum(1 for node in fused if isinstance(node, FusedExec))} container runs")
+    return fused
+
+def node_actions(node: PlanNode) -> List[Action]:
+    return node.actions if isinstance(node, FusedExec) else [node]
+
+def execute_action(action, context, result_path: Optional[Path] = None):
+    backend_name = context.settings.backend_for(action.image_name)
+    if isinstance(action, (PullImage, BuildImage)) and backend_name != BACKEND_DOCKER:
+        # the image only selects the backend its commands run on
+        context.fancy_output.phase(f"Image {action.image_name} runs on {backend_name}, nothing to pull or build")
+        context.action_durations.mark_skipped(action)
+        return
     if isinstance(action, PullImage):
         return execute_pull_image(action, context)
     elif isinstance(action, BuildImage):
         return execute_build_image(action, context)
     elif isinstance(action, Exec):
-        return execute_exec(action, context)
+        return execute_exec(action, context, result_path)
+    elif isinstance(action, FusedExec):
+        return execute_fused(action, context)
     else:
         raise UnexpectedActionType(action)
 
 
 def execute_build_image(action: BuildImage, context: Context):
-    client = from_env()
+    client = context.docker_client
     if action.from_git:
         context.fancy_output.phase(f"fetch from git repo {action.from_git.repo} rev {action.from_git.rev}")
-        repo_dir = re.sub("[^a-zA-Z0-9.-]+", "-", action.from_git.repo)
-        repo_path = context.context_absolute_path_for_mnb / ".mnb" / "repo" / repo_dir
-        if Path(repo_path).exists():
-            context.fancy_output.progress(f"use existing working copy")
-            repo = git.Repo(str(repo_path))
-            origin = repo.remote('origin')
-        else:
-            context.fancy_output.progress(f"create new working copy")
-            ensure_writable_dir(repo_path)
-            repo = git.Repo.init(str(repo_path))
-            origin = repo.create_remote('origin', action.from_git.repo)
-        origin.fetch()
-        context.fancy_output.success(f"fetched to {repo_path}")
-        repo.git.checkout(action.from_git.rev)
-        context_path = context.context_absolute_path_for_mnb / ".mnb" / "repo" / repo_dir / action.context_path
+        with context.tracer.span("git checkout", repo=action.from_git.repo):
+            (worktree_path, git_commit) = context.git_checkouts.checkout(action.from_git.repo,
+                                                                         action.from_git.rev,
+                                                                         context.fancy_output.progress)
+        context.fancy_output.success(f"checked out {git_commit} to {worktree_path}")
+        context_path = worktree_path / action.context_path
     else:
+        git_commit = None
         context_path = context.context_absolute_path_for_mnb / action.context_path
+    # skip the build if the image was built from exactly the same context, Dockerfile and arguments
+    with context.tracer.span("build fingerprint"):
+        fingerprint = build_fingerprint(context_path, action.dockerfile_path, action.build_args, git_commit)
+    if context.use_cache:
+        try:
+            existing_image = client.images.get(action.image_name)
+        except ImageNotFound:
+            existing_image = None
+        if existing_image is not None and existing_image.labels.get(FINGERPRINT_LABEL) == fingerprint:
+            context.fancy_output.phase(f"Image {action.image_name} is up to date, build skipped")
+            context.action_durations.mark_skipped(action)
+            return
     context.fancy_output.phase(f"Build image {action.image_name} using {context_path}")
-    (image, stream) = client.images.build(tag=action.image_name,
-                                          path=str(context_path),
-                                          dockerfile=action.dockerfile_path,
-                                          buildargs=action.build_args)
-    for i in stream:
-        if 'stream' in i:
-            context.fancy_output.progress(i['stream'], prefix=f"build {action.image_name}: ")
-        elif 'aux' in i:
-            context.fancy_output.success(str(i['aux']), prefix=f"build {action.image_name}: ")
+    with context.tracer.span("build image", image=action.image_name):
+        (image, stream) = client.images.build(tag=action.image_name,
+                                              path=str(context_path),
+                                              dockerfile=action.dockerfile_path,
+                                              buildargs=action.build_args,
+                                              labels={FINGERPRINT_LABEL: fingerprint})
+        for i in stream:
+            if 'stream' in i:
+                context.fancy_output.progress(i['stream'], prefix=f"build {action.image_name}: ")
+            elif 'aux' in i:
+                context.fancy_output.success(str(i['aux']), prefix=f"build {action.image_name}: ")
     for tag in action.extra_tags or []:
         image.tag(tag)
         context.fancy_output.progress(f"tagged {action.image_name} as {tag}", prefix=f"build {action.image_name}: ")
+    for image_name in [action.image_name] + (action.extra_tags or []):
+        context.add_local_image(image_name)
 
 def execute_pull_image(action: PullImage, context: Context):
-    client = from_env()
+    client = context.docker_client
+    if action.pull_policy != PULL_ALWAYS and context.local_images.contains(action.image_name):
+        context.fancy_output.phase(f"Image {action.image_name} is present locally, pull skipped")
+        context.action_durations.mark_skipped(action)
+        return
+    if action.pull_policy == PULL_NEVER:
+        raise ImageNotPresent(action.image_name)
     context.fancy_output.phase(f"Pull image {action.image_name}")
     parts = action.image_name.split(":")
     repository = parts[0]
@@ -114,184 +303,236 @@ def execute_pull_image(action: PullImage, context: Context):
         tag = parts[1]
     else:
         tag = None
-    for line in client.api.pull(repository, tag=tag, stream=True, decode=True):
-        #context.fancy_output.progress(f"{line.get('status', '')} {line.get('progress','')}")
-        context.fancy_output.progress(f"{line}", prefix=f"pull {action.image_name}: ")
+    with context.tracer.span("pull image", image=action.image_name):
+        for line in client.api.pull(repository, tag=tag, stream=True, decode=True):
+            #context.fancy_output.progress(f"{line.get('status', '')} {line.get('progress','')}")
+            context.fancy_output.progress(f"{line}", prefix=f"pull {action.image_name}: ")
+    context.add_local_image(action.image_name)
 
-def execute_exec(action: Exec, context: Context):
-    client = from_env()
-    context.fancy_output.phase(f"exec {action.image_name} {action.command}")
-    mounts: Dict[str, Mount] = dict()
-    stdin_inputs = [] # stdin sources (would be concatenated together)
-    stdout_outputs = []   # stdout destinations (output would be fanned out)
-    stderr_outputs = []  # stderr destinations (output would be fanned out)
-    file_outputs = []
-    environment = {}
-    for inp in action.inputs:
-        if isinstance(inp.through, ThroughFile):
-            if isinstance(inp.value, File):
-                if inp.through.path in mounts:
-                    raise ConflictingMounts(action, inp.through.path)
+class ExecIO:
+    """Inputs and outputs of an Exec action, by the way they are passed to its command"""
+    bound_inputs: Dict[str, Input]  # inputs staged by the backend, by path inside /mnb/run
+    stdin_inputs: List[Input]  # stdin sources (would be concatenated together)
+    stdout_outputs: List[Output]  # stdout destinations (output would be fanned out)
+    stderr_outputs: List[Output]  # stderr destinations (output would be fanned out)
+    file_outputs: List[Output]
+    environment: Dict[str, str]
+
+    def __init__(self, action: Exec, context: Context):
+        self.bound_inputs = dict()
+        self.stdin_inputs = []
+        self.stdout_outputs = []
+        self.stderr_outputs = []
+        self.file_outputs = []
+        self.environment = {}
+        for inp in action.inputs:
+            if isinstance(inp.through, ThroughFile):
+                if isinstance(inp.value, File):
+                    if inp.through.path in self.bound_inputs:
+                        raise ConflictingMounts(action, inp.through.path)
+                    else:
+                        self.bound_inputs[inp.through.path] = inp
                 else:
-                    mounts[inp.through.path] = (Mount(source=str(context.context_absolute_path_on_host / inp.value.path),
-                                                      target=str(MNB_RUN / inp.through.path),
-                                                      type='bind',
-                                                      read_only=True))
-            else:
-                raise IncompatibleValueAndThrough(action, inp.value, inp.through)
-        elif isinstance(inp.through, ThroughDir):
-            if isinstance(inp.value, Dir):
-                if inp.through.path in mounts:
-                    raise ConflictingMounts(action, inp.through.path)
+                    raise IncompatibleValueAndThrough(action, inp.value, inp.through)
+            elif isinstance(inp.through, ThroughDir):
+                if isinstance(inp.value, Dir):
+                    if inp.through.path in self.bound_inputs:
+                        raise ConflictingMounts(action, inp.through.path)
+                    else:
+                        self.bound_inputs[inp.through.path] = inp
                 else:
-                    mounts[inp.through.path] = (Mount(source=str(context.context_absolute_path_on_host / inp.value.path),
-                                                      target=str(MNB_RUN / inp.through.path),
-                                                      type='bind',
-                                                      read_only=True))
-            else:
-                raise IncompatibleValueAndThrough(action, inp.value, inp.through)
-        elif isinstance(inp.through, ThroughStdin):
-            if isinstance(inp.value, File):
-                stdin_inputs.append(inp)
-            else:
-                raise IncompatibleValueAndThrough(action, inp.value, inp.through)
-        elif isinstance(inp.through, ThroughEnvironment):
-            if inp.through.name in environment:
-                raise ConflictingEnvironmentAssignements(action, inp.through.name)
-            if isinstance(inp.value, File):
-                with open(context.context_absolute_path_for_mnb / inp.value.path) as input_file:
-                    # for now we ignore encoding issues
-                    s = input_file.read()
-                    environment[inp.through.name] = s
-            else:
-                raise IncompatibleValueAndThrough(action, inp.value, inp.through)
-        else:
-            raise UnexpectedInputThroughType(inp.through)
-    for out in action.outputs:
-        if isinstance(out.through, ThroughFile):
-            if (isinstance(out.value, File)):
-                file_outputs.append(out)
-            else:
-                raise IncompatibleValueAndThrough(action, out.value, out.through)
-        elif isinstance(out.through, ThroughDir):
-            # output directories not supported for now
-            raise UnexpectedOutputThroughType(out.through)
-        elif isinstance(out.through, ThroughStdout):
-            if (isinstance(out.value, File)):
-                stdout_outputs.append(out)
+                    raise IncompatibleValueAndThrough(action, inp.value, inp.through)
+            elif isinstance(inp.through, ThroughStdin):
+                if isinstance(inp.value, File):
+                    self.stdin_inputs.append(inp)
+                else:
+                    raise IncompatibleValueAndThrough(action, inp.value, inp.through)
+            elif isinstance(inp.through, ThroughEnvironment):
+                if inp.through.name in self.environment:
+                    raise ConflictingEnvironmentAssignements(action, inp.through.name)
+                if isinstance(inp.value, File):
+                    with open(context.context_absolute_path_for_mnb / inp.value.path) as input_file:
+                        # for now we ignore encoding issues
+                        s = input_file.read()
+                        self.environment[inp.through.name] = s
+                else:
+                    raise IncompatibleValueAndThrough(action, inp.value, inp.through)
             else:
-                raise IncompatibleValueAndThrough(action, out.value, out.through)
-        elif isinstance(out.through, ThroughStderr):
-            if (isinstance(out.value, File)):
-                stderr_outputs.append(out)
+                raise UnexpectedInputThroughType(inp.through)
+        for out in action.outputs:
+            if isinstance(out.through, ThroughFile):
+                if (isinstance(out.value, File)):
+                    self.file_outputs.append(out)
+                else:
+                    raise IncompatibleValueAndThrough(action, out.value, out.through)
+            elif isinstance(out.through, ThroughDir):
+                # output directories not supported for now
+                raise UnexpectedOutputThroughType(out.through)
+            elif isinstance(out.through, ThroughStdout):
+                if (isinstance(out.value, File)):
+                    self.stdout_outputs.append(out)
+                else:
+                    raise IncompatibleValueAndThrough(action, out.value, out.through)
+            elif isinstance(out.through, ThroughStderr):
+                if (isinstance(out.value, File)):
+                    self.stderr_outputs.append(out)
+                else:
+                    raise IncompatibleValueAndThrough(action, out.value, out.through)
             else:
-                raise IncompatibleValueAndThrough(action, out.value, out.through)
-        else:
-            raise UnexpectedOutputThroughType(out.through)
-    # create temporary dir to use as a current dir during container run
-    temp_dir_on_host = context.context_absolute_path_on_host / ".mnb" / "context" / str(id(action))
-    temp_dir_for_mnb = context.context_absolute_path_for_mnb / ".mnb" / "context" / str(id(action))
-    ensure_writable_dir(temp_dir_for_mnb)
-    all_mounts = list(mounts.values())
-    all_mounts.append(Mount(source=str(temp_dir_on_host),
-                      target=str(MNB_RUN),
-                      type="bind",
-                      read_only=False))
-    # detrmine workdir container parameter
-    if action.workdir:
-        workdir = MNB_RUN / action.workdir
+                raise UnexpectedOutputThroughType(out.through)
+
+def execute_exec(action: Exec, context: Context, result_path: Optional[Path] = None):
+    backend = context.backend_for(action.image_name)
+    context.fancy_output.phase(f"exec {action.image_name} {action.command}")
+    io = ExecIO(action, context)
+    # skip execution if the action was already executed with the same image and inputs, and its outputs are intact.
+    # Actions without outputs are executed for their stdout, so they are never skipped
+    cache_key = None
+    with context.tracer.span("check action cache"):
+        if context.action_cache is not None and len(action.outputs) > 0:
+            cache_key = action_cache_key(action, io, backend, context)
+            if context.action_cache.is_fresh(cache_key, context.context_absolute_path_for_mnb):
+                context.fancy_output.success("outputs are up to date, skipping", prefix=f"{action.image_name}: ")
+                context.action_durations.mark_skipped(action)
+                return None
+    # stdin inputs are streamed one after another (missing ones fail here, before anything is started)
+    stdin_source = ChainedFileSource([context.context_absolute_path_for_mnb / inp.value.path for inp in io.stdin_inputs])
+    # output streams are written to output files as they arrive. Stdout not redirected to files is the result of
+    # the action: it goes to result_path if given, otherwise it is kept in memory. Only the tail of stderr is kept
+    # for display
+    if io.stdout_outputs:
+        stdout_writer = FanOutWriter([writable_output_path(context, out) for out in io.stdout_outputs])
+    elif result_path is not None:
+        stdout_writer = FanOutWriter([result_path])
     else:
-        workdir = MNB_RUN
-    # create container, but do not start yet (we need to attach to it first)
-    container = client.containers.create(
-        action.image_name,
-        command=action.command,
-        mounts=all_mounts,
-        environment=environment,
-        working_dir=str(workdir),
-        detach=True,
-        stdin_open=True)
-    # attach to socket
-    docker_socket = container.attach_socket(params=dict(interactive=True,
-                                                        stdout=True,
-                                                        stderr=True,
-                                                        stdin=True,
-                                                        stream=True,
-                                                        demux=True))
-    # initialize in-memory buffers for stdio streams
-    # TODO: For output streams, writes could be redirected to output files via fan-out stream
-    stdout_stream = io.BytesIO()
-    stderr_stream = io.BytesIO()
-    # TODO: for stdin, reads could be orchestrated via chained stream source
-    stdin_data = []
-    for inp in stdin_inputs:
-        with open(str(context.context_absolute_path_for_mnb / inp.value.path), "rb") as f:
-            stdin_data.append(f.read())
-    stdin_stream = io.BytesIO(b"".join(stdin_data))
-    # threads to receive and send stdio streams via docker socket
-    sender_thread = threading.Thread(target=socket_sender, args=(docker_socket._sock, stdin_stream))
-    receiver_thread = threading.Thread(target=socket_receiver, args=(docker_socket._sock, stdout_stream, stderr_stream))
-    # now we are ready to start the container
-    container.start()
-    receiver_thread.start()
-    sender_thread.start()
-    # wait for sender and receiver threads to terminate
-    receiver_thread.join()
-    sender_thread.join()
-    # update container status
-    container.reload()
-    exit_code = container.attrs['State']['ExitCode']
-    container.stop()
-    container.remove()
-    if len(stderr_stream.getvalue()) > 0:
-        context.fancy_output.failure(stderr_stream.getvalue().decode('utf8'), prefix=f"{action.image_name} stderr: ")
-    context.fancy_output.progress(f"Stdout length {len(stdout_stream.getvalue())}", prefix=f"{action.image_name}: ")
+        stdout_writer = FanOutWriter([], capture=True)
+    stderr_writer = FanOutWriter([writable_output_path(context, out) for out in io.stderr_outputs],
+                                 tail_size=STDERR_TAIL_SIZE)
+    try:
+        with backend.start(action) as run:
+            with context.tracer.span("stage inputs"):
+                run.stage_inputs(io.bound_inputs)
+            exit_code = run.run(action, io.environment, stdin_source, stdout_writer, stderr_writer)
+            with context.tracer.span("place outputs"):
+                finish_exec(action, context, exit_code, stdout_writer, stderr_writer, io.file_outputs, run.scratch_dir)
+    except BaseException:
+        stdout_writer.abort()
+        stderr_writer.abort()
+        raise
+    if cache_key is not None:
+        store_action_cache_entry(action, cache_key, context)
+    context.fancy_output.success(f"command {action.command} succeed", prefix=f"{action.image_name}: ")
+    return stdout_writer.getvalue()
+
+
+def execute_fused(node: FusedExec, context: Context):
+    """
+    Execute fused actions in a single container run. Every action is still reported (and cached) on its own:
+    up to date actions are skipped, and outputs of actions completed before a failed one are placed.
+    """
+    backend = context.backend_for(node.image_name)
+    context.fancy_output.phase(f"fused run of {len(node.actions)} actions on {node.image_name}")
+    # actions to run, with the step (and the path in its scratch dir) producing every file output
+    steps: List[Tuple[Exec, ExecIO]] = list()
+    produced_by_step: Dict[str, Tuple[int, str]] = dict()
+    for action in node.actions:
+        io = ExecIO(action, context)
+        # up to date unless its inputs are going to be produced again
+        if context.action_cache is not None and not any(normalize_path(inp.value.path) in produced_by_step
+                                                        for inp in action.inputs):
+            with context.tracer.span("check action cache"):
+                cache_key = action_cache_key(action, io, backend, context)
+                if context.action_cache.is_fresh(cache_key, context.context_absolute_path_for_mnb):
+                    context.fancy_output.success("outputs are up to date, skipping", prefix=f"{action.image_name}: ")
+                    context.action_durations.mark_skipped(action)
+                    continue
+        for out in io.file_outputs:
+            produced_by_step[normalize_path(out.value.path)] = (len(steps), out.through.path)
+        steps.append((action, io))
+    if not steps:
+        return None
+    with backend.start_fused(node) as run:
+        fused_steps = []
+        with context.tracer.span("stage inputs"):
+            for (index, (action, io)) in enumerate(steps):
+                mounted = {through_path: inp for (through_path, inp) in io.bound_inputs.items()
+                           if normalize_path(inp.value.path) not in produced_by_step}
+                copies = [produced_by_step[normalize_path(inp.value.path)] + (through_path,)
+                          for (through_path, inp) in io.bound_inputs.items() if through_path not in mounted]
+                run.stage_inputs(index, mounted)
+                fused_steps.append(FusedStep(run.argv(action.image_name, action.command), action.workdir, copies,
+                                             io.environment))
+        exit_code = run.run(node.image_name, fused_script(fused_steps))
+        result = None
+        for (index, (action, io)) in enumerate(steps):
+            context.fancy_output.phase(f"exec {action.image_name} {action.command}")
+            step_exit_code = run.step_exit_code(index)
+            if step_exit_code is None:
+                context.fancy_output.failure(run.logs(), prefix=f"{action.image_name}: ")
+                context.fancy_output.failure(f"Not executed, fused run failed with exit code {exit_code}",
+                                             prefix=f"{action.image_name}: ")
+                raise Exception(f"Exit code {exit_code}")
+            stdout_writer = FanOutWriter([], capture=True)
+            stderr_writer = FanOutWriter([], tail_size=STDERR_TAIL_SIZE)
+            run.step_output(index, "out", stdout_writer)
+            run.step_output(index, "err", stderr_writer)
+            with context.tracer.span("place outputs"):
+                finish_exec(action, context, step_exit_code, stdout_writer, stderr_writer, io.file_outputs,
+                            run.step_dir(index))
+            if context.action_cache is not None:
+                # inputs produced by earlier steps are in place only now
+                store_action_cache_entry(action, action_cache_key(action, io, backend, context), context)
+            context.fancy_output.success(f"command {action.command} succeed", prefix=f"{action.image_name}: ")
+            result = stdout_writer.getvalue()
+    return result
+
+
+def action_cache_key(action: Exec, io: ExecIO, backend: ExecBackend, context: Context) -> str:
+    image_id = backend.image_id(action.image_name)
+    return context.action_cache.key_for(action, image_id, io.environment, context.context_absolute_path_for_mnb)
+
+
+def store_action_cache_entry(action: Exec, cache_key: str, context: Context):
+    with context.tracer.span("store action cache entry"):
+        context.action_cache.store(cache_key,
+                                   [output.value.path for output in action.outputs],
+                                   context.context_absolute_path_for_mnb)
+
+
+def finish_exec(action: Exec,
+                context: Context,
+                exit_code: int,
+                stdout_writer: FanOutWriter,
+                stderr_writer: FanOutWriter,
+                file_outputs: List[Output],
+                scratch_dir_for_mnb: Path):
+    """Report command results and, if it succeeded, place its outputs into the workspace"""
+    if stderr_writer.length > 0:
+        truncated = "..." if stderr_writer.length > STDERR_TAIL_SIZE else ""
+        context.fancy_output.failure(truncated + stderr_writer.getvalue().decode('utf8', errors='replace'),
+                                     prefix=f"{action.image_name} stderr: ")
+    context.fancy_output.progress(f"Stdout length {stdout_writer.length}", prefix=f"{action.image_name}: ")
     if exit_code != 0:
         context.fancy_output.failure(f"Exit code {exit_code}", prefix=f"{action.image_name}: ")
         raise Exception(f"Exit code {exit_code}")
-    # copy output files
-    # TODO: use more efficient file copy
+    stdout_writer.commit()
+    stderr_writer.commit()
+    # move output files into the workspace. The same file could be an output through several values,
+    # so it's moved only to the last of them
+    remaining_uses = Counter(file_output.through.path for file_output in file_outputs)
     for file_output in file_outputs:
-        tmp_output_path = temp_dir_for_mnb / file_output.through.path
-        output_path = context.context_absolute_path_for_mnb / file_output.value.path
-        ensure_writable_dir(output_path.parent)
-        copy(tmp_output_path, output_path)
-    for stdout_output in stdout_outputs:
-        output_path = context.context_absolute_path_for_mnb / stdout_output.value.path
-        ensure_writable_dir(output_path.parent)
-        with Path(output_path).open('wb') as dst:
-            dst.write(stdout_stream.getvalue())
-    for stderr_output in stderr_outputs:
-        output_path = context.context_absolute_path_for_mnb / stderr_output.value.path
-        ensure_writable_dir(output_path.parent)
-        with Path(output_path).open('wb') as dst:
-            dst.write(stderr_stream.getvalue())
-    context.fancy_output.success(f"command {action.command} succeed", prefix=f"{action.image_name}: ")
-    return stdout_stream.getvalue()
+        tmp_output_path = scratch_dir_for_mnb / file_output.through.path
+        output_path = writable_output_path(context, file_output)
+        remaining_uses[file_output.through.path] -= 1
+        strategy = materialize(tmp_output_path, output_path,
+                               move=remaining_uses[file_output.through.path] == 0)
+        context.fancy_output.progress(f"output {file_output.value.path} placed via {strategy}",
+                                      prefix=f"{action.image_name}: ")
 
-
-def socket_receiver(sock, stdout_stream, stderr_stream):
-    while True:
-        stream, length = next_frame_header(sock)
-        if stream == -1:
-            break
-        received = read_exactly(sock, length)
-        if stream == 1:
-            stdout_stream.write(received)
-        else:
-            stderr_stream.write(received)
-
-def socket_sender(sock, stdin_stream):
-    n = 512
-    buffer = b""
-    while True:
-        if len(buffer) == 0:
-            buffer = stdin_stream.read(n)
-            if len(buffer) == 0:
-                break
-        # TODO: use sendall
-        sent = sock.send(buffer)
-        buffer = buffer[sent:]
+def writable_output_path(context: Context, output: Output) -> Path:
+    output_path = context.context_absolute_path_for_mnb / output.value.path
+    ensure_writable_dir(output_path.parent)
+    return output_path
 
 def ensure_writable_dir(param):
     path = Path(param)
@@ -307,12 +548,200 @@ def update(cliopts: CommandLineOptions):
     if not mnb_file_path.exists():
         context.fancy_output.failure(f"mnb file {mnb_file_name} not found")
         sys.exit(1)
-    with mnb_file_path.open('r') as mnb_file:
-        mnb_file_json = json.load(mnb_file)
-        generator = spec_parser.parse_spec(mnb_file_json)
-        generator_output = execute_spec(generator, context)
-        spec = spec_parser.parse_spec(json.loads(generator_output))
-        execute_spec(spec, context)
+    hash_memo = enable_memo(context.context_absolute_path_for_mnb / ".mnb" / "cache" / "file-hashes.json")
+    validated_specs = spec_parser.enable_validated_specs_memo(
+        context.context_absolute_path_for_mnb / ".mnb" / "cache" / "validated-specs.json")
+    try:
+        with context.tracer.span("update"):
+            with context.tracer.span("parse bootstrap spec"):
+                mnb_file_text = mnb_file_path.read_bytes()
+                generator = spec_parser.parse_spec_bytes(mnb_file_text)
+                context.settings = generator.settings or Settings()
+            with context.tracer.span("generate spec"):
+                spec = generate_spec(generator, mnb_file_text, context)
+            with context.tracer.span("build plan graph", actions=len(spec.actions)):
+                graph = build_plan_graph(spec)
+                save_plan_index(spec, graph, plan_index_path(context))
+            if cliopts.targets:
+                # only what is needed to update the targets
+                execute_spec(spec, context, graph, graph.upstream_actions(cliopts.targets))
+            else:
+                execute_spec(spec, context, graph)
+    finally:
+        hash_memo.save()
+        validated_specs.save()
+        context.close()
+
+def watch(cliopts: CommandLineOptions):
+    """
+    Update values, then keep updating them as workspace files change: only actions downstream of changed files
+    are executed again, the spec is regenerated if mnb.json or generator inputs change.
+    """
+    context = Context(cliopts)
+    mnb_file_name = "mnb.json"
+    root = context.context_absolute_path_for_mnb
+    mnb_file_path = root / mnb_file_name
+    if not mnb_file_path.exists():
+        context.fancy_output.failure(f"mnb file {mnb_file_name} not found")
+        sys.exit(1)
+    hash_memo = enable_memo(root / ".mnb" / "cache" / "file-hashes.json")
+    validated_specs = spec_parser.enable_validated_specs_memo(root / ".mnb" / "cache" / "validated-specs.json")
+    try:
+        while True:
+            spec = graph = None
+            generator_paths = set()
+            try:
+                mnb_file_text = mnb_file_path.read_bytes()
+                generator = spec_parser.parse_spec_bytes(mnb_file_text)
+                context.settings = generator.settings or Settings()
+                generator_paths = consumed_paths(generator)
+                spec = generate_spec(generator, mnb_file_text, context)
+                graph = build_plan_graph(spec)
+                save_plan_index(spec, graph, plan_index_path(context))
+                execute_spec(spec, context, graph)
+            except Exception as e:
+                # keep watching, next change may fix the problem
+                context.fancy_output.failure(f"Update failed: {e}")
+            finally:
+                hash_memo.save()
+                validated_specs.save()
+            watch_for_changes(context, cliopts, mnb_file_name, generator_paths, spec, graph)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        hash_memo.save()
+        validated_specs.save()
+        context.close()
+
+def watch_for_changes(context: Context,
+                      cliopts: CommandLineOptions,
+                      mnb_file_name: str,
+                      generator_paths: Set[str],
+                      spec: Optional[Spec],
+                      graph: Optional[PlanGraph]):
+    """Execute actions affected by changes of source files, return when the spec has to be regenerated"""
+    (source_files, source_dirs) = graph.source_paths() if graph else (set(), set())
+    produced_paths = graph.produced_paths() if graph else set()
+    # dirs created to hold produced values
+    produced_paths |= {str(parent) for path in produced_paths for parent in PurePosixPath(path).parents}
+    parent_dirs = {str(PurePosixPath(path).parent) for path in source_files | generator_paths}
+    watcher = create_watcher(context.context_absolute_path_for_mnb,
+                             dirs=parent_dirs | {"."},
+                             recursive_dirs=source_dirs | generator_paths,
+                             poll=cliopts.poll)
+    try:
+        while True:
+            context.fancy_output.phase("Watching for changes")
+            changed = watcher.wait_for_changes(cliopts.debounce / 1000) - produced_paths
+            if requires_regeneration(changed, mnb_file_name, generator_paths, source_files, source_dirs):
+                return
+            if graph is None:
+                continue
+            actions = graph.downstream_actions(changed)
+            if not actions:
+                continue
+            context.fancy_output.phase(f"Changed: {', '.join(sorted(changed))}")
+            try:
+                execute_spec(spec, context, graph, actions)
+            except Exception as e:
+                context.fancy_output.failure(f"Update failed: {e}")
+    finally:
+        watcher.close()
+
+def requires_regeneration(changed: Set[str],
+                          mnb_file_name: str,
+                          generator_paths: Set[str],
+                          source_files: Set[str],
+                          source_dirs: Set[str]) -> bool:
+    """
+    True if changed paths may affect the generated spec. Sources of the current plan (files, and anything within
+    source dirs) are assumed not to, as they are handled by executing downstream actions, while any other change
+    of generator inputs may. The default generator consumes the whole workspace, so a generator input matching
+    a changed path more closely than plan sources do (e.g. the generator script itself) is what counts.
+    """
+    if mnb_file_name in changed:
+        return True
+    sources = {normalize_path(path) for path in source_files | source_dirs}
+    generator_paths = {normalize_path(path) for path in generator_paths}
+
+    def closest(path: str, paths: Set[str]) -> int:
+        """Depth of the deepest of paths the path is within, -1 if none"""
+        return max((len(path_parts(other)) for other in paths if is_within(path, other)), default=-1)
+
+    return any(closest(path, generator_paths) > closest(path, sources) for path in changed)
+
+def consumed_paths(spec: Spec) -> Set[str]:
+    """Paths of files and dirs the spec actions read, including build contexts"""
+    paths = set()
+    for action in spec.actions:
+        if isinstance(action, Exec):
+            paths.update(str(PurePosixPath(inp.value.path)) for inp in action.inputs if isinstance(inp.value, (File, Dir)))
+        elif isinstance(action, BuildImage) and not action.from_git:
+            paths.add(str(PurePosixPath(action.context_path)))
+    return paths
+
+def affected(cliopts: CommandLineOptions):
+    """Print actions and outputs downstream of given paths, as of the plan of the last update"""
+    context = Context(cliopts)
+    graph = load_plan_index(plan_index_path(context))
+    if graph is None:
+        context.fancy_output.failure("Plan index not found, run update first")
+        sys.exit(1)
+    actions = sorted(graph.downstream_actions(cliopts.paths), key=lambda action: action.number)
+    context.fancy_output.phase(f"Affected actions: {len(actions)}")
+    for action in actions:
+        context.fancy_output.progress(action.description)
+    outputs = sorted(node.value.path if isinstance(node.value, (File, Dir)) else node.value.image_name
+                     for action in actions for node in graph.action_node(action).output_value_nodes)
+    context.fancy_output.phase(f"Affected outputs: {len(outputs)}")
+    for output in outputs:
+        context.fancy_output.progress(output)
+
+def gc(cliopts: CommandLineOptions):
+    """Remove scratch dirs left over by interrupted runs"""
+    context = Context(cliopts)
+    mnb_dir = context.context_absolute_path_for_mnb / MNB_DIR_NAME
+    (removed, reclaimed) = collect_garbage(mnb_dir / "scratch")
+    legacy_path = mnb_dir / LEGACY_SCRATCH_DIR
+    if legacy_path.is_dir():
+        reclaimed += disk_usage(legacy_path)
+        removed += sum(1 for _ in legacy_path.iterdir())
+        shutil.rmtree(legacy_path, ignore_errors=True)
+    context.fancy_output.success(f"Removed {removed} scratch dirs, {reclaimed / 2**20:.1f} MB reclaimed")
+
+def plan_index_path(context: Context) -> Path:
+    return context.context_absolute_path_for_mnb / MNB_DIR_NAME / "cache" / "plan-index.json"
+
+def generate_spec(generator: Spec, mnb_file_text: bytes, context: Context) -> Spec:
+    """Execute the bootstrap spec, unless its inputs did not change since the last run, return generated spec"""
+    generator_cache = GeneratorCache(context.context_absolute_path_for_mnb / ".mnb" / "cache")
+    key = None
+    if context.use_cache:
+        with context.tracer.span("generator cache key"):
+            # outputs of the spec generated last time
+            last_graph = load_plan_index(plan_index_path(context))
+            produced_paths = [path for (path, node) in itertools.chain(last_graph.files.items(), last_graph.dirs.items())
+                              if node.producer is not None] if last_graph is not None else []
+            key = generator_cache.key_for(mnb_file_text, generator, context.context_absolute_path_for_mnb,
+                                          lambda image_name: local_image_id(image_name, context), produced_paths)
+        cached_output_path = generator_cache.output_path_for(key)
+        if cached_output_path is not None:
+            context.fancy_output.phase("Generator inputs did not change, reusing generated spec")
+            with context.tracer.span("parse generated spec"):
+                return spec_parser.parse_spec_file(cached_output_path)
+    # generator output is written straight to the cache, and parsed from there
+    output_path = generator_cache.prepare_output()
+    execute_spec(generator, context, result_path=output_path)
+    if key is not None and output_path.exists():
+        generator_cache.store(key)
+    with context.tracer.span("parse generated spec"):
+        return spec_parser.parse_spec_file(output_path)
+
+def local_image_id(image_name: str, context: Context) -> Optional[str]:
+    try:
+        return context.backend_for(image_name).image_id(image_name)
+    except ImageNotFound:
+        return None
 
 def init(cliopts):
     context = Context(cliopts)
@@ -1,3 +1,6 @@
+import threading
+from contextlib import contextmanager
+
 import console
 
 #◦○●•∙・❖◆✓˟
@@ -9,22 +12,40 @@ class FancyOutput:
         self.s_descr_success = console.fg.green
         self.s_phase = console.fg.white + console.fx.underline
         self.s_prefix = console.fg.yellow
+        self.s_tag = console.fg.cyan
         self.file = file
+        # lines from concurrently executed actions are written whole, and tagged with the action they belong to
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def tagged(self, tag):
+        """Prepend tag to every line printed by the current thread"""
+        prev_tag = getattr(self.local, 'tag', None)
+        self.local.tag = tag
+        try:
+            yield
+        finally:
+            self.local.tag = prev_tag
 
     def phase(self, text):
-        print(self.s_phase(text), file=self.file, flush=True)
+        self._print(self.s_phase(text))
 
     def progress(self, text, prefix = None):
-        if prefix:
-            print(self.s_prefix(prefix), file=self.file, end='')
-        print(self.s_descr_progress(text), file=self.file, flush=True)
+        self._print(self.s_descr_progress(text), prefix)
 
     def success(self, text, prefix = None):
-        if prefix:
-            print(self.s_prefix(prefix), file=self.file, end='')
-        print(self.s_descr_success(text), file=self.file, flush=True)
+        self._print(self.s_descr_success(text), prefix)
 
     def failure(self, text, prefix = None):
+        self._print(self.s_descr_failed(text), prefix)
+
+    def _print(self, styled_text, prefix = None):
+        line = styled_text
         if prefix:
-            print(self.s_prefix(prefix), file=self.file, end='')
-        print(self.s_descr_failed(text), file=self.file, flush=True)
+            line = self.s_prefix(prefix) + line
+        tag = getattr(self.local, 'tag', None)
+        if tag:
+            line = self.s_tag(tag) + line
+        with self.lock:
+            print(line, file=self.file, flush=True)
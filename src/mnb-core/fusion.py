@@ -0,0 +1,159 @@
+# Fusion of small Exec actions on the same image into a single container run
+#
+# Every container run pays for container create/start/stop/remove, which dominates for tiny commands (cp, sed,
+# graphviz renders...). This optional pass over the toposorted plan groups such actions. A group is executed by one
+# container running the commands one after another, every command in its own scratch dir, linked as /mnb/run
+# while the command runs; outputs of a command consumed by a later one are copied between scratch dirs.
+import shlex
+from typing import Callable, Dict, List, Tuple, Union
+
+from plan import is_within, normalize_path
+from spec import *
+
+# more commands per container only delay outputs (and failures) of the first ones
+MAX_FUSED_ACTIONS = 16
+
+
+class FusedExec:
+    """Exec actions on the same image, executed in order by a single container"""
+    __slots__ = ('actions',)
+    actions: List[Exec]
+
+    def __init__(self, actions: List[Exec]):
+        self.actions = actions
+
+    @property
+    def image_name(self) -> str:
+        return self.actions[0].image_name
+
+
+PlanNode = Union[Action, FusedExec]
+
+
+def is_fusable(action: Action) -> bool:
+    """
+    Only actions with file-based I/O: commands of a fused run have neither stdin, nor redirected stdout/stderr.
+    Actions asking for a tmpfs scratch dir are not small ones, so they keep their own container.
+    """
+    return (isinstance(action, Exec)
+            and action.tmpfs_size is None
+            and len(action.outputs) > 0
+            and all(isinstance(inp.value, (File, Dir)) and isinstance(inp.through, (ThroughFile, ThroughDir, ThroughEnvironment))
+                    for inp in action.inputs)
+            and all(isinstance(out.value, File) and isinstance(out.through, ThroughFile) for out in action.outputs))
+
+
+def fuse_actions(order: List[Action],
+                 dependencies: Dict[Action, List[Action]],
+                 can_fuse: Callable[[Action], bool],
+                 chains_only: bool) -> Dict[PlanNode, List[PlanNode]]:
+    """
+    Group actions (given in topological order) into fused runs, return dependencies between the resulting plan
+    nodes: FusedExec for groups, actions themselves for actions left alone. An action joins a group if:
+    - both are fusable (and pass can_fuse), on the same image, and the group is not full
+    - all its dependencies are in the group or are dependencies of the first action of the group, so groups
+      could not depend on each other in a cycle
+    - inputs produced in the group are consumed as files, not through environment or as parts of dirs
+    - with chains_only, it depends on an action of the group (independent actions are left to run concurrently)
+    """
+    fusable = {action for action in order if is_fusable(action) and can_fuse(action)}
+    groups: List[List[Action]] = list()
+    group_of: Dict[Action, List[Action]] = dict()
+    # the group most recently joined, per image
+    last_group: Dict[str, List[Action]] = dict()
+    for action in order:
+        group = None
+        if action in fusable:
+            candidates = [group_of[dep] for dep in dependencies[action] if dep in group_of]
+            if not chains_only and action.image_name in last_group:
+                candidates.append(last_group[action.image_name])
+            group = next((candidate for candidate in candidates
+                          if candidate[0] in fusable and can_join(candidate, action, dependencies, chains_only)), None)
+            if group is not None:
+                group.append(action)
+        if group is None:
+            group = [action]
+            groups.append(group)
+        group_of[action] = group
+        if action in fusable:
+            last_group[action.image_name] = group
+    node_of: Dict[Action, PlanNode] = dict()
+    for group in groups:
+        node = group[0] if len(group) == 1 else FusedExec(group)
+        for action in group:
+            node_of[action] = node
+    return {node_of[group[0]]: list(dict.fromkeys(node_of[dep]
+                                                  for action in group for dep in dependencies[action]
+                                                  if node_of[dep] is not node_of[group[0]]))
+            for group in groups}
+
+
+def can_join(group: List[Exec], action: Exec, dependencies: Dict[Action, List[Action]], chains_only: bool) -> bool:
+    if group[0].image_name != action.image_name or len(group) >= MAX_FUSED_ACTIONS:
+        return False
+    members = set(group)
+    allowed = members | set(dependencies[group[0]])
+    if any(dep not in allowed for dep in dependencies[action]):
+        return False
+    if chains_only and not any(dep in members for dep in dependencies[action]):
+        return False
+    produced = {normalize_path(out.value.path) for member in group for out in member.outputs}
+    for inp in action.inputs:
+        path = normalize_path(inp.value.path)
+        if path in produced:
+            if not (isinstance(inp.value, File) and isinstance(inp.through, ThroughFile)):
+                return False
+        elif any(is_within(produced_path, path) or is_within(path, produced_path) for produced_path in produced):
+            return False
+    return True
+
+
+class FusedStep:
+    """
+    Command of a fused run, with outputs of earlier steps to copy to its scratch dir before it starts, and
+    environment variables set for this command only
+    """
+    __slots__ = ('argv', 'workdir', 'copies', 'environment')
+    argv: List[str]
+    workdir: Optional[str]
+    # (index of producing step, path in its scratch dir, path in this step's scratch dir)
+    copies: List[Tuple[int, str, str]]
+    environment: Dict[str, str]
+
+    def __init__(self, argv: List[str], workdir: Optional[str], copies: List[Tuple[int, str, str]],
+                 environment: Optional[Dict[str, str]] = None):
+        self.argv = argv
+        self.workdir = workdir
+        self.copies = copies
+        self.environment = environment if environment is not None else dict()
+
+
+def step_dir(index: int) -> str:
+    return f"steps/{index}"
+
+
+def status_file(index: int, suffix: str) -> str:
+    return f"status/{index}.{suffix}"
+
+
+def fused_script(steps: List[FusedStep]) -> str:
+    """
+    Shell script running the steps one after another, from the dir holding steps/ and status/ (mounted at /mnb).
+    Stdout, stderr and exit code of step i are written to status/i.out, status/i.err and status/i.exit; the script
+    stops at the first failed step.
+    """
+    q = shlex.quote
+    lines = []
+    for (index, step) in enumerate(steps):
+        for (src_index, src_path, dst_path) in step.copies:
+            dst = f"{step_dir(index)}/{dst_path}"
+            lines.append(f"mkdir -p {q(str(PurePosixPath(dst).parent))} && "
+                         f"cp {q(f'{step_dir(src_index)}/{src_path}')} {q(dst)} || exit 1")
+        workdir = f"run/{step.workdir}" if step.workdir else "run"
+        lines.append(f"ln -sfn {step_dir(index)} run")
+        assignments = [q(f"{name}={value}") for (name, value) in step.environment.items()]
+        argv = (["env"] + assignments if assignments else []) + list(map(q, step.argv))
+        lines.append(f"(mkdir -p {q(workdir)} && cd {q(workdir)} && exec {' '.join(argv)}) "
+                     f"> {status_file(index, 'out')} 2> {status_file(index, 'err')}")
+        lines.append(f"code=$?; echo $code > {status_file(index, 'exit')}; [ $code -eq 0 ] || exit $code")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,92 @@
+# Cache of the spec generator output
+#
+# The bootstrap spec (mnb.json) usually builds or pulls an image and runs a generator in it, which prints the
+# real spec. The output is reused as long as the bootstrap spec, the local images the generator runs in and
+# everything it declares as its inputs are the same. Paths produced by the generated spec are not generator
+# inputs, even within a directory the generator reads (typically the whole workspace).
+import hashlib
+import os
+import posixpath
+from pathlib import Path
+from typing import Callable, Collection, Optional
+
+from build_fingerprint import build_fingerprint
+from errors import UnexpectedValueType
+from hashing import MNB_DIR_NAME, hash_dir, hash_file
+from plan import normalize_path, is_within
+from spec import *
+
+
+class GeneratorCache:
+    cache_dir: Path
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+
+    def key_for(self, bootstrap_spec_text: bytes, generator: Spec, root: Path,
+                image_id: Callable[[str], Optional[str]], produced_paths: Collection[str]) -> str:
+        """
+        Key of the generator output: `image_id` gives the id of a local image (None if absent),
+        `produced_paths` are outputs of the generated spec, skipped in input dirs
+        """
+        h = hashlib.sha256(bootstrap_spec_text)
+        excluded_paths = {MNB_DIR_NAME, *map(normalize_path, produced_paths)}
+        for action in generator.actions:
+            if isinstance(action, Exec):
+                h.update((image_id(action.image_name) or "").encode() + b"\0")
+                for inp in action.inputs:
+                    if isinstance(inp.value, Dir):
+                        h.update(hash_dir(root / inp.value.path, excluded_within(inp.value.path, excluded_paths)).encode())
+                    elif isinstance(inp.value, File):
+                        h.update(hash_file(root / inp.value.path).encode())
+                    else:
+                        raise UnexpectedValueType(inp.value)
+            elif isinstance(action, BuildImage):
+                if action.from_git:
+                    # revision is a part of the bootstrap spec already
+                    continue
+                context_path = root / action.context_path
+                fingerprint = build_fingerprint(context_path, action.dockerfile_path, action.build_args, None)
+                h.update(fingerprint.encode())
+        return h.hexdigest()
+
+    def output_path_for(self, key: str) -> Optional[Path]:
+        """Path to the output stored for the key, if any (large outputs are better parsed from file)"""
+        try:
+            if self.key_path.read_text() != key or not self.output_path.exists():
+                return None
+            return self.output_path
+        except FileNotFoundError:
+            return None
+
+    def prepare_output(self) -> Path:
+        """Path to write a new output to; the stored output is no longer reused, until the new one is stored"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # key is written last (by store), so that an interrupted run never leaves a key pointing to a wrong output
+        self.key_path.unlink(missing_ok=True)
+        return self.output_path
+
+    def store(self, key: str):
+        """Record the key of the output written to prepare_output() path"""
+        write_atomically(self.key_path, key.encode())
+
+    @property
+    def key_path(self) -> Path:
+        return self.cache_dir / "generator-key"
+
+    @property
+    def output_path(self) -> Path:
+        return self.cache_dir / "generator-output.json"
+
+
+def excluded_within(dir_path: str, excluded_paths: Collection[str]) -> Collection[str]:
+    """Excluded paths located under the dir, relative to it"""
+    dir_path = normalize_path(dir_path)
+    return {posixpath.relpath(path, dir_path) for path in excluded_paths
+            if path != dir_path and is_within(path, dir_path)}
+
+
+def write_atomically(path: Path, data: bytes):
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
@@ -0,0 +1,88 @@
+# Checkouts of git repositories used as image build contexts
+#
+# Every repository has a single object store under .mnb/repo/<repo dir>, and every revision used is checked out
+# into its own worktree under .mnb/repo/<repo dir>.worktrees/<commit>. Revisions are fetched one at a time and
+# shallowly; revisions given as commit ids are not fetched at all if they are already present.
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import git
+
+# full or abbreviated commit id
+COMMIT_ID_RE = re.compile("^[0-9a-fA-F]{7,40}$")
+
+DEFAULT_REV = "HEAD"
+
+
+class GitCheckouts:
+    repo_root: Path
+    repo_locks: Dict[str, threading.Lock]
+
+    def __init__(self, repo_root: Path):
+        self.repo_root = repo_root
+        self.repo_locks = dict()
+        self.lock = threading.Lock()
+
+    def checkout(self, repo_url: str, rev: Optional[str], progress) -> Tuple[Path, str]:
+        """
+        Make sure revision of the repo is checked out, return path to the worktree and the commit id.
+        progress is called with messages describing what is being done.
+        """
+        rev = rev or DEFAULT_REV
+        repo_dir = re.sub("[^a-zA-Z0-9.-]+", "-", repo_url)
+        with self.repo_lock(repo_dir):
+            repo = self.open_repo(repo_dir, repo_url, progress)
+            commit = None
+            if COMMIT_ID_RE.match(rev):
+                commit = resolve_commit(repo, rev)
+                if commit is not None:
+                    progress(f"commit {commit} is already present, fetch skipped")
+            if commit is None:
+                commit = fetch_rev(repo, rev, progress)
+            worktree_path = self.repo_root / f"{repo_dir}.worktrees" / commit
+            if (worktree_path / ".git").exists():
+                progress(f"use existing worktree {worktree_path}")
+            else:
+                progress(f"create worktree {worktree_path}")
+                # forget worktrees which were removed by hand
+                repo.git.worktree('prune')
+                repo.git.worktree('add', '--detach', '--force', str(worktree_path), commit)
+            return worktree_path, commit
+
+    def repo_lock(self, repo_dir: str) -> threading.Lock:
+        with self.lock:
+            return self.repo_locks.setdefault(repo_dir, threading.Lock())
+
+    def open_repo(self, repo_dir: str, repo_url: str, progress) -> git.Repo:
+        repo_path = self.repo_root / repo_dir
+        if repo_path.exists():
+            return git.Repo(str(repo_path))
+        progress(f"create new repository {repo_path}")
+        repo_path.mkdir(parents=True)
+        repo = git.Repo.init(str(repo_path), bare=True)
+        repo.create_remote('origin', repo_url)
+        return repo
+
+
+def resolve_commit(repo: git.Repo, rev: str) -> Optional[str]:
+    try:
+        return repo.git.rev_parse('--verify', '--quiet', f"{rev}^{{commit}}")
+    except git.GitCommandError:
+        return None
+
+
+def fetch_rev(repo: git.Repo, rev: str, progress) -> str:
+    try:
+        progress(f"shallow fetch of {rev}")
+        repo.git.fetch('origin', rev, depth=1)
+    except git.GitCommandError:
+        # some servers refuse to fetch commits by (abbreviated) id, fall back to fetching everything
+        progress("fetch all refs")
+        repo.remote('origin').fetch()
+        commit = resolve_commit(repo, rev)
+        if commit is None:
+            raise ValueError(f"Revision {rev} not found in repository {repo.remote('origin').url}")
+        return commit
+    return resolve_commit(repo, 'FETCH_HEAD')
@@ -0,0 +1,110 @@
+# Content hashing of values stored in the workspace
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Collection, Dict, Optional, Tuple
+
+CHUNK_SIZE = 1024 * 1024
+
+# mnb bookkeeping directory, never considered a part of any value
+MNB_DIR_NAME = ".mnb"
+
+
+# files modified more recently than that are not memoized, as their modification could go unnoticed
+# within timestamp granularity
+MEMO_MIN_AGE_NS = 2 * 10**9
+
+
+class HashMemo:
+    """
+    Content hashes of files, memoized by file identity (size, mtime, inode), so that unchanged files
+    are not read again. Persisted between runs.
+    """
+    entries: Dict[str, Tuple[int, int, int, str]]
+
+    def __init__(self, memo_path: Path):
+        self.memo_path = memo_path
+        self.lock = threading.Lock()
+        self.dirty = False
+        try:
+            with memo_path.open('r') as memo_file:
+                self.entries = {path: tuple(entry) for (path, entry) in json.load(memo_file).items()}
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = dict()
+
+    def hash_file(self, path) -> str:
+        key = os.path.abspath(path)
+        stat = os.stat(path)
+        identity = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[:3] == identity:
+            return entry[3]
+        digest = read_and_hash_file(path)
+        if time.time_ns() - stat.st_mtime_ns > MEMO_MIN_AGE_NS:
+            with self.lock:
+                self.entries[key] = identity + (digest,)
+                self.dirty = True
+        return digest
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            self.memo_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.memo_path.with_suffix(".tmp")
+            with tmp_path.open('w') as memo_file:
+                json.dump(self.entries, memo_file)
+            os.replace(tmp_path, self.memo_path)
+            self.dirty = False
+
+
+# memo used by hash_file, if enabled
+memo: Optional[HashMemo] = None
+
+
+def enable_memo(memo_path: Path) -> HashMemo:
+    global memo
+    memo = HashMemo(memo_path)
+    return memo
+
+
+def hash_file(path) -> str:
+    if memo is not None:
+        return memo.hash_file(path)
+    return read_and_hash_file(path)
+
+
+def read_and_hash_file(path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_dir(path, exclude: Collection[str] = (MNB_DIR_NAME,)) -> str:
+    """
+    Hash of directory tree: relative paths, file contents and symlink targets.
+    Entries at relative paths (normalized, with "/" separators) given in `exclude` are skipped.
+    """
+    root = Path(path)
+    h = hashlib.sha256()
+    for dir_path, dir_names, file_names in os.walk(root):
+        rel_dir = Path(dir_path).relative_to(root)
+        dir_names[:] = [d for d in dir_names if (rel_dir / d).as_posix() not in exclude]
+        file_names = [f for f in file_names if (rel_dir / f).as_posix() not in exclude]
+        dir_names.sort()
+        for dir_name in dir_names:
+            h.update(b"d\0" + str(rel_dir / dir_name).encode() + b"\0")
+        for file_name in sorted(file_names):
+            file_path = Path(dir_path) / file_name
+            rel_path = str(rel_dir / file_name).encode()
+            if file_path.is_symlink():
+                h.update(b"l\0" + rel_path + b"\0" + os.readlink(file_path).encode() + b"\0")
+            else:
+                h.update(b"f\0" + rel_path + b"\0" + hash_file(file_path).encode() + b"\0")
+    return h.hexdigest()
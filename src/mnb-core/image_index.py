@@ -0,0 +1,49 @@
+# Snapshot of images present in the local Docker daemon
+import threading
+from typing import Set
+
+from docker import DockerClient
+from docker.utils import parse_repository_tag
+
+DEFAULT_TAG = "latest"
+DEFAULT_REGISTRY_PREFIXES = ["docker.io/library/", "docker.io/", "index.docker.io/library/", "index.docker.io/"]
+
+
+class LocalImageIndex:
+    """
+    Names (tags and digests) of local images, listed once and then updated as images are built or pulled,
+    so that checking image presence does not need a daemon round-trip.
+    """
+    names: Set[str]
+
+    def __init__(self, client: DockerClient):
+        self.names = set()
+        self.lock = threading.Lock()
+        for image in client.images.list():
+            for name in image.attrs.get('RepoTags') or []:
+                self.names.add(normalize_image_name(name))
+            for name in image.attrs.get('RepoDigests') or []:
+                self.names.add(normalize_image_name(name))
+
+    def contains(self, image_name: str) -> bool:
+        with self.lock:
+            return normalize_image_name(image_name) in self.names
+
+    def add(self, image_name: str):
+        with self.lock:
+            self.names.add(normalize_image_name(image_name))
+
+
+def normalize_image_name(image_name: str) -> str:
+    """Canonical form of image reference: explicit tag (or digest), no default registry prefix"""
+    repository, tag = parse_repository_tag(image_name)
+    for prefix in DEFAULT_REGISTRY_PREFIXES:
+        if repository.startswith(prefix):
+            repository = repository[len(prefix):]
+            break
+    if tag is None:
+        return f"{repository}:{DEFAULT_TAG}"
+    elif tag.startswith("sha256:"):
+        return f"{repository}@{tag}"
+    else:
+        return f"{repository}:{tag}"
@@ -0,0 +1,105 @@
+# Incremental reading of a JSON document from a binary stream
+#
+# Only the structure the caller walks through (e.g. a top-level object and one of its arrays) is tokenized here,
+# every value read is decoded by the standard json decoder. So a huge array could be consumed item by item,
+# without the raw text or the decoded document being held in memory as a whole.
+import codecs
+import json
+from typing import Any, BinaryIO, Iterator, Tuple
+
+CHUNK_SIZE = 1024 * 1024
+WHITESPACE = " \t\n\r"
+
+
+class JsonStreamError(ValueError):
+    pass
+
+
+class JsonStream:
+    def __init__(self, stream: BinaryIO, chunk_size: int = CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Read next chunk into the buffer, dropping the consumed part; False at the end of stream"""
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self.eof = len(chunk) == 0
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+        return not self.eof
+
+    def peek(self) -> str:
+        """Next non-whitespace character, empty string at the end of stream"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise JsonStreamError(f"expected '{char}', found '{found or 'end of document'}'")
+        self.pos += 1
+
+    def read_value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+                # a number could continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise JsonStreamError(str(e)) from e
+            self.fill()
+
+    def read_object_items(self) -> Iterator[Tuple[str, 'JsonStream']]:
+        """
+        Iterate over keys of an object. The caller reads the value of every key (with read_value, or
+        read_array_items and so on) before moving to the next one.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            if not isinstance(key, str):
+                raise JsonStreamError(f"expected object key, found {key!r}")
+            self.expect(":")
+            yield key, self
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("}")
+                return
+
+    def read_array_items(self) -> Iterator[Any]:
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.read_value()
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("]")
+                return
+
+    def expect_end(self):
+        found = self.peek()
+        if found != "":
+            raise JsonStreamError(f"unexpected data after the end of document: '{found}'")
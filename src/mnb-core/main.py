@@ -15,7 +15,36 @@ def main():
     root_parser.add_argument('--dev-mode', dest="dev_mode", action='store_true',
                              help="Development mode (run outside of a container)")
     subparsers = root_parser.add_subparsers(dest='subcommand')
-    update_parser = subparsers.add_parser('update', help='perform actions to update values')
+    execution_options = argparse.ArgumentParser(add_help=False)
+    execution_options.add_argument('--no-cache', dest='no_cache', action='store_true',
+                                   help="Execute all actions and build all images, even if their inputs did not change")
+    execution_options.add_argument('--jobs', '-j', dest='jobs', type=positive_int, default=1,
+                                   help="Number of actions to execute concurrently")
+    execution_options.add_argument('--docker-pool-size', dest='docker_pool_size', type=positive_int,
+                                   help="Max number of kept-alive connections to Docker daemon (default: 2x jobs, at least 10)")
+    execution_options.add_argument('--warm-containers', dest='warm_containers', action='store_true',
+                                   help="Run commands in long-lived containers, one per image and concurrent action "
+                                        "(images must provide /bin/sh; inputs are copied instead of being mounted; "
+                                        "processes and /tmp are cleared between actions, other changes outside "
+                                        "/mnb/run, e.g. in $HOME, are seen by later actions)")
+    execution_options.add_argument('--fuse', dest='fuse', action='store_true',
+                                   help="Run chains of small actions on the same image in a single container "
+                                        "(images must provide /bin/sh; only actions with file inputs and outputs)")
+    execution_options.add_argument('--trace', dest='trace', metavar='FILE',
+                                   help="Write timing of the run to FILE, in Chrome trace event format (open with Perfetto)")
+    update_parser = subparsers.add_parser('update', parents=[execution_options], help='perform actions to update values')
+    update_parser.add_argument('targets', nargs='*', metavar='TARGET',
+                               help="Files or dirs to update, only actions they depend on are executed (default: all)")
+    watch_parser = subparsers.add_parser('watch', parents=[execution_options],
+                                         help='update values, then update them again whenever their inputs change')
+    watch_parser.add_argument('--poll', dest='poll', action='store_true',
+                              help="Poll for changes instead of relying on inotify (e.g. if the workspace is on a network share)")
+    watch_parser.add_argument('--debounce', dest='debounce', type=positive_int, default=100,
+                              help="Wait for that many milliseconds without changes before updating (default: 100)")
+    affected_parser = subparsers.add_parser('affected', help='list actions and outputs affected by changes of paths '
+                                                             '(as of the last update, nothing is executed)')
+    affected_parser.add_argument('paths', nargs='+', metavar='PATH', help="Changed files or dirs")
+    gc_parser = subparsers.add_parser('gc', help='remove scratch dirs left over by interrupted runs')
     init_parser = subparsers.add_parser('init', help='initialize a new project in the current directory')
     scripts_parser = subparsers.add_parser('scripts', help='update scripts')
 
@@ -33,11 +62,23 @@ def main():
 
     elif cliopts.subcommand == 'update':
         executor.update(cliopts)
+    elif cliopts.subcommand == 'watch':
+        executor.watch(cliopts)
+    elif cliopts.subcommand == 'affected':
+        executor.affected(cliopts)
+    elif cliopts.subcommand == 'gc':
+        executor.gc(cliopts)
     elif cliopts.subcommand == 'init':
         executor.init(cliopts)
     elif cliopts.subcommand == 'scripts':
         executor.scripts(cliopts)
 
+def positive_int(s: str) -> int:
+    value = int(s)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive number, got {s}")
+    return value
+
 def print_initial_help():
     print("To create mnb workspace and startup scripts, run:")
     print("  docker run -v $(pwd):/mnb/run --rm bberkgaut/mnb:latest init")
@@ -0,0 +1,79 @@
+# Placing output files produced in a scratch directory into the workspace
+#
+# Scratch directories live under .mnb in the workspace, so usually outputs could be just renamed into place.
+# Otherwise, the cheapest available way to get a copy is used: reflink (copy-on-write clone), hardlink,
+# and only then a real copy.
+import errno
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
+# ioctl request to clone file content, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+RENAME = "rename"
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+COPY = "copy"
+
+
+def materialize(src: Path, dst: Path, move: bool = True, allow_hardlink: bool = True) -> str:
+    """
+    Make file src available at path dst, atomically replacing dst.
+    When move is False, src is left intact (but may share storage with dst, unless allow_hardlink is False).
+    Returns the name of the strategy used.
+    """
+    if move:
+        try:
+            os.replace(src, dst)
+            return RENAME
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    tmp_path = dst.with_name(f".{dst.name}.{uuid.uuid4().hex}.mnb-tmp")
+    try:
+        strategy = copy_file(src, tmp_path, allow_hardlink)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return strategy
+
+
+def copy_file(src: Path, dst: Path, allow_hardlink: bool = True) -> str:
+    """Copy src to a new file dst, using the cheapest available strategy. Returns the name of the strategy used."""
+    if try_reflink(src, dst):
+        return REFLINK
+    if allow_hardlink:
+        try:
+            os.link(src, dst)
+            return HARDLINK
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    shutil.copymode(src, dst)
+    return COPY
+
+
+def try_reflink(src: Path, dst: Path) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(src, 'rb') as src_file, open(dst, 'xb') as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            except OSError:
+                dst_file.close()
+                os.unlink(dst)
+                return False
+    except OSError:
+        return False
+    shutil.copymode(src, dst)
+    return True
@@ -0,0 +1,66 @@
+# Index of items keyed by workspace paths, queried by containment
+#
+# Paths are relative to the workspace root, in POSIX style; "." is the root itself. Finding items at, above or
+# below a path takes time proportional to the path depth (plus the number of items found), not to the
+# number of items indexed.
+from typing import Dict, Generic, Iterator, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class PathTrieNode(Generic[T]):
+    __slots__ = ('children', 'items')
+    children: Dict[str, 'PathTrieNode[T]']
+    items: List[T]
+
+    def __init__(self):
+        self.children = dict()
+        self.items = list()
+
+
+class PathTrie(Generic[T]):
+    def __init__(self):
+        self.root = PathTrieNode()
+
+    def add(self, path: str, item: T):
+        node = self.root
+        for part in path_parts(path):
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = PathTrieNode()
+            node = child
+        node.items.append(item)
+
+    def items_containing(self, path: str) -> Iterator[T]:
+        """Items at the path and at all paths it is located under, outermost first"""
+        node = self.root
+        yield from node.items
+        for part in path_parts(path):
+            node = node.children.get(part)
+            if node is None:
+                return
+            yield from node.items
+
+    def items_within(self, path: str) -> Iterator[T]:
+        """Items at the path and at all paths located under it"""
+        node = self.find(path)
+        if node is None:
+            return
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            yield from node.items
+            pending.extend(node.children.values())
+
+    def find(self, path: str) -> Optional[PathTrieNode[T]]:
+        node = self.root
+        for part in path_parts(path):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+
+def path_parts(path: str) -> List[str]:
+    # same as PurePosixPath(path).parts for relative paths, but much faster
+    return [part for part in path.split("/") if part and part != "."]
@@ -1,7 +1,11 @@
 # Build toposorted execution plan on top of spec
-from graphlib import TopologicalSorter
+import itertools
+from graphlib import CycleError, TopologicalSorter
+from typing import Iterable, Set
 
-from errors import ImageSpecConflict, MissingImageSpec, UnexpectedValueType, ProducerConflict
+from errors import ImageSpecConflict, MissingImageSpec, UnexpectedValueType, ProducerConflict, \
+    UnknownTarget, DependencyCycle
+from path_trie import PathTrie
 from spec import *
 
 # could be rewritten using data-pipeline-like approach
@@ -11,6 +15,7 @@ from spec import *
 # !!! == or I could just implement dictionary/set key protocol for values. This protocol should be hash, eq, if I remember correctly
 
 class ValueNode:
+    __slots__ = ('value', 'consumers', 'producer')
     value: Union[File, Dir, Image]
     consumers: set[Action]
     producer: Optional[Action]
@@ -21,18 +26,117 @@ class ValueNode:
         self.producer = None
 
 class ActionNode:
+    __slots__ = ('action', 'input_value_nodes', 'output_value_nodes')
     action: Action
     input_value_nodes: set[ValueNode]
+    output_value_nodes: set[ValueNode]
 
     def __init__(self, action):
         self.action = action
         self.input_value_nodes = set()
+        self.output_value_nodes = set()
+
+class PlanGraph:
+    images: Dict[str, ValueNode]
+    files: Dict[str, ValueNode]
+    dirs: Dict[str, ValueNode]
+    action_nodes: set[ActionNode]
+
+    def __init__(self):
+        self.images = dict()
+        self.files = dict()
+        self.dirs = dict()
+        self.action_nodes = set()
+        self._action_node_by_action = None
+        self._path_index = None
+
+    def action_node(self, action: Action) -> ActionNode:
+        if self._action_node_by_action is None:
+            self._action_node_by_action = {action_node.action: action_node for action_node in self.action_nodes}
+        return self._action_node_by_action[action]
+
+    def source_paths(self) -> Tuple[Set[str], Set[str]]:
+        """Paths of files and dirs consumed by actions, but not produced by any action"""
+        return ({path for (path, node) in self.files.items() if node.producer is None and node.consumers},
+                {path for (path, node) in self.dirs.items() if node.producer is None and node.consumers})
+
+    def produced_paths(self) -> Set[str]:
+        return ({path for (path, node) in self.files.items() if node.producer is not None} |
+                {path for (path, node) in self.dirs.items() if node.producer is not None})
+
+    @property
+    def path_index(self) -> PathTrie[ValueNode]:
+        """File and dir values indexed by their paths"""
+        if self._path_index is None:
+            self._path_index = PathTrie()
+            for node in itertools.chain(self.files.values(), self.dirs.values()):
+                self._path_index.add(node.value.path, node)
+        return self._path_index
+
+    def value_nodes_containing(self, path: str) -> List[ValueNode]:
+        """File and dir values at the path, and all dir values the path is within"""
+        return [node for node in self.path_index.items_containing(path)
+                if isinstance(node.value, Dir) or is_same_path(node.value.path, path)]
+
+    def downstream_actions(self, changed_paths: Iterable[str]) -> Set[Action]:
+        """Actions consuming changed paths, directly or through outputs of other actions"""
+        result: Set[Action] = set()
+        pending: List[ValueNode] = [node for path in changed_paths for node in self.value_nodes_containing(path)]
+        visited_value_nodes: Set[ValueNode] = set()
+        while pending:
+            value_node = pending.pop()
+            if value_node in visited_value_nodes:
+                continue
+            visited_value_nodes.add(value_node)
+            for consumer in value_node.consumers:
+                if consumer in result:
+                    continue
+                result.add(consumer)
+                # consumers of dirs containing outputs are consumers of the outputs as well
+                pending.extend(self.action_node(consumer).output_value_nodes)
+        return result
+
+    def producers_of(self, path: str) -> Set[Action]:
+        """Actions producing the path, values within it, or a dir containing it"""
+        nodes = itertools.chain(self.value_nodes_containing(path), self.path_index.items_within(path))
+        return {node.producer for node in nodes if node.producer is not None}
+
+    def upstream_actions(self, targets: Iterable[str]) -> Set[Action]:
+        """Actions needed to update target paths: their producers, and everything those transitively depend on"""
+        result: Set[Action] = set()
+        pending: List[Action] = []
+        for target in targets:
+            producers = self.producers_of(target)
+            if not producers:
+                raise UnknownTarget(target)
+            pending.extend(producers)
+        while pending:
+            action = pending.pop()
+            if action in result:
+                continue
+            result.add(action)
+            for value_node in self.action_node(action).input_value_nodes:
+                if value_node.producer is not None:
+                    pending.append(value_node.producer)
+        return result
+
+    def dependencies(self) -> Dict[Action, List[Action]]:
+        """Maps every action to the list of actions producing its inputs"""
+        return {action_node.action: list(dict.fromkeys(value_node.producer
+                                                       for value_node in action_node.input_value_nodes
+                                                       if value_node.producer is not None))
+                for action_node in self.action_nodes}
 
 def toposort_actions(spec: Spec) -> List[Action]:
-    images: Dict[str, ValueNode] = dict()
-    files: Dict[str, ValueNode] = dict()
-    dirs: Dict[str, ValueNode] = dict()
-    action_nodes: set[ActionNode] = set()
+    ts = TopologicalSorter(build_plan_graph(spec).dependencies())
+    return list(ts.static_order())
+
+def build_plan_graph(spec: Spec) -> PlanGraph:
+    graph = PlanGraph()
+    images = graph.images
+    files = graph.files
+    dirs = graph.dirs
+    action_nodes = graph.action_nodes
 
     # Collect images produced by pull/build actions
     for action in spec.actions:
@@ -43,6 +147,7 @@ def toposort_actions(spec: Spec) -> List[Action]:
                 images[action.image_name] = value_node
                 images[action.image_name].producer = action
                 action_node = ActionNode(action)
+                action_node.output_value_nodes.add(value_node)
                 action_nodes.add(action_node)
             else:
                 raise ImageSpecConflict(action, prev_definition=images[action.image_name].producer)
@@ -82,19 +187,91 @@ def toposort_actions(spec: Spec) -> List[Action]:
                     if files[out.value.path].producer is not None:
                         raise ProducerConflict(out.value, action, prev_producer=files[out.value.path].producer)
                     files[out.value.path].producer = action
+                    action_node.output_value_nodes.add(files[out.value.path])
                 elif isinstance(out.value, Dir):
                     if out.value.path not in dirs:
                         dirs[out.value.path] = ValueNode(out.value)
                     if dirs[out.value.path].producer is not None:
-                        raise ProducerConflict(out.value, action, prev_producer=files[out.value.path].producer)
+                        raise ProducerConflict(out.value, action, prev_producer=dirs[out.value.path].producer)
                     dirs[out.value.path].producer = action
+                    action_node.output_value_nodes.add(dirs[out.value.path])
                 else:
                     raise UnexpectedValueType(out.value)
-    # Topologically sort
-    ts = TopologicalSorter()
-    for action_node in action_nodes:
-        action = action_node.action
-        predecessors = list(filter(lambda x: x is not None, map(lambda value_node: value_node.producer, action_node.input_value_nodes)))
-        ts.add(action, *predecessors)
-    return list(ts.static_order())
+    add_containment_dependencies(graph)
+    return graph
+
+
+def add_containment_dependencies(graph: PlanGraph):
+    """
+    Make consumers of a path depend on producers of paths within it or containing it (e.g. an action consuming
+    dir "data" on an action producing file "data/x.csv"), and check that no produced values overlap.
+    There is no such dependency on a producer which itself depends on the consumer, directly or through a dir
+    containing its outputs (e.g. two actions both consuming dir "docs" and producing "docs/a.pdf" and
+    "docs/b.pdf" take the dir as sources, and do not depend on each other).
+    """
+    produced = PathTrie()
+    # dirs are indexed on their own, usually there are few of them, so looking for ones containing a path is cheap
+    produced_dirs = PathTrie()
+    for node in itertools.chain(graph.files.values(), graph.dirs.values()):
+        if node.producer is not None:
+            produced.add(node.value.path, node)
+            if isinstance(node.value, Dir):
+                produced_dirs.add(node.value.path, node)
+    for node in itertools.chain(graph.files.values(), graph.dirs.values()):
+        if node.producer is None:
+            continue
+        # trie keys are normalized, so the same path spelled differently ("a/b", "./a/b") is found as well
+        same_path = produced.find(node.value.path).items
+        for other in itertools.chain(produced_dirs.items_containing(node.value.path), same_path):
+            if other is not node and other.producer is not node.producer:
+                raise ProducerConflict(node.value, node.producer, prev_producer=other.producer)
+
+    # direct dependencies, before containment ones are added
+    input_producers = {action_node.action: {node.producer for node in action_node.input_value_nodes}
+                       for action_node in graph.action_nodes}
+    consumed_dirs = {action_node.action: [normalize_path(node.value.path) for node in action_node.input_value_nodes
+                                          if isinstance(node.value, Dir)]
+                     for action_node in graph.action_nodes}
+
+    def depends_on(action: Action, other_action: Action) -> bool:
+        return (other_action in input_producers[action]
+                or any(is_within(normalize_path(node.value.path), dir_path)
+                       for node in graph.action_node(other_action).output_value_nodes
+                       for dir_path in consumed_dirs[action]))
+
+    added = False
+    for action_node in graph.action_nodes:
+        for input_node in list(action_node.input_value_nodes):
+            if isinstance(input_node.value, File):
+                related = produced_dirs.items_containing(input_node.value.path)
+            elif isinstance(input_node.value, Dir):
+                related = itertools.chain(produced_dirs.items_containing(input_node.value.path),
+                                          produced.items_within(input_node.value.path))
+            else:
+                continue
+            for produced_node in related:
+                if produced_node is input_node or produced_node.producer is action_node.action:
+                    continue
+                if depends_on(produced_node.producer, action_node.action):
+                    continue
+                produced_node.consumers.add(action_node.action)
+                action_node.input_value_nodes.add(produced_node)
+                added = True
+    if added:
+        # containment could close a cycle (e.g. through outputs consumed by a producer), report it as a spec error
+        try:
+            TopologicalSorter(graph.dependencies()).prepare()
+        except CycleError as e:
+            cycle = e.args[1]
+            raise DependencyCycle(cycle[0], cycle[1])
+
+
+def normalize_path(path: str) -> str:
+    return str(PurePosixPath(path))
+
+def is_same_path(path: str, other_path: str) -> bool:
+    return path == other_path or normalize_path(path) == normalize_path(other_path)
 
+def is_within(path: str, dir_path: str) -> bool:
+    """True if path is dir_path itself, or is located under it (both paths normalized, relative to workspace root)"""
+    return dir_path == "." or path == dir_path or path.startswith(dir_path + "/")
@@ -0,0 +1,104 @@
+# On-disk index of the plan graph: which actions produce and consume which values
+#
+# Written on every update, so that questions like "what do these changed files affect" can be answered
+# without generating the spec or talking to Docker.
+import json
+import os
+import posixpath
+from pathlib import Path
+from typing import Dict, List
+
+from fusion import FusedExec
+from plan import PlanGraph, ActionNode, ValueNode, is_within, normalize_path
+from spec import *
+
+# bump when the index format changes
+INDEX_VERSION = 2
+
+
+class IndexedAction:
+    """Stand-in for an action of the indexed plan"""
+    number: int
+    description: str
+
+    def __init__(self, number: int, description: str):
+        self.number = number
+        self.description = description
+
+    def __repr__(self):
+        return f"IndexedAction({self.number}, {self.description!r})"
+
+
+def describe_action(action: Action) -> str:
+    if isinstance(action, PullImage):
+        return f"pull {action.image_name}"
+    elif isinstance(action, BuildImage):
+        return f"build {action.image_name}"
+    elif isinstance(action, Exec):
+        return f"exec {action.image_name} {action.command}"
+    elif isinstance(action, FusedExec):
+        return f"fused {action.image_name} {[fused_action.command for fused_action in action.actions]}"
+    return str(action)
+
+
+def save_plan_index(spec: Spec, graph: PlanGraph, path: Path):
+    numbers = {action: number for (number, action) in enumerate(spec.actions)}
+
+    def values_json(value_nodes: Dict[str, ValueNode]):
+        return {key: {"producer": numbers[node.producer] if node.producer is not None else None,
+                      "consumers": sorted(numbers[consumer] for consumer in node.consumers)}
+                for (key, node) in value_nodes.items()}
+
+    index_json = {
+        "version": INDEX_VERSION,
+        "actions": [describe_action(action) for action in spec.actions],
+        "images": values_json(graph.images),
+        "files": values_json(graph.files),
+        "dirs": values_json(graph.dirs),
+    }
+    # build contexts and Dockerfiles are not values of the plan, but users of the built image depend on them
+    for action in spec.actions:
+        if isinstance(action, BuildImage) and not action.from_git:
+            context_path = normalize_path(action.context_path)
+            add_consumer(index_json["dirs"], context_path, numbers[action])
+            if action.dockerfile_path:
+                dockerfile_path = posixpath.normpath(posixpath.join(context_path, action.dockerfile_path))
+                if not is_within(dockerfile_path, context_path):
+                    add_consumer(index_json["files"], dockerfile_path, numbers[action])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(index_json))
+    os.replace(tmp_path, path)
+
+
+def add_consumer(values_json: dict, path: str, number: int):
+    entry = values_json.setdefault(path, {"producer": None, "consumers": []})
+    entry["consumers"] = sorted(set(entry["consumers"]) | {number})
+
+
+def load_plan_index(path: Path) -> Optional[PlanGraph]:
+    """Plan graph with IndexedAction in place of actions, or None if there is no (compatible) index"""
+    try:
+        index_json = json.loads(path.read_bytes())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if index_json.get("version") != INDEX_VERSION:
+        return None
+    graph = PlanGraph()
+    actions: List[IndexedAction] = [IndexedAction(number, description)
+                                    for (number, description) in enumerate(index_json["actions"])]
+    action_nodes = [ActionNode(action) for action in actions]
+    graph.action_nodes.update(action_nodes)
+    for (kind, value_nodes, value_class) in (("images", graph.images, Image),
+                                             ("files", graph.files, File),
+                                             ("dirs", graph.dirs, Dir)):
+        for (key, entry) in index_json[kind].items():
+            node = ValueNode(value_class(key))
+            if entry["producer"] is not None:
+                node.producer = actions[entry["producer"]]
+                action_nodes[entry["producer"]].output_value_nodes.add(node)
+            for consumer in entry["consumers"]:
+                node.consumers.add(actions[consumer])
+                action_nodes[consumer].input_value_nodes.add(node)
+            value_nodes[key] = node
+    return graph
@@ -0,0 +1,99 @@
+# Run actions concurrently, respecting dependencies between them
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait, Future
+from graphlib import TopologicalSorter
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+from spec import *
+
+
+class SchedulingAborted(Exception):
+    """Raised after a failed action, when some actions were left unscheduled"""
+    def __init__(self, cause: BaseException, not_started: int):
+        super().__init__(f'{cause} ({not_started} actions not started)')
+        self.cause = cause
+        self.not_started = not_started
+
+
+def run_actions(dependencies: Dict[Action, List[Action]],
+                jobs: int,
+                execute: Callable[[Action], Any],
+                priorities: Optional[Dict[Action, float]] = None) -> List[Tuple[Action, Any]]:
+    """
+    Execute actions using up to `jobs` worker threads. An action is started only after all of its dependencies
+    have completed. Of the actions ready to start, ones with higher priority go first (ones which became ready
+    earlier, if there are no priorities). After the first failure no new actions are started; actions already
+    running are waited for, and then the failure is re-raised.
+
+    Returns (action, result) pairs in order of completion.
+    """
+    ts = TopologicalSorter(dependencies)
+    ts.prepare()
+    # heap of (-priority, sequence number, action)
+    ready: List[Tuple[float, int, Action]] = list()
+    sequence = itertools.count()
+    running: Dict[Future, Action] = dict()
+    completed: List[Tuple[Action, Any]] = list()
+    failure = None
+    failed = 0
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="mnb-worker") as pool:
+        while True:
+            if failure is None:
+                for action in ts.get_ready():
+                    priority = priorities.get(action, 0.0) if priorities is not None else 0.0
+                    heapq.heappush(ready, (-priority, next(sequence), action))
+                while ready and len(running) < jobs:
+                    (_, _, action) = heapq.heappop(ready)
+                    running[pool.submit(execute, action)] = action
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                action = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    failed += 1
+                    if failure is None:
+                        failure = error
+                else:
+                    completed.append((action, future.result()))
+                    ts.done(action)
+    if failure is not None:
+        not_started = len(dependencies) - len(completed) - failed
+        if not_started > 0:
+            raise SchedulingAborted(failure, not_started) from failure
+        raise failure
+    return completed
+
+
+def remaining_path_lengths(dependencies: Dict[Action, List[Action]],
+                           duration: Callable[[Action], float]) -> Dict[Action, float]:
+    """Maps every action to the duration of the longest chain of actions starting with it (its own included)"""
+    dependents = dependents_of(dependencies)
+    lengths: Dict[Action, float] = dict()
+    # dependents come first in the reversed topological order
+    for action in reversed(list(TopologicalSorter(dependencies).static_order())):
+        longest_after = max((lengths[dependent] for dependent in dependents.get(action, ())), default=0.0)
+        lengths[action] = duration(action) + longest_after
+    return lengths
+
+
+def critical_path(dependencies: Dict[Action, List[Action]], lengths: Dict[Action, float]) -> List[Action]:
+    """Longest chain of actions, given remaining path lengths computed by remaining_path_lengths"""
+    dependents = dependents_of(dependencies)
+    path = []
+    candidates = [action for (action, deps) in dependencies.items() if not deps]
+    while candidates:
+        action = max(candidates, key=lambda candidate: lengths[candidate])
+        path.append(action)
+        candidates = dependents.get(action, [])
+    return path
+
+
+def dependents_of(dependencies: Dict[Action, List[Action]]) -> Dict[Action, List[Action]]:
+    dependents: Dict[Action, List[Action]] = dict()
+    for (action, deps) in dependencies.items():
+        for dep in deps:
+            dependents.setdefault(dep, []).append(action)
+    return dependents
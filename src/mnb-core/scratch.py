@@ -0,0 +1,168 @@
+# Scratch dirs for command runs, under .mnb/scratch
+#
+# Every mnb process gets its own session dir there, created on first use and locked (flock on a lock file next to
+# it) while the process runs. A scratch dir is emptied as soon as it is released, and kept for reuse by later runs,
+# so disk space is taken only by runs in progress. Session dirs are removed when the process finishes; ones left
+# by processes which did not finish cleanly are removed by `mnb gc`.
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path, PurePath
+from typing import List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
+# emptied dirs kept for reuse, more are removed
+MAX_FREE_DIRS = 16
+LOCK_SUFFIX = ".lock"
+
+
+class ScratchDir:
+    """Scratch dir, as seen by mnb and by the Docker daemon (for bind mounts)"""
+    __slots__ = ('path', 'path_on_host')
+    path: Path
+    path_on_host: PurePath
+
+    def __init__(self, path: Path, path_on_host: PurePath):
+        self.path = path
+        self.path_on_host = path_on_host
+
+
+class ScratchAllocator:
+    free: List[ScratchDir]
+
+    def __init__(self, root: Path, root_on_host: PurePath, max_free: int = MAX_FREE_DIRS):
+        self.root = root
+        self.root_on_host = root_on_host
+        self.max_free = max_free
+        self.lock = threading.Lock()
+        self.session: Optional[str] = None
+        self.lock_file = None
+        self.free = list()
+        self.count = 0
+
+    def allocate(self) -> ScratchDir:
+        """Empty dir, not used by any other run"""
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+            if self.session is None:
+                self.open_session()
+            self.count += 1
+            name = f"{self.session}/{self.count}"
+        scratch_dir = ScratchDir(self.root / name, self.root_on_host / name)
+        scratch_dir.path.mkdir()
+        return scratch_dir
+
+    def release(self, scratch_dir: ScratchDir):
+        """Empty the dir, keep it for reuse"""
+        if empty_dir(scratch_dir.path):
+            with self.lock:
+                if self.session is not None and len(self.free) < self.max_free:
+                    self.free.append(scratch_dir)
+                    return
+        shutil.rmtree(scratch_dir.path, ignore_errors=True)
+
+    @contextmanager
+    def scratch_dir(self):
+        scratch_dir = self.allocate()
+        try:
+            yield scratch_dir
+        finally:
+            self.release(scratch_dir)
+
+    def open_session(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        session = uuid.uuid4().hex
+        # locked (under a temporary name, skipped by gc) before the session dir exists, so that gc never sees
+        # the session unlocked
+        tmp_lock_path = self.root / f".{session}{LOCK_SUFFIX}"
+        self.lock_file = open(tmp_lock_path, 'w')
+        if fcntl is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        os.replace(tmp_lock_path, self.root / (session + LOCK_SUFFIX))
+        (self.root / session).mkdir()
+        self.session = session
+
+    def close(self):
+        """Remove the session dir with all scratch dirs (runs must be finished)"""
+        with self.lock:
+            if self.session is None:
+                return
+            shutil.rmtree(self.root / self.session, ignore_errors=True)
+            (self.root / (self.session + LOCK_SUFFIX)).unlink(missing_ok=True)
+            self.lock_file.close()
+            self.session = None
+            self.free = list()
+
+
+def empty_dir(path: Path) -> bool:
+    """Remove everything in the dir, return False if something could not be removed"""
+    try:
+        for entry in path.iterdir():
+            if entry.is_dir() and not entry.is_symlink():
+                shutil.rmtree(entry)
+            else:
+                entry.unlink()
+        return True
+    except OSError:
+        return False
+
+
+def collect_garbage(root: Path) -> Tuple[int, int]:
+    """Remove session dirs of processes no longer running, return the number of dirs removed and bytes reclaimed"""
+    if not root.is_dir():
+        return 0, 0
+    removed = 0
+    reclaimed = 0
+    for path in root.iterdir():
+        if path.name.startswith(".") or path.suffix == LOCK_SUFFIX \
+                or session_in_use(path.with_name(path.name + LOCK_SUFFIX)):
+            continue
+        reclaimed += disk_usage(path)
+        if path.is_dir() and not path.is_symlink():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+        removed += 1
+    # lock files of finished sessions
+    for lock_path in root.glob("[!.]*" + LOCK_SUFFIX):
+        if not lock_path.with_suffix("").exists() and not session_in_use(lock_path):
+            lock_path.unlink(missing_ok=True)
+    return removed, reclaimed
+
+
+def session_in_use(lock_path: Path) -> bool:
+    try:
+        with open(lock_path, 'r') as lock_file:
+            if fcntl is None:
+                # could not tell, the lock file is removed when the session is closed
+                return True
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return False
+    except FileNotFoundError:
+        return False
+
+
+def disk_usage(path: Path) -> int:
+    """Bytes taken by files under the path (symlinks are not followed)"""
+    if not path.is_dir() or path.is_symlink():
+        return path.lstat().st_size
+    total = 0
+    for (dir_path, dir_names, file_names) in os.walk(path):
+        for name in file_names:
+            try:
+                total += os.lstat(os.path.join(dir_path, name)).st_size
+            except OSError:
+                pass
+    return total
@@ -1,28 +1,167 @@
-from typing import Optional
-
-from jsonschema.validators import validate
+import hashlib
+import io
 import json
+import os
+import threading
+from pathlib import Path
+from typing import BinaryIO, List, Optional
+
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
 import spec
 
 from errors import ParseError
+from json_stream import JsonStream
 import common
 
-with (common.get_lib_path() / "spec-schema.json").open("r") as schema_file:
-    schema = json.load(schema_file)
+with (common.get_lib_path() / "spec-schema.json").open("rb") as schema_file:
+    schema_bytes = schema_file.read()
+schema = json.loads(schema_bytes)
+# validator is built once, validation of a big spec is then a single walk over the document
+schema_validator_class = validator_for(schema)
+schema_validator_class.check_schema(schema)
+schema_validator = schema_validator_class(schema)
+# actions of big specs are validated one by one as they are parsed, by the same validator (so $refs resolve
+# against the whole schema)
+action_schema = schema["properties"]["actions"]["items"]
+schema_digest = hashlib.sha256(schema_bytes).digest()
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# hashes of validated documents remembered between runs, most recent last
+VALIDATED_MEMO_SIZE = 64
+
+
+class ValidatedSpecs:
+    """Hashes of spec documents known to be valid (against the current schema), persisted between runs"""
+    digests: List[str]
+
+    def __init__(self, memo_path: Optional[Path]):
+        self.memo_path = memo_path
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.digests = []
+        if memo_path is not None:
+            try:
+                with memo_path.open('r') as memo_file:
+                    self.digests = json.load(memo_file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+
+    def contains(self, digest: str) -> bool:
+        with self.lock:
+            return digest in self.digests
+
+    def add(self, digest: str):
+        with self.lock:
+            self.digests.append(digest)
+            del self.digests[:-VALIDATED_MEMO_SIZE]
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if self.memo_path is None or not self.dirty:
+                return
+            self.memo_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.memo_path.with_suffix(".tmp")
+            with tmp_path.open('w') as memo_file:
+                json.dump(self.digests, memo_file)
+            os.replace(tmp_path, self.memo_path)
+            self.dirty = False
+
+
+validated_specs = ValidatedSpecs(None)
+
+
+def enable_validated_specs_memo(memo_path: Path) -> ValidatedSpecs:
+    global validated_specs
+    validated_specs = ValidatedSpecs(memo_path)
+    return validated_specs
+
+
+def parse_spec_bytes(data: bytes) -> spec.Spec:
+    """Parse spec JSON document, validation is skipped if the same document was validated already"""
+    digest = hashlib.sha256(schema_digest + data).hexdigest()
+    return parse_validated_stream(io.BytesIO(data), digest)
+
+
+def parse_spec_file(path: Path) -> spec.Spec:
+    """Same as parse_spec_bytes, but the document is never read into memory as a whole"""
+    h = hashlib.sha256(schema_digest)
+    with path.open('rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            h.update(chunk)
+    with path.open('rb') as f:
+        return parse_validated_stream(f, h.hexdigest())
+
+
+def parse_validated_stream(stream: BinaryIO, digest: str) -> spec.Spec:
+    if validated_specs.contains(digest):
+        return parse_spec_stream(stream, validate_document=False)
+    result = parse_spec_stream(stream, validate_document=True)
+    validated_specs.add(digest)
+    return result
+
+
+def parse_spec_stream(stream: BinaryIO, validate_document: bool = True) -> spec.Spec:
+    """
+    Parse spec JSON document incrementally: actions are validated and turned into spec objects one at a time,
+    as they are read from the stream
+    """
+    reader = JsonStream(stream)
+    header_json = dict()
+    actions = []
+    for (key, _) in reader.read_object_items():
+        if key == 'actions':
+            header_json['actions'] = []
+            for action_json in reader.read_array_items():
+                if validate_document:
+                    validate_action(action_json)
+                actions.append(parse_action(action_json))
+        else:
+            header_json[key] = reader.read_value()
+    reader.expect_end()
+    if validate_document:
+        # everything but the actions, which were validated already
+        validate(header_json)
+    return build_spec(header_json, actions)
+
 
 def parse_spec(parsed_json) -> spec.Spec:
-    validate(parsed_json, schema)
-    [maj_str, min_str] = parsed_json['spec_version'].split('.')
+    validate(parsed_json)
+    return build_spec(parsed_json, list(map(parse_action, parsed_json['actions'])))
+
+
+def validate(parsed_json):
+    # same error jsonschema.validate would raise
+    error = best_match(schema_validator.iter_errors(parsed_json))
+    if error is not None:
+        raise error
+
+
+def validate_action(action_json):
+    error = best_match(schema_validator.descend(action_json, action_schema))
+    if error is not None:
+        raise error
+
+
+def build_spec(header_json, actions: List['spec.Action']) -> spec.Spec:
+    [maj_str, min_str] = header_json['spec_version'].split('.')
     spec_version = (int(maj_str), int(min_str))
-    description = parsed_json.get('description')
-    actions = map(parse_action, parsed_json['actions'])
-    return spec.Spec(spec_version, list(actions), description)
+    description = header_json.get('description')
+    settings = parse_settings(header_json.get('settings'))
+    return spec.Spec(spec_version, actions, description, settings)
+
+def parse_settings(settings_json) -> Optional[spec.Settings]:
+    if settings_json is None:
+        return None
+    return spec.Settings(backends=settings_json.get('backends'))
 
 def parse_action(parsed_json) -> 'spec.Action':
     if 'pull_image' in parsed_json:
         action_json = parsed_json['pull_image']
         image_name = action_json['image_name']
-        return spec.PullImage(image_name)
+        pull_policy = action_json.get('pull_policy', spec.PULL_ALWAYS)
+        return spec.PullImage(image_name, pull_policy)
     elif 'build_image' in parsed_json:
         action_json = parsed_json['build_image']
         image_name = action_json['image_name']
@@ -40,7 +179,8 @@ def parse_action(parsed_json) -> 'spec.Action':
         workdir = action_json.get("workdir")
         inputs = map(parse_input, action_json.get('inputs', []))
         outputs = map(parse_output, action_json.get('outputs', []))
-        return spec.Exec(image_name, command, entrypoint, workdir, list(inputs), list(outputs))
+        tmpfs_size = action_json.get("tmpfs_size")
+        return spec.Exec(image_name, command, entrypoint, workdir, list(inputs), list(outputs), tmpfs_size)
     else:
         raise ParseError(f"invalid action {parsed_json}")
 
@@ -48,7 +188,7 @@ def parse_from_git(parsed_json) -> Optional[spec.FromGit]:
     if parsed_json is None:
         return None
     else:
-        return spec.FromGit(parsed_json['repo'], parsed_json['rev'])
+        return spec.FromGit(parsed_json['repo'], parsed_json.get('rev'))
 
 def parse_input(parsed_json) -> 'spec.Input':
     value = parse_value(parsed_json['value'])
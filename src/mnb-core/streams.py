@@ -0,0 +1,280 @@
+# Streaming of container stdio to and from files
+import io
+import os
+import shutil
+import socket
+import stat
+import subprocess
+import struct
+import tarfile
+import tempfile
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, List, BinaryIO, Tuple
+
+# size of a single read from container socket, bounds memory used per stream
+BUFFER_SIZE = 64 * 1024
+
+# header of a frame of multiplexed container stdout/stderr: stream type, 3 padding bytes, payload length
+FRAME_HEADER = struct.Struct('>BxxxL')
+STDOUT_STREAM = 1
+
+# size of a single send when zero-copy sendfile is not available for a socket
+SEND_CHUNK_SIZE = 1024 * 1024
+
+# temporary files are created with 0600 mode, while outputs should get regular permissions
+_umask = os.umask(0)
+os.umask(_umask)
+OUTPUT_FILE_MODE = 0o666 & ~_umask
+
+
+class FanOutWriter:
+    """
+    Writes a stream into several destination files as data arrives.
+
+    Data goes to temporary files next to destinations; on commit, temporary files atomically replace destinations,
+    on abort they are removed. Optionally keeps either the whole stream (capture) or its last `tail_size` bytes
+    in memory.
+    """
+    destinations: List[Tuple[Path, Path, BinaryIO]]
+    length: int
+
+    def __init__(self, paths: List[Path], capture: bool = False, tail_size: int = 0):
+        self.destinations = list()
+        self.capture = capture
+        self.tail_size = tail_size
+        self.buffer = bytearray()
+        self.length = 0
+        try:
+            for path in paths:
+                fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".mnb-tmp")
+                os.fchmod(fd, OUTPUT_FILE_MODE)
+                self.destinations.append((path, Path(tmp_name), os.fdopen(fd, 'wb')))
+        except BaseException:
+            self.abort()
+            raise
+
+    def write(self, data: bytes):
+        for (_, _, tmp_file) in self.destinations:
+            tmp_file.write(data)
+        self.length += len(data)
+        if self.capture:
+            self.buffer += data
+        elif self.tail_size > 0:
+            self.buffer += data
+            if len(self.buffer) > self.tail_size:
+                del self.buffer[:len(self.buffer) - self.tail_size]
+
+    def getvalue(self) -> bytes:
+        return bytes(self.buffer)
+
+    def commit(self):
+        for (path, tmp_path, tmp_file) in self.destinations:
+            tmp_file.close()
+            os.replace(tmp_path, path)
+        self.destinations = list()
+
+    def abort(self):
+        for (_, tmp_path, tmp_file) in self.destinations:
+            tmp_file.close()
+            tmp_path.unlink(missing_ok=True)
+        self.destinations = list()
+
+
+class ChainedFileSource:
+    """
+    Streams several files one after another, as if they were concatenated.
+    Files are not read into memory: for sockets supporting it, data is sent with sendfile.
+    Files are checked to be readable when the source is created, so that a missing one fails the action before
+    its command is started, rather than in the sending thread.
+    """
+    paths: List[Path]
+
+    def __init__(self, paths: List[Path]):
+        self.paths = paths
+        for path in paths:
+            with open(path, 'rb'):
+                pass
+
+    def write_to(self, pipe: BinaryIO):
+        for path in self.paths:
+            with open(path, 'rb') as f:
+                shutil.copyfileobj(f, pipe, SEND_CHUNK_SIZE)
+
+    def send_to(self, sock):
+        for path in self.paths:
+            with open(path, 'rb') as f:
+                if isinstance(sock, socket.socket):
+                    # uses os.sendfile, falls back to send() internally for sockets not supporting it
+                    sock.sendfile(f)
+                else:
+                    while chunk := f.read(SEND_CHUNK_SIZE):
+                        sock.sendall(chunk)
+
+
+def socket_sender(sock, stdin_source: ChainedFileSource):
+    """Send stdin_source to the socket and half-close it (even if sending failed), so the receiving side gets EOF"""
+    try:
+        stdin_source.send_to(sock)
+    except (BrokenPipeError, ConnectionResetError):
+        # the command exited without reading the whole input
+        pass
+    finally:
+        try:
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            # already disconnected
+            pass
+
+
+def socket_receiver(sock, stdout_writer: FanOutWriter, stderr_writer: FanOutWriter):
+    """Demultiplex container output frames from the socket into stdout and stderr writers, until EOF"""
+    while True:
+        header = recv_exactly(sock, FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            break
+        stream, length = FRAME_HEADER.unpack(header)
+        writer = stdout_writer if stream == STDOUT_STREAM else stderr_writer
+        # frames could be large, read them in chunks of bounded size
+        while length > 0:
+            received = recv_exactly(sock, min(length, BUFFER_SIZE))
+            if len(received) == 0:
+                raise ConnectionError("Unexpected end of container output stream")
+            writer.write(received)
+            length -= len(received)
+
+
+class ChunkReader(io.RawIOBase):
+    """Readable file over an iterable of byte chunks (e.g. a streamed HTTP response)"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.chunk = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        while len(self.chunk) == 0:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.chunk = memoryview(chunk)
+        n = min(len(buffer), len(self.chunk))
+        buffer[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+
+def extract_file(archive_chunks: Iterable[bytes], dst: Path) -> bool:
+    """
+    Write the file a tar stream holds (as produced by Docker for a single path) to dst, without buffering it
+    whole; return False if the archive holds no regular file
+    """
+    with tarfile.open(fileobj=io.BufferedReader(ChunkReader(archive_chunks), BUFFER_SIZE), mode='r|') as archive:
+        member = archive.next()
+        if member is None or not member.isfile():
+            return False
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        with archive.extractfile(member) as src, open(dst, 'wb') as f:
+            shutil.copyfileobj(src, f, BUFFER_SIZE)
+        os.chmod(dst, stat.S_IMODE(member.mode))
+    return True
+
+
+def recv_exactly(sock, n: int) -> bytes:
+    """Receive n bytes, or less if EOF is reached"""
+    data = sock.recv(n)
+    if len(data) == n or len(data) == 0:
+        return data
+    chunks = [data]
+    received = len(data)
+    while received < n:
+        data = sock.recv(n - received)
+        if len(data) == 0:
+            break
+        chunks.append(data)
+        received += len(data)
+    return b"".join(chunks)
+
+
+def run_concurrently(functions: List[Callable[[], None]], on_error: Callable[[], None]):
+    """
+    Run functions in threads until all of them return, then re-raise the first exception any of them raised.
+    on_error is called when the first one fails, to unblock the others (e.g. by closing what they wait on).
+    """
+    errors: List[BaseException] = list()
+    lock = threading.Lock()
+
+    def run(function: Callable[[], None]):
+        try:
+            function()
+        except BaseException as e:
+            with lock:
+                errors.append(e)
+                first = len(errors) == 1
+            if first:
+                on_error()
+
+    threads = [threading.Thread(target=run, args=(function,)) for function in functions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def exchange_stdio(sock, stdin_source: ChainedFileSource, stdout_writer: FanOutWriter, stderr_writer: FanOutWriter):
+    """
+    Send stdin and receive stdout/stderr of a running command attached to the socket, until the command exits.
+    If either fails (e.g. an output file system is full, or the stream ends in the middle of a frame), writers
+    are aborted, so that a partial output is never committed, and the exception is re-raised.
+    """
+    def disconnect():
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    try:
+        run_concurrently([lambda: socket_receiver(sock, stdout_writer, stderr_writer),
+                          lambda: socket_sender(sock, stdin_source)],
+                         on_error=disconnect)
+    except BaseException:
+        stdout_writer.abort()
+        stderr_writer.abort()
+        raise
+
+
+def pipe_sender(pipe: BinaryIO, stdin_source: ChainedFileSource):
+    """Write stdin_source to the (unbuffered) pipe and close it, so the process gets EOF"""
+    try:
+        stdin_source.write_to(pipe)
+    except BrokenPipeError:
+        # the command exited without reading the whole input
+        pass
+    finally:
+        pipe.close()
+
+
+def pipe_receiver(pipe: BinaryIO, writer: FanOutWriter):
+    while chunk := pipe.read(BUFFER_SIZE):
+        writer.write(chunk)
+
+
+def exchange_process_stdio(process: subprocess.Popen,
+                           stdin_source: ChainedFileSource,
+                           stdout_writer: FanOutWriter,
+                           stderr_writer: FanOutWriter):
+    """Same as exchange_stdio, for a local process started with unbuffered stdin, stdout and stderr pipes"""
+    try:
+        # a process left without readers of its output could block forever
+        run_concurrently([lambda: pipe_receiver(process.stdout, stdout_writer),
+                          lambda: pipe_receiver(process.stderr, stderr_writer),
+                          lambda: pipe_sender(process.stdin, stdin_source)],
+                         on_error=process.kill)
+    except BaseException:
+        stdout_writer.abort()
+        stderr_writer.abort()
+        raise
@@ -0,0 +1,63 @@
+# Timing spans of a run, written in Chrome trace event format (viewable in Perfetto or chrome://tracing)
+#
+# Every thread gets its own track, so actions executed concurrently by worker threads are shown side by side.
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+class Tracer:
+    events: List[Dict[str, Any]]
+
+    def __init__(self, trace_path: Optional[Path]):
+        """Spans are collected only if there is a path to write them to"""
+        self.trace_path = trace_path
+        self.enabled = trace_path is not None
+        self.lock = threading.Lock()
+        self.events = list()
+        self.thread_names: Dict[int, str] = dict()
+        self.pid = os.getpid()
+        self.started_ns = time.perf_counter_ns()
+
+    def span(self, name: str, **args):
+        """Context manager recording the time spent in its block, args are shown as the span details"""
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, args)
+
+    @contextmanager
+    def _span(self, name: str, args: Dict[str, Any]):
+        thread = threading.current_thread()
+        started_ns = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            finished_ns = time.perf_counter_ns()
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": (started_ns - self.started_ns) / 1000,
+                "dur": (finished_ns - started_ns) / 1000,
+                "pid": self.pid,
+                "tid": thread.ident,
+            }
+            if args:
+                event["args"] = {key: str(value) for (key, value) in args.items()}
+            with self.lock:
+                self.events.append(event)
+                self.thread_names[thread.ident] = thread.name
+
+    def save(self):
+        if not self.enabled:
+            return
+        with self.lock:
+            metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                        for (tid, name) in self.thread_names.items()]
+            trace_json = {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+        self.trace_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.trace_path.open('w') as trace_file:
+            json.dump(trace_json, trace_file)
@@ -0,0 +1,198 @@
+# Pool of long-lived containers to run Exec actions in, avoiding container create/start/stop/remove per action
+#
+# Every pooled container runs an idle process and has its own scratch directory mounted at /mnb/run, held for
+# the container lifetime.
+# A container serves one action at a time: action inputs are copied into its scratch directory, the command
+# is run as an exec instance, outputs are taken from the scratch directory, and then the container is reset
+# before it is returned to the pool: the scratch directory is cleaned up, processes left behind by the action
+# are killed and /tmp is cleared. Other changes to the container filesystem (e.g. files in $HOME) are seen by
+# later actions on the same image, so actions relying on a pristine image should not use warm containers.
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+from typing import Callable, Dict, List, Optional
+
+from docker import DockerClient
+from docker.models.containers import Container
+from docker.types import Mount
+
+from scratch import ScratchAllocator, ScratchDir, empty_dir
+from streams import ChainedFileSource, FanOutWriter, exchange_stdio
+
+# keeps container running until it is removed
+IDLE_ENTRYPOINT = ["/bin/sh", "-c", "trap 'exit 0' TERM; while :; do sleep 3600 & wait $!; done"]
+
+# run as root between actions: kills every process but the idle one (PID 1, spared by kill -1), clears /tmp
+RESET_COMMAND = ["/bin/sh", "-c", "kill -9 -1 2>/dev/null; rm -rf /tmp/* /tmp/.[!.]* /tmp/..?*"]
+
+EXEC_POLL_INTERVAL = 0.01
+
+
+class WarmContainer:
+    container: Container
+    image_name: str
+    scratch: ScratchDir
+    scratch_dir: Path
+    argv_prefix: List[str]
+    default_command: List[str]
+
+    def __init__(self, container: Container, image_name: str, scratch: ScratchDir, image_config: dict):
+        self.container = container
+        self.image_name = image_name
+        self.scratch = scratch
+        self.scratch_dir = scratch.path
+        # exec instances do not use image entrypoint and command, so these are applied explicitly
+        self.argv_prefix = image_config.get('Entrypoint') or []
+        self.default_command = image_config.get('Cmd') or []
+
+    def exec(self,
+             client: DockerClient,
+             command: Optional[List[str]],
+             environment: Dict[str, str],
+             workdir: PurePosixPath,
+             stdin_source: ChainedFileSource,
+             stdout_writer: FanOutWriter,
+             stderr_writer: FanOutWriter) -> int:
+        argv = self.argv_prefix + (command if command is not None else self.default_command)
+        return exec_command(client, self.container.id, argv, environment, workdir,
+                            stdin_source, stdout_writer, stderr_writer)
+
+    def clean_scratch_dir(self):
+        if not empty_dir(self.scratch_dir):
+            raise OSError(f"Could not clean scratch dir {self.scratch_dir}")
+
+    def reset(self, client: DockerClient) -> bool:
+        """Kill processes left behind by the last action and clear /tmp, return False if that failed"""
+        exec_id = client.api.exec_create(self.container.id, cmd=RESET_COMMAND, user="root")['Id']
+        client.api.exec_start(exec_id)
+        return wait_exec(client, exec_id) == 0
+
+
+def exec_command(client: DockerClient,
+                 container_id: str,
+                 argv: List[str],
+                 environment: Dict[str, str],
+                 workdir: PurePosixPath,
+                 stdin_source: ChainedFileSource,
+                 stdout_writer: FanOutWriter,
+                 stderr_writer: FanOutWriter) -> int:
+    """Run a command in a running container as an exec instance, streaming its stdio; return exit code"""
+    exec_id = client.api.exec_create(container_id,
+                                     cmd=argv,
+                                     stdin=True,
+                                     stdout=True,
+                                     stderr=True,
+                                     environment=environment,
+                                     workdir=str(workdir))['Id']
+    exec_socket = client.api.exec_start(exec_id, socket=True)
+    try:
+        exchange_stdio(exec_socket._sock, stdin_source, stdout_writer, stderr_writer)
+    finally:
+        exec_socket.close()
+    return wait_exec(client, exec_id)
+
+
+def wait_exec(client: DockerClient, exec_id: str) -> int:
+    """Wait for an exec instance to exit (its stdio may be closed slightly before), return exit code"""
+    while True:
+        exec_info = client.api.exec_inspect(exec_id)
+        if not exec_info['Running']:
+            return exec_info['ExitCode']
+        time.sleep(EXEC_POLL_INTERVAL)
+
+
+class WarmContainerPool:
+    get_client: Callable[[], DockerClient]
+    scratch: ScratchAllocator
+    run_path: PurePosixPath
+    idle: Dict[str, List[WarmContainer]]
+    all: List[WarmContainer]
+
+    def __init__(self,
+                 get_client: Callable[[], DockerClient],
+                 scratch: ScratchAllocator,
+                 run_path: PurePosixPath):
+        self.get_client = get_client
+        self.scratch = scratch
+        self.run_path = run_path
+        self.idle = dict()
+        self.all = list()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def lease(self, image_name: str):
+        """
+        Take an idle container for the image (starting a new one if there is none) for the duration of an action.
+        A container is returned to the pool only if the action did not fail.
+        """
+        warm_container = self.acquire(image_name)
+        try:
+            yield warm_container
+        except BaseException:
+            self.discard(warm_container)
+            raise
+        try:
+            self.release(warm_container)
+        except BaseException:
+            # neither idle nor usable, e.g. its scratch dir could not be cleaned
+            self.discard(warm_container)
+            raise
+
+    def acquire(self, image_name: str) -> WarmContainer:
+        with self.lock:
+            idle = self.idle.get(image_name)
+            if idle:
+                return idle.pop()
+        return self.start_container(image_name)
+
+    def release(self, warm_container: WarmContainer):
+        warm_container.clean_scratch_dir()
+        if not warm_container.reset(self.get_client()):
+            self.discard(warm_container)
+            return
+        with self.lock:
+            self.idle.setdefault(warm_container.image_name, list()).append(warm_container)
+
+    def discard(self, warm_container: WarmContainer):
+        with self.lock:
+            if warm_container not in self.all:
+                # already removed by close()
+                return
+            self.all.remove(warm_container)
+        self.remove_container(warm_container)
+
+    def start_container(self, image_name: str) -> WarmContainer:
+        client = self.get_client()
+        scratch = self.scratch.allocate()
+        try:
+            container = client.containers.create(
+                image_name,
+                entrypoint=IDLE_ENTRYPOINT,
+                mounts=[Mount(source=str(scratch.path_on_host),
+                              target=str(self.run_path),
+                              type="bind",
+                              read_only=False)],
+                detach=True)
+        except BaseException:
+            self.scratch.release(scratch)
+            raise
+        container.start()
+        image_config = client.images.get(image_name).attrs['Config']
+        warm_container = WarmContainer(container, image_name, scratch, image_config)
+        with self.lock:
+            self.all.append(warm_container)
+        return warm_container
+
+    def remove_container(self, warm_container: WarmContainer):
+        warm_container.container.remove(force=True)
+        self.scratch.release(warm_container.scratch)
+
+    def close(self):
+        """Remove all containers of the pool"""
+        with self.lock:
+            warm_containers = self.all
+            self.all = list()
+            self.idle = dict()
+        for warm_container in warm_containers:
+            self.remove_container(warm_container)
@@ -0,0 +1,193 @@
+# Watching workspace files for changes
+#
+# Inotify is used on Linux (via libc, no extra dependencies); elsewhere, or when file change notifications
+# are not delivered (e.g. some bind mounts of Docker Desktop), directories are polled.
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, Set, Tuple
+
+from hashing import MNB_DIR_NAME
+
+# directories never watched
+IGNORED_DIR_NAMES = {MNB_DIR_NAME, ".git"}
+# temporary files mnb creates next to outputs
+IGNORED_SUFFIX = ".mnb-tmp"
+
+# inotify(7) constants
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_ISDIR = 0x40000000
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ATTRIB
+EVENT_HEADER = struct.Struct('iIII')
+
+POLL_INTERVAL = 0.5
+
+
+class Watcher(ABC):
+    """
+    Reports paths (relative to root, POSIX-style) changed under watched directories.
+    Directories listed as recursive are watched with all their subdirectories.
+    """
+    def __init__(self, root: Path, dirs: Iterable[str], recursive_dirs: Iterable[str]):
+        self.root = root
+        self.dirs = set(dirs)
+        self.recursive_dirs = set(recursive_dirs)
+
+    def wait_for_changes(self, debounce: float) -> Set[str]:
+        """Block until something changes, then collect changes until there are none for `debounce` seconds"""
+        changed = self.read_changes(None)
+        while True:
+            more_changes = self.read_changes(debounce)
+            if not more_changes:
+                return changed
+            changed |= more_changes
+
+    @abstractmethod
+    def read_changes(self, timeout) -> Set[str]:
+        """Changes seen within timeout seconds (None: wait until there are some), empty set if there are none"""
+
+    def close(self):
+        pass
+
+    def walk_dirs(self) -> Iterable[Path]:
+        for rel_dir in self.dirs:
+            path = self.root / rel_dir
+            if path.is_dir():
+                yield path
+        for rel_dir in self.recursive_dirs:
+            yield from walk_subdirs(self.root / rel_dir)
+
+    def relative(self, path: Path) -> str:
+        return str(PurePosixPath(*path.relative_to(self.root).parts))
+
+
+def is_ignored(name: str) -> bool:
+    return name in IGNORED_DIR_NAMES or name.endswith(IGNORED_SUFFIX)
+
+
+def walk_subdirs(path: Path) -> Iterable[Path]:
+    if not path.is_dir():
+        return
+    yield path
+    for dir_path, dir_names, _ in os.walk(path):
+        dir_names[:] = [d for d in dir_names if d not in IGNORED_DIR_NAMES]
+        for dir_name in dir_names:
+            yield Path(dir_path) / dir_name
+
+
+class InotifyWatcher(Watcher):
+    def __init__(self, root: Path, dirs: Iterable[str], recursive_dirs: Iterable[str]):
+        super().__init__(root, dirs, recursive_dirs)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor -> (watched dir, whether subdirs are watched too)
+        self.watches: Dict[int, Tuple[Path, bool]] = dict()
+        for rel_dir in self.dirs:
+            self.add_watch(self.root / rel_dir, False)
+        for rel_dir in self.recursive_dirs:
+            for path in walk_subdirs(self.root / rel_dir):
+                self.add_watch(path, True)
+
+    def add_watch(self, path: Path, recursive: bool):
+        if not path.is_dir():
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        prev = self.watches.get(wd)
+        self.watches[wd] = (path, recursive or (prev is not None and prev[1]))
+
+    def read_changes(self, timeout) -> Set[str]:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, consider everything changed
+                changed.update(self.relative(path) for (path, _) in self.watches.values())
+                continue
+            if wd not in self.watches:
+                continue
+            (dir_path, recursive) = self.watches[wd]
+            path = dir_path / name if name else dir_path
+            if is_ignored(name):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and recursive:
+                for subdir in walk_subdirs(path):
+                    self.add_watch(subdir, True)
+            changed.add(self.relative(path))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(Watcher):
+    def __init__(self, root: Path, dirs: Iterable[str], recursive_dirs: Iterable[str]):
+        super().__init__(root, dirs, recursive_dirs)
+        self.snapshot = self.scan()
+
+    def scan(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = dict()
+        for dir_path in self.walk_dirs():
+            try:
+                entries = list(os.scandir(dir_path))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if is_ignored(entry.name):
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    # changes of dir contents are reported for the contents, not for the dir itself
+                    snapshot[self.relative(Path(entry.path))] = (-1, -1)
+                else:
+                    snapshot[self.relative(Path(entry.path))] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def read_changes(self, timeout) -> Set[str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(POLL_INTERVAL if deadline is None else min(POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+            snapshot = self.scan()
+            changed = {path for path in snapshot.keys() | self.snapshot.keys()
+                       if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+
+def create_watcher(root: Path, dirs: Iterable[str], recursive_dirs: Iterable[str], poll: bool) -> Watcher:
+    if not poll:
+        try:
+            return InotifyWatcher(root, dirs, recursive_dirs)
+        except (OSError, AttributeError):
+            # inotify not available (not Linux)
+            pass
+    return PollingWatcher(root, dirs, recursive_dirs)
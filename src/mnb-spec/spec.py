@@ -13,14 +13,32 @@ CommandElement = Union[str, 'File', 'Dir', PurePosixPath]
 
 StringOrPath = Union[str, PurePosixPath]
 
+# Pull policies for PullImage action
+PULL_ALWAYS = "always"                  # pull on every run, to get updates of the tag
+PULL_IF_NOT_PRESENT = "if-not-present"  # pull only if the image is not present locally
+PULL_NEVER = "never"                    # never pull, the image must be present locally
+PULL_POLICIES = [PULL_ALWAYS, PULL_IF_NOT_PRESENT, PULL_NEVER]
+
+# Backends running commands of Exec actions, selected per image in workspace settings
+BACKEND_DOCKER = "docker"  # in a container of the image (default)
+BACKEND_HOST = "host"      # as a local process in a scratch dir, image name only selects the backend (trusted commands)
+BACKENDS = [BACKEND_DOCKER, BACKEND_HOST]
+
 class Spec:
+    __slots__ = ('spec_version', 'actions', 'description', 'settings')
     spec_version: Tuple[int, int]
     actions: List['Action']
     description: Optional[str]
+    settings: Optional['Settings']
 
-    def __init__(self, spec_version: Tuple[int, int], actions: Optional[List['Action']] = None, description: Optional[str] = None):
+    def __init__(self,
+                 spec_version: Tuple[int, int],
+                 actions: Optional[List['Action']] = None,
+                 description: Optional[str] = None,
+                 settings: Optional['Settings'] = None):
         self.spec_version = spec_version
         self.description = description
+        self.settings = settings
         if actions is None:
             self.actions = list()
         else:
@@ -34,8 +52,8 @@ class Spec:
         print_spec_json(self)
 
     #### Helpers ####
-    def pull_image(self, image_spec: ImageSpec) -> 'PullImage':
-        action = PullImage(get_image_name(image_spec))
+    def pull_image(self, image_spec: ImageSpec, pull_policy: str = PULL_ALWAYS) -> 'PullImage':
+        action = PullImage(get_image_name(image_spec), pull_policy=pull_policy)
         self.actions.append(action)
         return action
 
@@ -61,38 +79,56 @@ class Spec:
              entrypoint: Optional[str] = None,
              workdir: Optional[str] = None,
              inputs: Optional[List['Input']] = None,
-             outputs: Optional[List['Output']] = None) -> 'Exec':
+             outputs: Optional[List['Output']] = None,
+             tmpfs_size: Optional[int] = None) -> 'Exec':
         action = Exec(get_image_name(image_spec),
                       command = command,
                       entrypoint = entrypoint,
                       workdir=workdir,
                       inputs=inputs if inputs is not None else list(),
-                      outputs=outputs if outputs is not None else list())
+                      outputs=outputs if outputs is not None else list(),
+                      tmpfs_size=tmpfs_size)
         self.actions.append(action)
         return action
 
 
+class Settings:
+    """Workspace settings, taken from mnb.json (settings of generated specs are ignored)"""
+    __slots__ = ('backends',)
+    backends: Dict[ImageName, str]
+
+    def __init__(self, backends: Optional[Dict[ImageName, str]] = None):
+        self.backends = backends if backends is not None else dict()
+
+    def backend_for(self, image_name: ImageName) -> str:
+        return self.backends.get(image_name, BACKEND_DOCKER)
+
 class Exec:
+    __slots__ = ('image_name', 'command', 'entrypoint', 'workdir', 'inputs', 'outputs', 'tmpfs_size')
     image_name: 'ImageName'
     command: Optional[List[str]]
     entrypoint: Optional[str]
     workdir: Optional[str]
     inputs: List['Input']
     outputs: List['Output']
+    # if set, /mnb/run is a tmpfs of that many bytes (Docker backend), only file outputs are copied out of it
+    tmpfs_size: Optional[int]
 
     def __init__(self,
                  image_name: ImageName,
                  command: Optional[List[CommandElement]],
-                 entrypoint: Optional[StringOrPath],
-                 workdir: Optional[StringOrPath],
-                 inputs: List['Input'],
-                 outputs: List['Output']):
-        self.image_name = image_name
+                 entrypoint: Optional[StringOrPath] = None,
+                 workdir: Optional[StringOrPath] = None,
+                 inputs: Optional[List['Input']] = None,
+                 outputs: Optional[List['Output']] = None,
+                 tmpfs_size: Optional[int] = None):
+        self.image_name = sys.intern(image_name)
         self.command = [command_element_to_str(element) for element in command] if command is not None else None
         self.entrypoint = path_to_str(entrypoint)
         self.workdir = path_to_str(workdir)
-        self.inputs = inputs
-        self.outputs = outputs
+        self.inputs = inputs if inputs is not None else list()
+        self.outputs = outputs if outputs is not None else list()
+        self.tmpfs_size = tmpfs_size
 
     #### Helpers ####
     def input(self,
@@ -149,6 +185,7 @@ class Exec:
 
 
 class BuildImage:
+    __slots__ = ('image_name', 'context_path', 'build_args', 'dockerfile_path', 'from_git', 'extra_tags')
     image_name: ImageName
     context_path: str
     build_args: dict[str, str]
@@ -172,20 +209,27 @@ class BuildImage:
 
 
 class FromGit:
+    __slots__ = ('repo', 'rev')
     repo: str
-    rev: str
+    rev: Optional[str]
 
-    def __init__(self, repo: str, rev: str):
+    def __init__(self, repo: str, rev: Optional[str] = None):
         self.repo = repo
         self.rev = rev
 
 class PullImage:
+    __slots__ = ('image_name', 'pull_policy')
     image_name: ImageName
+    pull_policy: str
 
-    def __init__(self, image_name: ImageName):
-        self.image_name = image_name
+    def __init__(self, image_name: ImageName, pull_policy: str = PULL_ALWAYS):
+        if pull_policy not in PULL_POLICIES:
+            raise ValueError(f"Unexpected pull policy {pull_policy}")
+        self.image_name = sys.intern(image_name)
+        self.pull_policy = pull_policy
 
 class Input:
+    __slots__ = ('value', 'through')
     value: Value
     through: InputThrough
 
@@ -194,6 +238,7 @@ class Input:
         self.through = through
 
 class Output:
+    __slots__ = ('value', 'through')
     value: Value
     through: OutputThrough
 
@@ -202,49 +247,65 @@ class Output:
         self.through = through
 
 class File:
+    __slots__ = ('path',)
     path: str
 
     def __init__(self, path: StringOrPath):
         self.path = path_to_str(path)
 
 class Dir:
+    __slots__ = ('path',)
     path: str
 
     def __init__(self, path: StringOrPath):
         self.path = path_to_str(path)
 
 class Image:
+    __slots__ = ('image_name',)
     image_name: ImageName
 
     def __init__(self, image_name: ImageName):
-        self.image_name = image_name
+        self.image_name = sys.intern(image_name)
 
 class ThroughFile:
+    __slots__ = ('path',)
     path: str
 
     def __init__(self, path: StringOrPath):
         self.path = path_to_str(path)
 
 class ThroughDir:
+    __slots__ = ('path',)
     path: str
 
     def __init__(self, path: StringOrPath):
         self.path = path_to_str(path)
 
 class ThroughEnvironment:
+    __slots__ = ('name',)
     name: str
 
     def __init__(self, name: str):
         self.name = name
 
-class ThroughStdin:
-    pass
+class StreamThrough:
+    """Base of throughs without parameters: every class has a single shared instance"""
+    __slots__ = ()
+    _instance = None
 
-class ThroughStdout:
-    pass
+    def __new__(cls):
+        if cls.__dict__.get('_instance') is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
 
-class ThroughStderr:
-    pass
+class ThroughStdin(StreamThrough):
+    __slots__ = ()
+
+class ThroughStdout(StreamThrough):
+    __slots__ = ()
+
+class ThroughStderr(StreamThrough):
+    __slots__ = ()
 
 #### Utility functions ####
 
@@ -259,9 +320,10 @@ def get_image_name(image_spec: ImageSpec) -> ImageName:
         raise ValueError(f"Unexpected image spec type {type(image_spec)}")
 
 def path_to_str(path: Optional[StringOrPath]) -> Optional[str]:
+    # paths are interned: the same path is usually referred to by many inputs and outputs of a big spec
     if path is None:
         return None
-    return str(path)
+    return sys.intern(str(path))
 
 def command_element_to_str(element: CommandElement) -> str:
     if isinstance(element, str):
@@ -286,10 +348,19 @@ def to_path(string_or_path: StringOrPath) -> PurePosixPath:
 #### JSON serialization ####
 
 def spec_to_json(s: Spec):
-    return {
+    spec_json = {
         "spec_version": f"{s.spec_version[0]}.{s.spec_version[1]}",
         "actions": list(map(action_to_json, s.actions))
     }
+    if s.settings is not None:
+        spec_json['settings'] = settings_to_json(s.settings)
+    return spec_json
+
+def settings_to_json(settings: Settings):
+    settings_json = {}
+    if settings.backends:
+        settings_json['backends'] = dict(settings.backends)
+    return settings_json
 
 class WriterError(Exception):
     pass
@@ -297,6 +368,8 @@ class WriterError(Exception):
 def action_to_json(action: Action):
     if isinstance(action, PullImage):
         action_json = {"pull_image": {"image_name": action.image_name}}
+        if action.pull_policy != PULL_ALWAYS:
+            action_json['pull_image']['pull_policy'] = action.pull_policy
         return action_json
     elif isinstance(action, BuildImage):
         action_json = {"build_image": {
@@ -308,7 +381,9 @@ def action_to_json(action: Action):
         if action.build_args:
             action_json['build_image']['build_args'] = [{"name": key, "value": value} for (key, value) in action.build_args.items()]
         if action.from_git:
-            action_json['build_image']['from_git'] = {"repo": action.from_git.repo, "rev": action.from_git.rev}
+            action_json['build_image']['from_git'] = {"repo": action.from_git.repo}
+            if action.from_git.rev is not None:
+                action_json['build_image']['from_git']['rev'] = action.from_git.rev
         if action.extra_tags:
             action_json['build_image']['extra_tags'] = action.extra_tags
         return action_json
@@ -322,6 +397,8 @@ def action_to_json(action: Action):
             action_json['exec']['entrypoint'] = action.entrypoint
         if action.workdir:
             action_json['exec']['workdir'] = action.workdir
+        if action.tmpfs_size is not None:
+            action_json['exec']['tmpfs_size'] = action.tmpfs_size
         if len(action.inputs) > 0:
             action_json['exec']['inputs'] = list(map(input_to_json, action.inputs))
         if len(action.outputs) > 0:
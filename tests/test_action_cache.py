@@ -0,0 +1,43 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from spec import *
+from action_cache import ActionCache
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+        self.cache = ActionCache(self.root / ".mnb" / "cache" / "actions")
+        (self.root / "a").write_text("a")
+        (self.root / "d").mkdir()
+        (self.root / "d" / "x").write_text("x")
+        self.action = Exec(image_name="foo",
+                           inputs=[Input(value=File("a"), through=ThroughFile("a")),
+                                   Input(value=Dir("d"), through=ThroughDir("d"))],
+                           outputs=[Output(value=File("b"), through=ThroughFile("b"))],
+                           command=["convert", "a", "b"], entrypoint=None, workdir=None)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_key_depends_on_inputs(self):
+        key = self.cache.key_for(self.action, "sha256:1", {}, self.root)
+        self.assertEqual(key, self.cache.key_for(self.action, "sha256:1", {}, self.root))
+        self.assertNotEqual(key, self.cache.key_for(self.action, "sha256:2", {}, self.root))
+        self.assertNotEqual(key, self.cache.key_for(self.action, "sha256:1", {"X": "1"}, self.root))
+        (self.root / "d" / "x").write_text("y")
+        self.assertNotEqual(key, self.cache.key_for(self.action, "sha256:1", {}, self.root))
+
+    def test_fresh_only_while_outputs_intact(self):
+        key = self.cache.key_for(self.action, "sha256:1", {}, self.root)
+        self.assertFalse(self.cache.is_fresh(key, self.root))
+        (self.root / "b").write_text("b")
+        self.cache.store(key, ["b"], self.root)
+        self.assertTrue(self.cache.is_fresh(key, self.root))
+        (self.root / "b").write_text("modified")
+        self.assertFalse(self.cache.is_fresh(key, self.root))
+        (self.root / "b").unlink()
+        self.assertFalse(self.cache.is_fresh(key, self.root))
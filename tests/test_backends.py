@@ -0,0 +1,162 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import executor
+from backends import DockerBackend, DockerRun, FusedDockerRun, HostBackend
+from common import CommandLineOptions
+from errors import MissingHostCommand
+from scratch import ScratchAllocator
+from streams import ChainedFileSource, FanOutWriter
+from tracing import Tracer
+from spec import *
+
+
+class HostBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+        self.scratch = ScratchAllocator(self.root / "scratch", self.root / "scratch")
+        self.backend = HostBackend(self.root, self.scratch, Tracer(None))
+
+    def tearDown(self):
+        self.scratch.close()
+        self.tmp_dir.cleanup()
+
+    def run_action(self, action: Exec, stdin_paths=(), bound_inputs=None):
+        stdout_writer = FanOutWriter([], capture=True)
+        stderr_writer = FanOutWriter([], capture=True)
+        with self.backend.start(action) as run:
+            run.stage_inputs(bound_inputs or {})
+            exit_code = run.run(action, {"GREETING": "hello"}, ChainedFileSource(list(stdin_paths)),
+                                stdout_writer, stderr_writer)
+            files = sorted(str(path.relative_to(run.scratch_dir)) for path in run.scratch_dir.rglob("*"))
+        # scratch dir is emptied after the run
+        self.assertEqual(list(run.scratch_dir.iterdir()), [])
+        return exit_code, stdout_writer.getvalue(), stderr_writer.getvalue(), files
+
+    def test_stdio(self):
+        (self.root / "a.txt").write_bytes(b"a\n")
+        (self.root / "b.txt").write_bytes(b"b\n")
+        (exit_code, stdout, _, _) = self.run_action(Exec("tools", ["cat"]), [self.root / "a.txt", self.root / "b.txt"])
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(stdout, b"a\nb\n")
+        (exit_code, _, stderr, _) = self.run_action(Exec("tools", ["sh", "-c", "echo $GREETING >&2; exit 3"]))
+        self.assertEqual(exit_code, 3)
+        self.assertEqual(stderr, b"hello\n")
+
+    def test_inputs_and_workdir(self):
+        (self.root / "src").mkdir()
+        (self.root / "src" / "x.txt").write_text("x")
+        action = Exec("tools", ["sh", "-c", "cat ../in/x.txt > out.txt; pwd"], workdir="work")
+        (exit_code, stdout, _, files) = self.run_action(action, bound_inputs={"in": Input(Dir("src"), ThroughDir("in"))})
+        self.assertEqual(exit_code, 0)
+        self.assertTrue(stdout.decode().strip().endswith("/work"))
+        self.assertEqual(files, ["in", "in/x.txt", "work", "work/out.txt"])
+
+    def test_entrypoint(self):
+        (exit_code, stdout, _, _) = self.run_action(Exec("tools", ["-c", "echo $0 $1", "a", "b"], entrypoint="sh"))
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(stdout, b"a b\n")
+        (exit_code, stdout, _, _) = self.run_action(Exec("tools", None, entrypoint="pwd"))
+        self.assertEqual(exit_code, 0)
+
+    def test_missing_command(self):
+        (exit_code, _, stderr, _) = self.run_action(Exec("tools", ["no-such-command-mnb"]))
+        self.assertEqual(exit_code, 127)
+        self.assertIn(b"no-such-command-mnb", stderr)
+        with self.assertRaises(MissingHostCommand):
+            self.run_action(Exec("tools", None))
+
+
+class HostExecutionTest(unittest.TestCase):
+    def test_execute_spec_on_host(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            (root / "in.txt").write_text("hello\n")
+            cliopts = CommandLineOptions()
+            cliopts.rootabspath = tmp
+            cliopts.dev_mode = True
+            cliopts.windows_host = False
+            cliopts.subcommand = "update"
+            context = executor.Context(cliopts)
+            context.settings = Settings(backends={"tools": BACKEND_HOST})
+            s = Spec(spec_version=(1, 0))
+            tools = s.pull_image("tools")
+            s.exec(tools, command=["cp", "in.txt", "copy.txt"]) \
+                .input(file="in.txt", through_file="in.txt") \
+                .output(file="out/copy.txt", through_file="copy.txt")
+            s.exec(tools, command=["tr", "a-z", "A-Z"]) \
+                .input(file="out/copy.txt", through_stdin=True) \
+                .output(file="upper.txt", through_stdout=True)
+            try:
+                # no Docker daemon is needed
+                executor.execute_spec(s, context)
+            finally:
+                context.close()
+            self.assertEqual((root / "out" / "copy.txt").read_text(), "hello\n")
+            self.assertEqual((root / "upper.txt").read_text(), "HELLO\n")
+            # session dir is removed when the context is closed
+            self.assertEqual(list((root / ".mnb" / "scratch").iterdir()), [])
+
+
+    def test_generate_spec_on_host(self):
+        generated = {"spec_version": "1.0", "actions": [{"pull_image": {"image_name": "foo"}}]}
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            (root / "plan.json").write_text(json.dumps(generated))
+            cliopts = CommandLineOptions()
+            cliopts.rootabspath = tmp
+            cliopts.dev_mode = True
+            cliopts.windows_host = False
+            cliopts.subcommand = "update"
+            context = executor.Context(cliopts)
+            context.settings = Settings(backends={"tools": BACKEND_HOST})
+            generator = Spec(spec_version=(1, 0))
+            tools = generator.pull_image("tools")
+            generator.exec(tools, command=["cat"]).input(file="plan.json", through_stdin=True)
+            try:
+                s = executor.generate_spec(generator, b"{}", context)
+                # generator stdout is written to the cache, not kept in memory
+                self.assertEqual(json.loads((root / ".mnb" / "cache" / "generator-output.json").read_bytes()), generated)
+                with mock.patch.object(executor, 'execute_spec') as execute_spec:
+                    self.assertEqual(spec_to_json(executor.generate_spec(generator, b"{}", context)), spec_to_json(s))
+                    execute_spec.assert_not_called()
+            finally:
+                context.close()
+            self.assertIsInstance(s.actions[0], PullImage)
+
+
+class FusedDockerRunTest(unittest.TestCase):
+    def test_argv(self):
+        client = mock.Mock()
+        client.images.get.return_value.attrs = {'Config': {'Entrypoint': ["/entrypoint"], 'Cmd': ["serve"]}}
+        with tempfile.TemporaryDirectory() as tmp:
+            scratch = ScratchAllocator(Path(tmp), Path(tmp))
+            backend = DockerBackend(lambda: client, Path(tmp), scratch, Tracer(None))
+            with scratch.scratch_dir() as scratch_dir:
+                run = FusedDockerRun(backend, scratch_dir)
+                self.assertEqual(run.argv("foo", None), ["/entrypoint", "serve"])
+                self.assertEqual(run.argv("foo", ["run"]), ["/entrypoint", "run"])
+                # an empty command is not the image default
+                self.assertEqual(run.argv("foo", []), ["/entrypoint"])
+            scratch.close()
+
+
+class DockerRunTest(unittest.TestCase):
+    def test_container_is_removed_on_failure(self):
+        client = mock.Mock()
+        container = client.containers.create.return_value
+        container.attach_socket.side_effect = ConnectionError("daemon went away")
+        with tempfile.TemporaryDirectory() as tmp:
+            scratch = ScratchAllocator(Path(tmp), Path(tmp))
+            backend = DockerBackend(lambda: client, Path(tmp), scratch, Tracer(None))
+            with backend.start(Exec("foo", ["true"])) as run:
+                self.assertIsInstance(run, DockerRun)
+                run.stage_inputs({})
+                with self.assertRaises(ConnectionError):
+                    run.run(Exec("foo", ["true"]), {}, ChainedFileSource([]), FanOutWriter([]), FanOutWriter([]))
+            container.remove.assert_called_once_with(force=True)
+            scratch.close()
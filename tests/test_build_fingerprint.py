@@ -0,0 +1,54 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from build_fingerprint import build_fingerprint
+
+
+class BuildFingerprintTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+        (self.root / "Dockerfile").write_text("FROM scratch\nCOPY app /\n")
+        (self.root / "app").write_text("app")
+        (self.root / "alt.Dockerfile").write_text("FROM scratch\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def fingerprint(self, dockerfile_path=None, build_args=None, git_rev=None):
+        return build_fingerprint(self.root, dockerfile_path, build_args or {}, git_rev)
+
+    def test_context_changes(self):
+        before = self.fingerprint()
+        self.assertEqual(self.fingerprint(), before)
+        (self.root / "app").write_text("app v2")
+        self.assertNotEqual(self.fingerprint(), before)
+
+    def test_dockerignore_excludes_files(self):
+        (self.root / ".dockerignore").write_text("# build outputs\n*.log\nbuild/\n")
+        before = self.fingerprint()
+        (self.root / "debug.log").write_text("log")
+        (self.root / "build").mkdir()
+        (self.root / "build" / "out.bin").write_text("out")
+        self.assertEqual(self.fingerprint(), before)
+        (self.root / "notes.txt").write_text("notes")
+        self.assertNotEqual(self.fingerprint(), before)
+
+    def test_bookkeeping_dir_is_skipped(self):
+        before = self.fingerprint()
+        (self.root / ".mnb" / "cache").mkdir(parents=True)
+        (self.root / ".mnb" / "cache" / "plan-index.json").write_text("{}")
+        self.assertEqual(self.fingerprint(), before)
+
+    def test_build_parameters_change_fingerprint(self):
+        before = self.fingerprint()
+        (self.root / "Dockerfile").write_text("FROM scratch\nCOPY app /app\n")
+        after_dockerfile = self.fingerprint()
+        self.assertNotEqual(after_dockerfile, before)
+        self.assertNotEqual(self.fingerprint(dockerfile_path="alt.Dockerfile"), after_dockerfile)
+        self.assertNotEqual(self.fingerprint(build_args={"VERSION": "1"}), after_dockerfile)
+        self.assertNotEqual(self.fingerprint(build_args={"VERSION": "1"}),
+                            self.fingerprint(build_args={"VERSION": "2"}))
+        self.assertNotEqual(self.fingerprint(git_rev="a" * 40), after_dockerfile)
+        self.assertNotEqual(self.fingerprint(git_rev="a" * 40), self.fingerprint(git_rev="b" * 40))
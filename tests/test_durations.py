@@ -0,0 +1,26 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from durations import ActionDurations, DEFAULT_DURATION
+from spec import *
+
+
+class ActionDurationsTest(unittest.TestCase):
+    def test_record_and_reload(self):
+        action = Exec("foo", command=["make"])
+        same_action = Exec("foo", command=["make"])
+        skipped_action = Exec("foo", command=["true"])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "durations.json"
+            durations = ActionDurations(path)
+            self.assertEqual(durations.estimate(action), DEFAULT_DURATION)
+            durations.record(action, 4.0)
+            durations.record(action, 2.0)
+            durations.mark_skipped(skipped_action)
+            durations.record(skipped_action, 0.01)
+            durations.save()
+
+            reloaded = ActionDurations(path)
+            self.assertEqual(reloaded.estimate(same_action), 3.0)
+            self.assertEqual(reloaded.estimate(skipped_action), DEFAULT_DURATION)
@@ -0,0 +1,112 @@
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+from fusion import FusedExec, FusedStep, fuse_actions, fused_script, status_file
+from plan import build_plan_graph
+from spec import *
+
+
+def copy_action(image: str, src: str, dst: str, **kwargs) -> Exec:
+    return Exec(image, ["cp", "in", "out"],
+                inputs=[Input(File(src), ThroughFile("in"))] + kwargs.get("inputs", []),
+                outputs=[Output(File(dst), ThroughFile("out"))] + kwargs.get("outputs", []))
+
+
+def fuse(actions, chains_only=True, can_fuse=lambda action: True):
+    dependencies = build_plan_graph(Spec((1, 0), actions)).dependencies()
+    order = [action for action in actions if action in dependencies]
+    return fuse_actions(order, dependencies, can_fuse, chains_only)
+
+
+class FuseActionsTest(unittest.TestCase):
+    def test_chain_is_fused(self):
+        pull = PullImage("foo")
+        chain = [copy_action("foo", f"{i}.txt", f"{i + 1}.txt") for i in range(3)]
+        other = copy_action("bar", "3.txt", "4.txt")
+        fused = fuse([pull, PullImage("bar")] + chain + [other])
+        node = next(node for node in fused if isinstance(node, FusedExec))
+        self.assertEqual(node.actions, chain)
+        self.assertEqual(fused[node], [pull])
+        self.assertIn(node, fused[other])
+
+    def test_independent_actions_are_fused_only_if_serial(self):
+        pull = PullImage("foo")
+        a = copy_action("foo", "a", "a.out")
+        b = copy_action("foo", "b", "b.out")
+        self.assertEqual(len(fuse([pull, a, b], chains_only=True)), 3)
+        fused = fuse([pull, a, b], chains_only=False)
+        self.assertEqual([len(node.actions) for node in fused if isinstance(node, FusedExec)], [2])
+
+    def test_incompatible_actions_are_not_fused(self):
+        pull = PullImage("foo")
+        a = copy_action("foo", "src", "out/a")
+        # consumes the output as a part of a dir
+        b = Exec("foo", ["ls"], inputs=[Input(Dir("out"), ThroughDir("out"))], outputs=[Output(File("list"), ThroughFile("list"))])
+        # output through stdout
+        c = Exec("foo", ["cat", "a"], inputs=[Input(File("out/a"), ThroughFile("a"))], outputs=[Output(File("c"), ThroughStdout())])
+        # asks for a tmpfs scratch dir
+        f = copy_action("foo", "out/a", "f")
+        f.tmpfs_size = 2**20
+        for actions in ([a, b], [a, c], [a, f]):
+            self.assertFalse(any(isinstance(node, FusedExec) for node in fuse([pull] + actions)))
+        # not allowed by the caller
+        self.assertFalse(any(isinstance(node, FusedExec)
+                             for node in fuse([pull, a, f], can_fuse=lambda action: action is not f)))
+
+    def test_same_environment_variable(self):
+        pull = PullImage("foo")
+        # every step has its own environment
+        d = copy_action("foo", "src", "d", inputs=[Input(File("x"), ThroughEnvironment("X"))])
+        e = copy_action("foo", "d", "e", inputs=[Input(File("y"), ThroughEnvironment("X"))])
+        self.assertTrue(any(isinstance(node, FusedExec) for node in fuse([pull, d, e])))
+
+    def test_dependency_outside_of_group(self):
+        pull = PullImage("foo")
+        a = copy_action("foo", "src", "a")
+        b = Exec("bar", ["true"], outputs=[Output(File("b"), ThroughFile("b"))])
+        # depends on a and on b, which is not a dependency of a
+        c = copy_action("foo", "a", "c", inputs=[Input(File("b"), ThroughFile("b"))])
+        fused = fuse([pull, PullImage("bar"), a, b, c])
+        self.assertFalse(any(isinstance(node, FusedExec) for node in fused))
+
+
+class FusedScriptTest(unittest.TestCase):
+    def test_steps_run_in_order_until_failure(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            for i in range(4):
+                (root / "steps" / str(i)).mkdir(parents=True)
+            (root / "status").mkdir()
+            (root / "steps" / "0" / "in.txt").write_text("hello\n")
+            steps = [
+                FusedStep(["sh", "-c", "tr a-z A-Z < in.txt > out.txt; echo done"], None, []),
+                FusedStep(["sh", "-c", "cat ../data/x.txt > y.txt; pwd"], "work", [(0, "out.txt", "data/x.txt")]),
+                FusedStep(["sh", "-c", "echo failed >&2; exit 3"], None, []),
+                FusedStep(["true"], None, []),
+            ]
+            result = subprocess.run(["/bin/sh", "-c", fused_script(steps)], cwd=root)
+            self.assertEqual(result.returncode, 3)
+            self.assertEqual((root / "steps" / "1" / "work" / "y.txt").read_text(), "HELLO\n")
+            self.assertEqual((root / status_file(0, "out")).read_text(), "done\n")
+            self.assertEqual((root / status_file(1, "out")).read_text(), "/".join([str(root), "run", "work\n"]))
+            self.assertEqual((root / status_file(2, "err")).read_text(), "failed\n")
+            self.assertEqual([(root / status_file(i, "exit")).read_text() for i in range(3)], ["0\n", "0\n", "3\n"])
+            self.assertFalse((root / status_file(3, "exit")).exists())
+
+    def test_environment_is_per_step(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            for i in range(3):
+                (root / "steps" / str(i)).mkdir(parents=True)
+            (root / "status").mkdir()
+            steps = [
+                FusedStep(["sh", "-c", 'echo "$X"'], None, [], {"X": "it's x", "Y": "y"}),
+                FusedStep(["sh", "-c", 'echo "${X-unset} $Y"'], None, [], {"Y": "$HOME"}),
+                FusedStep(["sh", "-c", 'echo "${X-unset} ${Y-unset}"'], None, []),
+            ]
+            result = subprocess.run(["/bin/sh", "-c", fused_script(steps)], cwd=root)
+            self.assertEqual(result.returncode, 0)
+            self.assertEqual([(root / status_file(i, "out")).read_text() for i in range(3)],
+                             ["it's x\n", "unset $HOME\n", "unset unset\n"])
@@ -0,0 +1,48 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from generator_cache import GeneratorCache
+from spec import *
+
+GENERATOR = Spec((1, 0), [
+    Exec("generator", ["python", "mnb-plan.py"], None, None,
+         [Input(Dir("."), ThroughDir("/src"))],
+         [Output(File("mnb-plan.json"), ThroughStdout())]),
+])
+
+
+class GeneratorCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+        self.cache = GeneratorCache(self.root / ".mnb" / "cache")
+        self.image_ids = {"generator": "sha256:1"}
+        (self.root / "mnb-plan.py").write_text("print()")
+        (self.root / "docs").mkdir()
+        (self.root / "docs" / "index.md").write_text("# docs")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def key(self, produced_paths=("build", "docs/index.html")):
+        return self.cache.key_for(b"{}", GENERATOR, self.root, self.image_ids.get, produced_paths)
+
+    def test_produced_paths_are_not_inputs(self):
+        key = self.key()
+        self.cache.prepare_output().write_bytes(b"{}")
+        self.cache.store(key)
+        (self.root / "build").mkdir()
+        (self.root / "build" / "app").write_text("app")
+        (self.root / "docs" / "index.html").write_text("<html/>")
+        self.assertEqual(self.key(), key)
+        self.assertEqual(self.cache.output_path_for(self.key()), self.cache.output_path)
+        (self.root / "docs" / "index.md").write_text("# more docs")
+        self.assertNotEqual(self.key(), key)
+
+    def test_image_id_is_a_part_of_key(self):
+        key = self.key()
+        self.image_ids["generator"] = "sha256:2"
+        self.assertNotEqual(self.key(), key)
+        del self.image_ids["generator"]
+        self.assertNotEqual(self.key(), key)
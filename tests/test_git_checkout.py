@@ -0,0 +1,61 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import git
+
+import git_checkout
+from git_checkout import GitCheckouts
+
+
+class GitCheckoutsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = Path(self.tmp_dir.name)
+        # commits are made in a work repo and pushed to a local bare repo, which serves as the remote
+        work_repo = git.Repo.init(str(root / "work"))
+        actor = git.Actor("test", "test@example.com")
+        self.commits = []
+        for version in ["1", "2"]:
+            (root / "work" / "version").write_text(version)
+            work_repo.index.add(["version"])
+            self.commits.append(work_repo.index.commit(f"version {version}", author=actor, committer=actor).hexsha)
+        git.Repo.init(str(root / "remote.git"), bare=True)
+        work_repo.git.push(str(root / "remote.git"), "HEAD:refs/heads/master")
+        git.Repo(str(root / "remote.git")).git.symbolic_ref("HEAD", "refs/heads/master")
+        self.repo_url = (root / "remote.git").as_uri()
+        self.checkouts = GitCheckouts(root / "mnb" / "repo")
+        self.messages = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def checkout(self, rev):
+        return self.checkouts.checkout(self.repo_url, rev, self.messages.append)
+
+    def test_checkout_rev(self):
+        worktree_path, commit = self.checkout(None)
+        self.assertEqual(commit, self.commits[1])
+        self.assertEqual((worktree_path / "version").read_text(), "2")
+        worktree_path, commit = self.checkout(self.commits[0])
+        self.assertEqual(commit, self.commits[0])
+        self.assertEqual((worktree_path / "version").read_text(), "1")
+
+    def test_fetch_skipped_for_present_commit(self):
+        self.checkout(self.commits[1])
+        with mock.patch.object(git_checkout, 'fetch_rev', side_effect=AssertionError("fetched")):
+            _, commit = self.checkout(self.commits[1])
+            # abbreviated commit ids are resolved locally too
+            _, abbreviated_commit = self.checkout(self.commits[1][:10])
+        self.assertEqual(commit, self.commits[1])
+        self.assertEqual(abbreviated_commit, self.commits[1])
+        self.assertIn(f"commit {self.commits[1]} is already present, fetch skipped", self.messages)
+
+    def test_worktree_is_reused(self):
+        worktree_path, commit = self.checkout("master")
+        self.assertEqual(self.checkout(None), (worktree_path, commit))
+        self.assertEqual(self.checkout(commit), (worktree_path, commit))
+        self.assertEqual(self.messages.count(f"create worktree {worktree_path}"), 1)
+        self.assertEqual(self.messages.count(f"use existing worktree {worktree_path}"), 2)
+        self.assertEqual(list(worktree_path.parent.iterdir()), [worktree_path])
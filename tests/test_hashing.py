@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from hashing import HashMemo, hash_dir, read_and_hash_file
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_memo_persists_and_detects_changes(self):
+        path = self.root / "a"
+        path.write_text("a")
+        # make the file old enough to be memoized
+        os.utime(path, ns=(10**9, 10**9))
+        memo_path = self.root / ".mnb" / "hashes.json"
+        memo = HashMemo(memo_path)
+        self.assertEqual(memo.hash_file(path), read_and_hash_file(path))
+        memo.save()
+        reloaded = HashMemo(memo_path)
+        self.assertEqual(reloaded.entries, memo.entries)
+        path.write_text("bb")
+        self.assertEqual(reloaded.hash_file(path), read_and_hash_file(path))
+
+    def test_dir_hash_ignores_bookkeeping_dir(self):
+        (self.root / "a").write_text("a")
+        before = hash_dir(self.root)
+        (self.root / ".mnb").mkdir()
+        (self.root / ".mnb" / "x").write_text("x")
+        self.assertEqual(before, hash_dir(self.root))
+        (self.root / "b").write_text("b")
+        self.assertNotEqual(before, hash_dir(self.root))
+
+    def test_dir_hash_ignores_excluded_paths(self):
+        (self.root / "src").mkdir()
+        (self.root / "src" / "a").write_text("a")
+        before = hash_dir(self.root, exclude={".mnb", "src/out", "build"})
+        (self.root / "src" / "out").write_text("out")
+        (self.root / "build").mkdir()
+        (self.root / "build" / "b").write_text("b")
+        self.assertEqual(before, hash_dir(self.root, exclude={".mnb", "src/out", "build"}))
+        (self.root / "out").write_text("out")
+        self.assertNotEqual(before, hash_dir(self.root, exclude={".mnb", "src/out", "build"}))
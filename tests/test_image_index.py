@@ -0,0 +1,89 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import executor
+from common import CommandLineOptions
+from errors import ImageNotPresent, SpecSemanticError
+from image_index import LocalImageIndex, normalize_image_name
+from spec import *
+
+DIGEST = "sha256:" + "a" * 64
+
+
+def stub_client(repo_tags=(), repo_digests=()):
+    """Docker client listing a single local image with the given names"""
+    client = mock.Mock()
+    client.images.list.return_value = [mock.Mock(attrs={'RepoTags': list(repo_tags),
+                                                        'RepoDigests': list(repo_digests)})]
+    client.api.pull.return_value = iter([{"status": "Downloaded"}])
+    return client
+
+
+class NormalizeImageNameTest(unittest.TestCase):
+    def test_default_tag(self):
+        self.assertEqual(normalize_image_name("foo"), "foo:latest")
+        self.assertEqual(normalize_image_name("foo:latest"), "foo:latest")
+        self.assertEqual(normalize_image_name("foo:1.0"), "foo:1.0")
+
+    def test_registry_prefix(self):
+        for name in ["docker.io/library/foo", "docker.io/foo", "index.docker.io/library/foo:latest"]:
+            self.assertEqual(normalize_image_name(name), "foo:latest")
+        self.assertEqual(normalize_image_name("docker.io/acme/foo:1.0"), "acme/foo:1.0")
+        # other registries are kept, as is a registry port
+        self.assertEqual(normalize_image_name("registry.example.com:5000/foo"), "registry.example.com:5000/foo:latest")
+
+    def test_digest(self):
+        self.assertEqual(normalize_image_name(f"foo@{DIGEST}"), f"foo@{DIGEST}")
+        self.assertEqual(normalize_image_name(f"docker.io/library/foo@{DIGEST}"), f"foo@{DIGEST}")
+
+    def test_index(self):
+        index = LocalImageIndex(stub_client(["docker.io/library/foo:1.0"], [f"foo@{DIGEST}"]))
+        self.assertTrue(index.contains("foo:1.0"))
+        self.assertTrue(index.contains(f"docker.io/library/foo@{DIGEST}"))
+        self.assertFalse(index.contains("foo"))
+        index.add("foo")
+        self.assertTrue(index.contains("foo:latest"))
+
+
+class PullPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        cliopts = CommandLineOptions()
+        cliopts.rootabspath = self.tmp_dir.name
+        cliopts.dev_mode = True
+        cliopts.windows_host = False
+        cliopts.subcommand = "update"
+        self.context = executor.Context(cliopts)
+        self.client = stub_client(["foo:latest"])
+        patcher = mock.patch.object(executor.Context, 'docker_client', new_callable=mock.PropertyMock,
+                                    return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.context.close()
+        self.tmp_dir.cleanup()
+
+    def test_always(self):
+        executor.execute_pull_image(PullImage("foo", PULL_ALWAYS), self.context)
+        self.client.api.pull.assert_called_once()
+        # the index is not even listed
+        self.client.images.list.assert_not_called()
+
+    def test_if_not_present(self):
+        executor.execute_pull_image(PullImage("docker.io/library/foo", PULL_IF_NOT_PRESENT), self.context)
+        self.client.api.pull.assert_not_called()
+        executor.execute_pull_image(PullImage("bar", PULL_IF_NOT_PRESENT), self.context)
+        self.client.api.pull.assert_called_once()
+        # pulled image is recorded, so it is not pulled again
+        executor.execute_pull_image(PullImage("bar:latest", PULL_IF_NOT_PRESENT), self.context)
+        self.client.api.pull.assert_called_once()
+        self.assertEqual(self.client.images.list.call_count, 1)
+
+    def test_never(self):
+        executor.execute_pull_image(PullImage("foo", PULL_NEVER), self.context)
+        with self.assertRaises(ImageNotPresent) as raised:
+            executor.execute_pull_image(PullImage("bar", PULL_NEVER), self.context)
+        self.assertIsInstance(raised.exception, SpecSemanticError)
+        self.client.api.pull.assert_not_called()
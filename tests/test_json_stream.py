@@ -0,0 +1,37 @@
+import io
+import unittest
+
+from json_stream import JsonStream, JsonStreamError
+
+
+def stream(text: str, chunk_size: int = 3) -> JsonStream:
+    return JsonStream(io.BytesIO(text.encode()), chunk_size=chunk_size)
+
+
+class JsonStreamTest(unittest.TestCase):
+    def test_object_with_array(self):
+        reader = stream(' {"n": 12345, "items": [1, {"a": "ü\\"x"}, [2, 3]], "empty": []} ')
+        result = dict()
+        for (key, _) in reader.read_object_items():
+            if key == "items" or key == "empty":
+                result[key] = list(reader.read_array_items())
+            else:
+                result[key] = reader.read_value()
+        reader.expect_end()
+        self.assertEqual(result, {"n": 12345, "items": [1, {"a": "ü\"x"}, [2, 3]], "empty": []})
+
+    def test_number_at_chunk_boundary(self):
+        reader = stream("[123456789]", chunk_size=4)
+        self.assertEqual(list(reader.read_array_items()), [123456789])
+
+    def test_truncated_document(self):
+        reader = stream('{"items": [1, 2')
+        with self.assertRaises(JsonStreamError):
+            for (key, _) in reader.read_object_items():
+                list(reader.read_array_items())
+
+    def test_trailing_data(self):
+        reader = stream('{} x')
+        list(reader.read_object_items())
+        with self.assertRaises(JsonStreamError):
+            reader.expect_end()
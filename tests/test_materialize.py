@@ -0,0 +1,31 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from materialize import materialize, RENAME, REFLINK, HARDLINK, COPY
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+        self.src = self.root / "scratch" / "out.txt"
+        self.src.parent.mkdir()
+        self.src.write_text("content")
+        self.dst = self.root / "out.txt"
+        self.dst.write_text("previous")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_move(self):
+        self.assertEqual(materialize(self.src, self.dst), RENAME)
+        self.assertEqual(self.dst.read_text(), "content")
+        self.assertFalse(self.src.exists())
+
+    def test_keep_source(self):
+        strategy = materialize(self.src, self.dst, move=False)
+        self.assertIn(strategy, [REFLINK, HARDLINK, COPY])
+        self.assertEqual(self.dst.read_text(), "content")
+        self.assertEqual(self.src.read_text(), "content")
+        self.assertEqual(sorted(p.name for p in self.root.iterdir()), ["out.txt", "scratch"])
@@ -0,0 +1,20 @@
+import unittest
+
+from path_trie import PathTrie
+
+
+class PathTrieTest(unittest.TestCase):
+    def setUp(self):
+        self.trie = PathTrie()
+        for path in [".", "a", "a/b", "./a/b/c.txt", "a/bc", "d"]:
+            self.trie.add(path, path)
+
+    def test_items_containing(self):
+        self.assertEqual(list(self.trie.items_containing("a/b/c.txt")), [".", "a", "a/b", "./a/b/c.txt"])
+        self.assertEqual(list(self.trie.items_containing("a/x/y")), [".", "a"])
+
+    def test_items_within(self):
+        self.assertEqual(set(self.trie.items_within("a/b")), {"a/b", "./a/b/c.txt"})
+        self.assertEqual(set(self.trie.items_within("a")), {"a", "a/b", "./a/b/c.txt", "a/bc"})
+        self.assertEqual(len(list(self.trie.items_within("."))), 6)
+        self.assertEqual(list(self.trie.items_within("x")), [])
@@ -0,0 +1,50 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from spec import *
+from plan import build_plan_graph
+from plan_index import save_plan_index, load_plan_index
+
+
+class PlanIndexTest(unittest.TestCase):
+    def test_affected_from_saved_index(self):
+        pull_image = PullImage("foo")
+        a_to_b = Exec(image_name="foo", command=["cp", "a", "b"], entrypoint=None, workdir=None,
+                      inputs=[Input(value=File("a"), through=ThroughFile("a"))],
+                      outputs=[Output(value=File("b"), through=ThroughFile("b"))])
+        b_to_c = Exec(image_name="foo", command=["cp", "b", "c"], entrypoint=None, workdir=None,
+                      inputs=[Input(value=File("b"), through=ThroughFile("b"))],
+                      outputs=[Output(value=File("c"), through=ThroughFile("c"))])
+        notes_to_d = Exec(image_name="foo", command=["ls"], entrypoint=None, workdir=None,
+                          inputs=[Input(value=Dir("notes"), through=ThroughDir("notes"))],
+                          outputs=[Output(value=Dir("d"), through=ThroughDir("d"))])
+        spec = Spec(spec_version=(1, 0), actions=[pull_image, a_to_b, b_to_c, notes_to_d])
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = Path(tmp) / "plan-index.json"
+            save_plan_index(spec, build_plan_graph(spec), index_path)
+            graph = load_plan_index(index_path)
+
+        self.assertEqual({action.number for action in graph.downstream_actions(["a"])}, {1, 2})
+        self.assertEqual({action.number for action in graph.downstream_actions(["notes/2024/x.md"])}, {3})
+        self.assertEqual(graph.downstream_actions(["c"]), set())
+        (notes_action,) = graph.downstream_actions(["notes"])
+        self.assertEqual(notes_action.description, "exec foo ['ls']")
+        self.assertEqual([node.value.path for node in graph.action_node(notes_action).output_value_nodes], ["d"])
+
+    def test_build_context_affects_image_users(self):
+        build_image = BuildImage("bar", context_path="containers/bar", build_args={},
+                                 dockerfile_path="../Dockerfile.bar")
+        run = Exec(image_name="bar", command=["run"], outputs=[Output(value=File("out"), through=ThroughStdout())])
+        spec = Spec(spec_version=(1, 0), actions=[build_image, run])
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = Path(tmp) / "plan-index.json"
+            save_plan_index(spec, build_plan_graph(spec), index_path)
+            graph = load_plan_index(index_path)
+        for path in ["containers/bar/Dockerfile", "containers/bar", "containers/Dockerfile.bar"]:
+            self.assertEqual({action.number for action in graph.downstream_actions([path])}, {0, 1})
+        self.assertEqual(graph.downstream_actions(["containers/foo/Dockerfile"]), set())
+
+    def test_missing_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertIsNone(load_plan_index(Path(tmp) / "plan-index.json"))
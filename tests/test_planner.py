@@ -1,7 +1,8 @@
 import unittest
 
 from spec import *
-from plan import toposort_actions
+from errors import UnknownTarget, ProducerConflict, DependencyCycle
+from plan import toposort_actions, build_plan_graph
 
 class Test(unittest.TestCase):
     def test_spec_from_scratch(self):
@@ -29,3 +30,120 @@ class Test(unittest.TestCase):
         i1 = planned_actions.index(a1)
         i2 = planned_actions.index(a2)
         return i1 < i2
+
+class DownstreamActionsTest(unittest.TestCase):
+    def test_closure_of_changed_paths(self):
+        pull_image = PullImage("foo")
+        a_to_b = Exec(image_name="foo", command=["cp", "a", "b"], entrypoint=None, workdir=None,
+                      inputs=[Input(value=File("a"), through=ThroughFile("a"))],
+                      outputs=[Output(value=File("out/b"), through=ThroughFile("b"))])
+        out_to_c = Exec(image_name="foo", command=["ls"], entrypoint=None, workdir=None,
+                        inputs=[Input(value=Dir("out"), through=ThroughDir("out"))],
+                        outputs=[Output(value=File("c"), through=ThroughStdout())])
+        d_to_e = Exec(image_name="foo", command=["cp", "d", "e"], entrypoint=None, workdir=None,
+                      inputs=[Input(value=Dir("src"), through=ThroughDir("src"))],
+                      outputs=[Output(value=File("e"), through=ThroughStdout())])
+        graph = build_plan_graph(Spec(spec_version=(1, 0), actions=[pull_image, a_to_b, out_to_c, d_to_e]))
+        self.assertEqual(graph.downstream_actions(["a"]), {a_to_b, out_to_c})
+        self.assertEqual(graph.downstream_actions(["src/x/y.txt"]), {d_to_e})
+        self.assertEqual(graph.downstream_actions(["unrelated"]), set())
+        # "out" is only partially produced, other files in it are sources
+        self.assertEqual(graph.source_paths(), ({"a"}, {"src", "out"}))
+
+class UpstreamActionsTest(unittest.TestCase):
+    def test_closure_of_targets(self):
+        pull_image = PullImage("foo")
+        build_image = BuildImage("bar", context_path="bar", build_args={})
+        a_to_b = Exec(image_name="foo", command=["cp", "a", "b"], entrypoint=None, workdir=None,
+                      inputs=[Input(value=File("a"), through=ThroughFile("a"))],
+                      outputs=[Output(value=File("out/b"), through=ThroughFile("b"))])
+        out_to_c = Exec(image_name="foo", command=["ls"], entrypoint=None, workdir=None,
+                        inputs=[Input(value=Dir("out"), through=ThroughDir("out"))],
+                        outputs=[Output(value=File("c"), through=ThroughStdout())])
+        d_to_e = Exec(image_name="bar", command=["cp", "d", "e"], entrypoint=None, workdir=None,
+                      inputs=[Input(value=File("d"), through=ThroughFile("d"))],
+                      outputs=[Output(value=File("e"), through=ThroughStdout())])
+        graph = build_plan_graph(Spec(spec_version=(1, 0),
+                                      actions=[pull_image, build_image, a_to_b, out_to_c, d_to_e]))
+        self.assertEqual(graph.upstream_actions(["c"]), {pull_image, a_to_b, out_to_c})
+        self.assertEqual(graph.upstream_actions(["./e"]), {build_image, d_to_e})
+        self.assertEqual(graph.upstream_actions(["out"]), {pull_image, a_to_b})
+        with self.assertRaises(UnknownTarget):
+            graph.upstream_actions(["a"])
+
+class ContainmentTest(unittest.TestCase):
+    def test_dir_consumer_depends_on_producers_within(self):
+        pull_image = PullImage("foo")
+        produce_csv = Exec(image_name="foo", command=["fetch"],
+                           outputs=[Output(value=File("data/x.csv"), through=ThroughStdout())])
+        produce_raw = Exec(image_name="foo", command=["fetch"],
+                           outputs=[Output(value=Dir("data/raw"), through=ThroughDir("raw"))])
+        consume_data = Exec(image_name="foo", command=["ls"],
+                            inputs=[Input(value=Dir("./data"), through=ThroughDir("data"))])
+        consume_raw_file = Exec(image_name="foo", command=["cat"],
+                                inputs=[Input(value=File("data/raw/1.txt"), through=ThroughStdin())])
+        graph = build_plan_graph(Spec(spec_version=(1, 0),
+                                      actions=[pull_image, produce_csv, produce_raw, consume_data, consume_raw_file]))
+        dependencies = graph.dependencies()
+        self.assertEqual(set(dependencies[consume_data]), {pull_image, produce_csv, produce_raw})
+        self.assertEqual(set(dependencies[consume_raw_file]), {pull_image, produce_raw})
+        self.assertEqual(graph.downstream_actions(["data/x.csv"]), {consume_data})
+
+    def test_overlapping_producers(self):
+        pull_image = PullImage("foo")
+        produce_dir = Exec(image_name="foo", command=["make"],
+                           outputs=[Output(value=Dir("out"), through=ThroughDir("out"))])
+        produce_file = Exec(image_name="foo", command=["make"],
+                            outputs=[Output(value=File("out/sub/x"), through=ThroughStdout())])
+        with self.assertRaises(ProducerConflict) as e:
+            build_plan_graph(Spec(spec_version=(1, 0), actions=[pull_image, produce_dir, produce_file]))
+        self.assertEqual({e.exception.producer, e.exception.prev_producer}, {produce_dir, produce_file})
+
+    def test_same_dir_produced_twice(self):
+        pull_image = PullImage("foo")
+        produce_dirs = [Exec(image_name="foo", command=["make"],
+                             outputs=[Output(value=Dir("out"), through=ThroughDir("out"))]) for _ in range(2)]
+        with self.assertRaises(ProducerConflict) as e:
+            build_plan_graph(Spec(spec_version=(1, 0), actions=[pull_image] + produce_dirs))
+        self.assertIs(e.exception.prev_producer, produce_dirs[0])
+
+    def test_same_file_spelled_differently(self):
+        pull_image = PullImage("foo")
+        produce_files = [Exec(image_name="foo", command=["make"],
+                              outputs=[Output(value=File(path), through=ThroughStdout())]) for path in ["a/b", "./a/b"]]
+        with self.assertRaises(ProducerConflict):
+            build_plan_graph(Spec(spec_version=(1, 0), actions=[pull_image] + produce_files))
+
+    def test_producers_within_consumed_dir(self):
+        pull_image = PullImage("foo")
+        render = [Exec(image_name="foo", command=["render", name],
+                       inputs=[Input(value=Dir("docs"), through=ThroughDir("docs"))],
+                       outputs=[Output(value=File(f"docs/{name}.pdf"), through=ThroughFile(f"{name}.pdf"))])
+                  for name in ["a", "b"]]
+        # the whole dir as sources, taking pdfs produced in it
+        index = Exec(image_name="foo", command=["index"],
+                     inputs=[Input(value=Dir("docs"), through=ThroughDir("docs"))],
+                     outputs=[Output(value=File("index.html"), through=ThroughStdout())])
+        s = Spec(spec_version=(1, 0), actions=[pull_image] + render + [index])
+        dependencies = build_plan_graph(s).dependencies()
+        self.assertEqual(dependencies[render[0]], [pull_image])
+        self.assertEqual(dependencies[render[1]], [pull_image])
+        self.assertEqual(set(dependencies[index]), {pull_image} | set(render))
+        self.assertEqual(len(toposort_actions(s)), 4)
+
+    def test_containment_cycle(self):
+        pull_image = PullImage("foo")
+        a = Exec(image_name="foo", command=["a"],
+                 inputs=[Input(value=Dir("docs"), through=ThroughDir("docs"))],
+                 outputs=[Output(value=File("a.txt"), through=ThroughStdout())])
+        b = Exec(image_name="foo", command=["b"],
+                 inputs=[Input(value=File("a.txt"), through=ThroughStdin())],
+                 outputs=[Output(value=File("b.txt"), through=ThroughStdout())])
+        # produces into the dir a consumes, while depending on a through b
+        c = Exec(image_name="foo", command=["c"],
+                 inputs=[Input(value=File("b.txt"), through=ThroughStdin())],
+                 outputs=[Output(value=File("docs/c.pdf"), through=ThroughStdout())])
+        with self.assertRaises(DependencyCycle) as e:
+            build_plan_graph(Spec(spec_version=(1, 0), actions=[pull_image, a, b, c]))
+        self.assertLessEqual({e.exception.action, e.exception.other_action}, {a, b, c})
+        self.assertNotEqual(e.exception.action, e.exception.other_action)
@@ -0,0 +1,49 @@
+import threading
+import unittest
+
+from scheduler import run_actions, SchedulingAborted, remaining_path_lengths, critical_path
+
+
+class Test(unittest.TestCase):
+    def test_dependencies_complete_first(self):
+        dependencies = {"a": [], "b": [], "c": ["a", "b"], "d": ["c"], "e": []}
+        finished = set()
+        lock = threading.Lock()
+
+        def execute(action):
+            with lock:
+                for dependency in dependencies[action]:
+                    self.assertIn(dependency, finished)
+                finished.add(action)
+            return action.upper()
+
+        completed = run_actions(dependencies, 3, execute)
+        self.assertEqual(len(completed), 5)
+        self.assertEqual(completed[-1], ("d", "D"))
+
+    def test_failure_stops_scheduling(self):
+        dependencies = {"a": [], "b": ["a"], "c": ["b"]}
+        executed = []
+
+        def execute(action):
+            executed.append(action)
+            if action == "a":
+                raise ValueError("boom")
+
+        with self.assertRaises(SchedulingAborted) as cm:
+            run_actions(dependencies, 2, execute)
+        self.assertIsInstance(cm.exception.cause, ValueError)
+        self.assertEqual(cm.exception.not_started, 2)
+        self.assertEqual(executed, ["a"])
+
+    def test_critical_path_starts_first(self):
+        # "slow" chain is the longest one, though "a" and "b" become ready earlier in insertion order
+        dependencies = {"a": [], "b": [], "slow": [], "after_slow": ["slow"], "after_a": ["a"]}
+        durations = {"a": 1.0, "b": 1.0, "slow": 10.0, "after_slow": 5.0, "after_a": 2.0}
+        lengths = remaining_path_lengths(dependencies, durations.__getitem__)
+        self.assertEqual(lengths["slow"], 15.0)
+        self.assertEqual(lengths["a"], 3.0)
+        self.assertEqual(critical_path(dependencies, lengths), ["slow", "after_slow"])
+        started = []
+        run_actions(dependencies, 1, started.append, lengths)
+        self.assertEqual(started, ["slow", "after_slow", "a", "after_a", "b"])
@@ -0,0 +1,54 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from scratch import ScratchAllocator, collect_garbage
+
+
+class ScratchAllocatorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name) / "scratch"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_dirs_are_unique_and_recycled_empty(self):
+        allocator = ScratchAllocator(self.root, self.root)
+        a = allocator.allocate()
+        b = allocator.allocate()
+        self.assertNotEqual(a.path, b.path)
+        (a.path / "sub").mkdir()
+        (a.path / "sub" / "out.txt").write_text("out")
+        allocator.release(a)
+        self.assertEqual(list(a.path.iterdir()), [])
+        c = allocator.allocate()
+        self.assertEqual(c.path, a.path)
+        allocator.close()
+        self.assertFalse(a.path.exists())
+        self.assertEqual(list(self.root.iterdir()), [])
+
+    def test_free_dirs_are_bounded(self):
+        allocator = ScratchAllocator(self.root, self.root, max_free=1)
+        dirs = [allocator.allocate() for _ in range(3)]
+        for scratch_dir in dirs:
+            allocator.release(scratch_dir)
+        self.assertEqual(sum(1 for scratch_dir in dirs if scratch_dir.path.exists()), 1)
+        allocator.close()
+
+    def test_gc_removes_only_stale_sessions(self):
+        live = ScratchAllocator(self.root, self.root)
+        live_dir = live.allocate()
+        stale = ScratchAllocator(self.root, self.root)
+        stale_dir = stale.allocate()
+        (stale_dir.path / "big.bin").write_bytes(b"x" * 1000)
+        # as if the process was killed: lock released, nothing removed
+        stale.lock_file.close()
+        (removed, reclaimed) = collect_garbage(self.root)
+        self.assertEqual((removed, reclaimed), (1, 1000))
+        self.assertFalse(stale_dir.path.exists())
+        self.assertTrue(live_dir.path.exists())
+        self.assertEqual(sorted(path.name for path in self.root.iterdir()),
+                         sorted([live.session, live.session + ".lock"]))
+        live.close()
+
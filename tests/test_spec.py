@@ -0,0 +1,56 @@
+import json
+import unittest
+from pathlib import PurePosixPath
+
+import spec_parser
+from spec import *
+
+
+def example_spec() -> Spec:
+    s = Spec((1, 0), settings=Settings(backends={"tools": BACKEND_HOST}))
+    builder = s.build_image("builder", context_path="docker", build_args={"VERSION": "1"},
+                            dockerfile_path="docker/Dockerfile", from_git=FromGit("https://example.com/repo.git", "main"),
+                            extra_tags=["builder:1"])
+    s.pull_image("alpine", pull_policy=PULL_IF_NOT_PRESENT)
+    s.exec(builder, ["make", Dir("src"), PurePosixPath("/mnb/run/out")], workdir="/mnb/run", tmpfs_size=1 << 20) \
+        .input(dir="src") \
+        .input(file="config.json", through_stdin=True) \
+        .input(file="token.txt", through_env="TOKEN") \
+        .output("build.log", through_stdout=True) \
+        .output("errors.log", through_stderr=True) \
+        .output("app", through_file="out/app")
+    s.exec("tools", ["ls"], entrypoint="/bin/sh")
+    return s
+
+
+class SpecTest(unittest.TestCase):
+    def test_stream_throughs_are_singletons(self):
+        for through_class in [ThroughStdin, ThroughStdout, ThroughStderr]:
+            self.assertIs(through_class(), through_class())
+        self.assertIsNot(ThroughStdout(), ThroughStderr())
+        self.assertIs(spec_parser.parse_output(output_to_json(Output(File("a"), ThroughStdout()))).through,
+                      ThroughStdout())
+
+    def test_helpers_build_equal_actions(self):
+        s = Spec((1, 0))
+        s.pull_image("alpine")
+        s.exec("alpine", ["ls", File("a")], workdir=PurePosixPath("/w")) \
+            .input(file="a") \
+            .input(dir="d", through_dir="/d") \
+            .output("out.txt", through_stdout=True) \
+            .output("b")
+        direct = Spec((1, 0), [
+            PullImage("alpine"),
+            Exec("alpine", ["ls", "a"], None, "/w",
+                 [Input(File("a"), ThroughFile("a")), Input(Dir("d"), ThroughDir("/d"))],
+                 [Output(File("out.txt"), ThroughStdout()), Output(File("b"), ThroughFile("b"))]),
+        ])
+        self.assertEqual(spec_to_json(s), spec_to_json(direct))
+        with self.assertRaises(ValueError):
+            s.exec("alpine").input(through_file="a")
+
+    def test_json_round_trip(self):
+        spec_json = spec_to_json(example_spec())
+        parsed = spec_parser.parse_spec_bytes(json.dumps(spec_json).encode())
+        self.assertEqual(spec_to_json(parsed), spec_json)
+        self.assertEqual(parsed.settings.backend_for("tools"), BACKEND_HOST)
@@ -0,0 +1,93 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from jsonschema.exceptions import ValidationError
+
+import spec_parser
+from spec import *
+
+SPEC_JSON = {
+    "spec_version": "1.0",
+    "actions": [
+        {"pull_image": {"image_name": "foo"}},
+        {"exec": {"image_name": "foo", "command": ["ls"],
+                  "outputs": [{"value": {"file": {"path": "out.txt"}}, "through": {"stream": {"name": "STDOUT"}}}]}},
+    ]
+}
+
+
+class ParseSpecTest(unittest.TestCase):
+    def setUp(self):
+        spec_parser.enable_validated_specs_memo(None)
+
+    def test_parse(self):
+        s = spec_parser.parse_spec_bytes(json.dumps(SPEC_JSON).encode())
+        self.assertEqual(s.spec_version, (1, 0))
+        self.assertIsInstance(s.actions[0], PullImage)
+        self.assertEqual(s.actions[1].outputs[0].value.path, "out.txt")
+
+    def test_settings(self):
+        s = spec_parser.parse_spec_bytes(json.dumps({**SPEC_JSON, "settings": {"backends": {"foo": "host"}}}).encode())
+        self.assertEqual(s.settings.backend_for("foo"), BACKEND_HOST)
+        self.assertEqual(s.settings.backend_for("bar"), BACKEND_DOCKER)
+        self.assertEqual(spec_to_json(s)["settings"], {"backends": {"foo": "host"}})
+        self.assertIsNone(spec_parser.parse_spec_bytes(json.dumps(SPEC_JSON).encode()).settings)
+        with self.assertRaises(ValidationError):
+            spec_parser.parse_spec({**SPEC_JSON, "settings": {"backends": {"foo": "vm"}}})
+
+    def test_tmpfs_size(self):
+        tmpfs_json = json.loads(json.dumps(SPEC_JSON))
+        tmpfs_json["actions"][1]["exec"]["tmpfs_size"] = 2**20
+        s = spec_parser.parse_spec_bytes(json.dumps(tmpfs_json).encode())
+        self.assertEqual(s.actions[1].tmpfs_size, 2**20)
+        self.assertEqual(action_to_json(s.actions[1])["exec"]["tmpfs_size"], 2**20)
+        self.assertIsNone(spec_parser.parse_spec_bytes(json.dumps(SPEC_JSON).encode()).actions[1].tmpfs_size)
+        tmpfs_json["actions"][1]["exec"]["tmpfs_size"] = 0
+        with self.assertRaises(ValidationError):
+            spec_parser.parse_spec(tmpfs_json)
+
+    def test_invalid_spec(self):
+        with self.assertRaises(ValidationError):
+            spec_parser.parse_spec_bytes(json.dumps({"spec_version": "1.0"}).encode())
+        with self.assertRaises(ValidationError):
+            spec_parser.parse_spec({"spec_version": "1.0"})
+
+    def test_validated_document_is_not_validated_again(self):
+        data = json.dumps(SPEC_JSON).encode()
+        with mock.patch.object(spec_parser, 'validate', wraps=spec_parser.validate) as validate:
+            spec_parser.parse_spec_bytes(data)
+            spec_parser.parse_spec_bytes(data)
+            self.assertEqual(validate.call_count, 1)
+            spec_parser.parse_spec_bytes(data + b" ")
+            self.assertEqual(validate.call_count, 2)
+
+    def test_validated_hashes_are_persisted(self):
+        data = json.dumps(SPEC_JSON).encode()
+        with tempfile.TemporaryDirectory() as tmp:
+            memo_path = Path(tmp) / "validated-specs.json"
+            spec_parser.enable_validated_specs_memo(memo_path)
+            spec_parser.parse_spec_bytes(data)
+            spec_parser.validated_specs.save()
+            spec_parser.enable_validated_specs_memo(memo_path)
+            with mock.patch.object(spec_parser, 'validate') as validate:
+                spec_parser.parse_spec_bytes(data)
+                validate.assert_not_called()
+
+    def test_stream_parse_validates_every_action(self):
+        invalid = dict(SPEC_JSON, actions=SPEC_JSON["actions"] + [{"pull_image": {}}])
+        with self.assertRaises(ValidationError):
+            spec_parser.parse_spec_bytes(json.dumps(invalid).encode())
+        without_actions = {"spec_version": "1.0"}
+        with self.assertRaises(ValidationError):
+            spec_parser.parse_spec_bytes(json.dumps(without_actions).encode())
+
+    def test_parse_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "spec.json"
+            path.write_text(json.dumps(dict(SPEC_JSON, description="from file")))
+            s = spec_parser.parse_spec_file(path)
+        self.assertEqual(s.description, "from file")
+        self.assertEqual(len(s.actions), 2)
@@ -0,0 +1,167 @@
+import io
+import socket
+import subprocess
+import tarfile
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from streams import FanOutWriter, ChainedFileSource, socket_sender, socket_receiver, exchange_stdio, \
+    exchange_process_stdio, extract_file, FRAME_HEADER
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_fan_out_commit(self):
+        a = self.root / "a"
+        b = self.root / "b"
+        a.write_bytes(b"old")
+        writer = FanOutWriter([a, b], tail_size=4)
+        writer.write(b"hello ")
+        writer.write(b"world")
+        # destinations are replaced only on commit
+        self.assertEqual(a.read_bytes(), b"old")
+        self.assertFalse(b.exists())
+        writer.commit()
+        self.assertEqual(a.read_bytes(), b"hello world")
+        self.assertEqual(b.read_bytes(), b"hello world")
+        self.assertEqual(writer.length, 11)
+        self.assertEqual(writer.getvalue(), b"orld")
+        self.assertEqual(sorted(p.name for p in self.root.iterdir()), ["a", "b"])
+
+    def test_abort_leaves_destinations_intact(self):
+        a = self.root / "a"
+        a.write_bytes(b"old")
+        writer = FanOutWriter([a], capture=True)
+        writer.write(b"new")
+        writer.abort()
+        self.assertEqual(a.read_bytes(), b"old")
+        self.assertEqual(writer.getvalue(), b"new")
+        self.assertEqual([p.name for p in self.root.iterdir()], ["a"])
+
+    def test_chained_source_sends_files_in_order_and_half_closes(self):
+        a = self.root / "a"
+        b = self.root / "b"
+        a.write_bytes(b"first,")
+        b.write_bytes(b"second")
+        sender_sock, receiver_sock = socket.socketpair()
+        with sender_sock, receiver_sock:
+            socket_sender(sender_sock, ChainedFileSource([a, b]))
+            received = b""
+            while chunk := receiver_sock.recv(1024):
+                received += chunk
+        self.assertEqual(received, b"first,second")
+
+    def test_missing_source_file_fails_early(self):
+        with self.assertRaises(FileNotFoundError):
+            ChainedFileSource([self.root / "missing"])
+
+    def test_sender_half_closes_on_failure(self):
+        a = self.root / "a"
+        a.write_bytes(b"a")
+        source = ChainedFileSource([a, a])
+        # removed after the source was created
+        source.paths.append(self.root / "missing")
+        sender_sock, receiver_sock = socket.socketpair()
+        received = []
+
+        def container():
+            # exits once stdin is closed, rather than waiting for more input forever
+            while chunk := receiver_sock.recv(1024):
+                received.append(chunk)
+            receiver_sock.shutdown(socket.SHUT_WR)
+
+        with sender_sock, receiver_sock:
+            container_thread = threading.Thread(target=container)
+            container_thread.start()
+            with self.assertRaises(FileNotFoundError):
+                exchange_stdio(sender_sock, source, FanOutWriter([]), FanOutWriter([]))
+            container_thread.join()
+        self.assertEqual(b"".join(received), b"aa")
+
+    def test_receiver_demultiplexes_frames(self):
+        out = self.root / "out"
+        stdout_writer = FanOutWriter([out])
+        stderr_writer = FanOutWriter([], capture=True)
+        sender_sock, receiver_sock = socket.socketpair()
+
+        def send_frames():
+            for (stream, payload) in [(1, b"out1,"), (2, b"err"), (1, b"x" * 200000)]:
+                sender_sock.sendall(FRAME_HEADER.pack(stream, len(payload)) + payload)
+            sender_sock.shutdown(socket.SHUT_WR)
+
+        with sender_sock, receiver_sock:
+            sender_thread = threading.Thread(target=send_frames)
+            sender_thread.start()
+            socket_receiver(receiver_sock, stdout_writer, stderr_writer)
+            sender_thread.join()
+        stdout_writer.commit()
+        self.assertEqual(out.read_bytes(), b"out1," + b"x" * 200000)
+        self.assertEqual(stderr_writer.getvalue(), b"err")
+
+    def test_truncated_stream_is_not_committed(self):
+        out = self.root / "out"
+        stdout_writer = FanOutWriter([out])
+        stderr_writer = FanOutWriter([], capture=True)
+        sender_sock, receiver_sock = socket.socketpair()
+
+        def container():
+            receiver_sock.sendall(FRAME_HEADER.pack(1, 4) + b"full")
+            # the stream ends in the middle of a frame
+            receiver_sock.sendall(FRAME_HEADER.pack(1, 100) + b"part")
+            receiver_sock.shutdown(socket.SHUT_WR)
+
+        with sender_sock, receiver_sock:
+            container_thread = threading.Thread(target=container)
+            container_thread.start()
+            with self.assertRaises(ConnectionError):
+                exchange_stdio(sender_sock, ChainedFileSource([]), stdout_writer, stderr_writer)
+            container_thread.join()
+        stdout_writer.commit()
+        self.assertFalse(out.exists())
+        self.assertEqual(list(self.root.iterdir()), [])
+
+    def test_failed_writer_stops_process(self):
+        class FullDisk(FanOutWriter):
+            def write(self, data):
+                raise OSError(28, "No space left on device")
+
+        out = self.root / "out"
+        stdout_writer = FullDisk([out])
+        # would block on its full stdout pipe, if it was not killed
+        process = subprocess.Popen(["yes"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, bufsize=0)
+        with process:
+            with self.assertRaises(OSError):
+                exchange_process_stdio(process, ChainedFileSource([]), stdout_writer, FanOutWriter([]))
+        self.assertNotEqual(process.returncode, 0)
+        self.assertEqual(list(self.root.iterdir()), [])
+
+    def test_extract_file_from_chunked_archive(self):
+        content = bytes(range(256)) * 1000
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode="w") as archive:
+            info = tarfile.TarInfo("out.bin")
+            info.size = len(content)
+            info.mode = 0o640
+            archive.addfile(info, io.BytesIO(content))
+        archive_bytes = data.getvalue()
+        # chunks not aligned to tar blocks
+        chunks = [archive_bytes[i:i + 7000] for i in range(0, len(archive_bytes), 7000)]
+        dst = self.root / "sub" / "out.bin"
+        self.assertTrue(extract_file(iter(chunks), dst))
+        self.assertEqual(dst.read_bytes(), content)
+        self.assertEqual(dst.stat().st_mode & 0o777, 0o640)
+        # an archive of a dir
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode="w") as archive:
+            archive.add(self.root / "sub", arcname="sub")
+        self.assertFalse(extract_file([data.getvalue()], self.root / "dir"))
+        self.assertFalse((self.root / "dir").exists())
@@ -0,0 +1,37 @@
+import json
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from tracing import Tracer
+
+
+class TracerTest(unittest.TestCase):
+    def test_spans_of_threads(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            trace_path = Path(tmp) / "trace.json"
+            tracer = Tracer(trace_path)
+            with tracer.span("outer", actions=2):
+                worker = threading.Thread(target=self.run_span, args=(tracer,), name="mnb-worker_0")
+                worker.start()
+                worker.join()
+            tracer.save()
+            trace = json.loads(trace_path.read_text())
+        spans = {event["name"]: event for event in trace["traceEvents"] if event["ph"] == "X"}
+        self.assertEqual(spans["outer"]["args"], {"actions": "2"})
+        self.assertNotEqual(spans["outer"]["tid"], spans["inner"]["tid"])
+        self.assertGreaterEqual(spans["inner"]["ts"], spans["outer"]["ts"])
+        thread_names = {event["args"]["name"] for event in trace["traceEvents"] if event["ph"] == "M"}
+        self.assertIn("mnb-worker_0", thread_names)
+
+    def run_span(self, tracer):
+        with tracer.span("inner"):
+            pass
+
+    def test_disabled(self):
+        tracer = Tracer(None)
+        with tracer.span("ignored"):
+            pass
+        tracer.save()
+        self.assertEqual(tracer.events, [])
@@ -0,0 +1,48 @@
+import tempfile
+import unittest
+from pathlib import Path, PurePosixPath
+from unittest import mock
+
+from scratch import ScratchAllocator
+from warm_pool import WarmContainer, WarmContainerPool
+
+
+class WarmContainerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = Path(self.tmp_dir.name)
+        self.scratch = ScratchAllocator(root, root)
+        self.client = mock.Mock()
+        self.client.images.get.return_value.attrs = {'Config': {}}
+        self.client.api.exec_create.return_value = {'Id': "reset"}
+        self.client.api.exec_inspect.return_value = {'Running': False, 'ExitCode': 0}
+        self.pool = WarmContainerPool(lambda: self.client, self.scratch, PurePosixPath("/mnb/run"))
+
+    def tearDown(self):
+        self.pool.close()
+        self.scratch.close()
+        self.tmp_dir.cleanup()
+
+    def test_container_is_reused(self):
+        with self.pool.lease("foo") as first:
+            pass
+        with self.pool.lease("foo") as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(self.client.containers.create.call_count, 1)
+
+    def test_container_failing_release_is_removed(self):
+        with mock.patch.object(WarmContainer, 'clean_scratch_dir', side_effect=OSError("busy")):
+            with self.assertRaises(OSError):
+                with self.pool.lease("foo") as warm_container:
+                    pass
+        self.assertEqual(self.pool.all, [])
+        self.assertEqual(self.pool.idle, {})
+        warm_container.container.remove.assert_called_once_with(force=True)
+
+    def test_container_failing_reset_is_removed(self):
+        self.client.api.exec_inspect.return_value = {'Running': False, 'ExitCode': 1}
+        with self.pool.lease("foo") as warm_container:
+            pass
+        self.assertEqual(self.pool.all, [])
+        warm_container.container.remove.assert_called_once_with(force=True)
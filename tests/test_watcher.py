@@ -0,0 +1,55 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from executor import requires_regeneration
+from watcher import InotifyWatcher, PollingWatcher
+
+
+class WatcherTest(unittest.TestCase):
+    def check_watcher(self, watcher_class):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            (root / "src" / "sub").mkdir(parents=True)
+            (root / ".mnb").mkdir()
+            watcher = watcher_class(root, dirs=["."], recursive_dirs=["src"])
+            try:
+                def modify():
+                    (root / "a.txt").write_text("a")
+                    (root / "src" / "sub" / "b.txt").write_text("b")
+                    (root / ".mnb" / "ignored").write_text("c")
+                    (root / "out.mnb-tmp").write_text("d")
+                timer = threading.Timer(0.1, modify)
+                timer.start()
+                changed = watcher.wait_for_changes(0.6)
+                timer.join()
+            finally:
+                watcher.close()
+            self.assertEqual(changed, {"a.txt", "src/sub/b.txt"})
+
+    def test_inotify(self):
+        self.check_watcher(InotifyWatcher)
+
+    def test_polling(self):
+        self.check_watcher(PollingWatcher)
+
+
+class RequiresRegenerationTest(unittest.TestCase):
+    def check(self, changed, generator_paths=frozenset({".", "mnb-plan.py"})):
+        return requires_regeneration(set(changed), "mnb.json", set(generator_paths),
+                                     source_files={"README.md", "./data/x.csv"}, source_dirs={"./docs"})
+
+    def test_plan_sources_are_not_generator_inputs(self):
+        self.assertFalse(self.check(["README.md"]))
+        self.assertFalse(self.check(["data/x.csv"]))
+        # anything within a source dir, including new files
+        self.assertFalse(self.check(["docs/a.md", "docs/new/b.md"]))
+
+    def test_other_generator_inputs(self):
+        self.assertTrue(self.check(["mnb.json"]))
+        self.assertTrue(self.check(["docs/a.md", "new.txt"]))
+        self.assertTrue(self.check(["data/y.csv"]))
+        # the generator script is a closer match than a source dir containing it
+        self.assertTrue(self.check(["docs/gen.py"], generator_paths={".", "docs/gen.py"}))
+        self.assertFalse(self.check(["new.txt"], generator_paths={"mnb-plan.py"}))